@@ -4,13 +4,38 @@ Fedora 43 Openbox Post-Install Script with Nord Aurora Theme
 Run as regular user with sudo privileges
 """
 
+import argparse
+import asyncio
+import base64
+import collections
+import errno
+import functools
 import os
+import random
+import re
+import select
+import shlex
 import sys
 import subprocess
 import shutil
+import hashlib
+import http.client
+import inspect
+import json
+import logging
+import logging.handlers
+import queue
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict
-import urllib.request
+from typing import Callable, List, Dict, Optional, Tuple
+import urllib.parse
+import xml.etree.ElementTree as ET
+import zipfile
 
 # Colors for terminal output
 class Colors:
@@ -20,104 +45,2034 @@ class Colors:
     BLUE = '\033[0;34m'
     NC = '\033[0m'
 
+# Downloads and other reusable artifacts, can point at a directory shared between machines
+CACHE_DIR = Path(os.environ.get('OPENBOX_SETUP_CACHE', Path.home() / '.cache' / 'openbox-setup'))
+
+# Steps run concurrently, keep their output lines from interleaving
+_print_lock = threading.Lock()
+
+# Whether the last thing on the terminal is a live command output line
+_progress_shown = False
+
 def print_status(message: str, color: str = Colors.GREEN):
     """Print colored status message"""
-    print(f"{color}{message}{Colors.NC}")
+    global _progress_shown
+    with _print_lock:
+        if _progress_shown:
+            sys.stdout.write('\r\033[K')
+            _progress_shown = False
+        print(f"{color}{message}{Colors.NC}")
+
+def show_progress(label: str, line: str):
+    """Replace the live output line on a terminal with the latest line of a command"""
+    global _progress_shown
+    if not sys.stdout.isatty():
+        return
+    width = shutil.get_terminal_size().columns - 4
+    text = f"{label}: {line.strip()}"[:width]
+    with _print_lock:
+        sys.stdout.write(f"\r\033[K  {Colors.BLUE}{text}{Colors.NC}")
+        sys.stdout.flush()
+        _progress_shown = True
+
+# Outputs and trace span of the step running on this thread
+_step_context = threading.local()
+
+class Tracer:
+    """Timed spans for steps and commands, saved as JSON lines and a Chrome trace"""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+        self._threads = {}
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        """Time the block, yields the span's args dict for results like exit codes"""
+        thread = threading.current_thread()
+        started = time.time()
+        try:
+            yield args
+        finally:
+            ended = time.time()
+            with self._lock:
+                tid = self._threads.setdefault(thread.ident, (len(self._threads) + 1, thread.name))[0]
+                self.spans.append({'name': name, 'cat': category, 'start': started, 'end': ended,
+                                   'tid': tid, 'args': args})
+
+    def write(self, directory: Path) -> Tuple[Path, Path]:
+        """Write <run>.jsonl and <run>.trace.json (chrome://tracing, Perfetto) to directory"""
+        directory.mkdir(parents=True, exist_ok=True)
+        host = socket.gethostname()
+        stem = directory / f"{host}-{time.strftime('%Y%m%d-%H%M%S')}"
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start'])
+            threads = dict(self._threads)
+        
+        jsonl = stem.with_suffix('.jsonl')
+        with open(jsonl, 'w') as f:
+            for span in spans:
+                f.write(json.dumps({'host': host, **span, 'duration': span['end'] - span['start']}) + '\n')
+        
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                  for tid, name in threads.values()]
+        events += [{'name': span['name'], 'cat': span['cat'], 'ph': 'X', 'pid': pid, 'tid': span['tid'],
+                    'ts': int(span['start'] * 1e6), 'dur': int((span['end'] - span['start']) * 1e6),
+                    'args': span['args']} for span in spans]
+        trace = stem.with_suffix('.trace.json')
+        trace.write_text(json.dumps({'traceEvents': events, 'otherData': {'host': host}}))
+        return jsonl, trace
+
+TRACE = Tracer()
+
+def count_in_step(key: str, amount: int):
+    """Add amount to a counter on the span of the step running on this thread"""
+    span = getattr(_step_context, 'span', None)
+    if span is not None:
+        span[key] = span.get(key, 0) + amount
+
+class CommandStats:
+    """Resource usage of one finished command"""
+
+    def __init__(self, cmd: str, returncode: int, wall: float, cpu: float, max_rss_kb: int):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.wall = wall
+        self.cpu = cpu
+        self.max_rss_kb = max_rss_kb
+
+COMMAND_STATS: List[CommandStats] = []
+
+# Full output of every command, rotated so long-lived machines don't fill the disk
+LOG_DIR = CACHE_DIR / 'logs'
+_command_log = None
+_command_log_lock = threading.Lock()
+
+def command_log() -> logging.Logger:
+    """Logger writing command output to a rotating file"""
+    global _command_log
+    with _command_log_lock:
+        if _command_log is None:
+            LOG_DIR.mkdir(parents=True, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(LOG_DIR / 'commands.log', maxBytes=10 << 20,
+                                                           backupCount=5)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            _command_log = logging.getLogger('openbox-setup.commands')
+            _command_log.setLevel(logging.INFO)
+            _command_log.propagate = False
+            _command_log.addHandler(handler)
+        return _command_log
+
+# Commands running right now, so cancel_commands() can stop them
+_running = set()
+_running_lock = threading.Lock()
+CANCELLED = threading.Event()
+
+def _stop(proc: subprocess.Popen, grace: float = 5):
+    """Terminate proc, kill it if it ignores SIGTERM"""
+    proc.terminate()
+    
+    def kill():
+        with _running_lock:
+            if proc in _running:
+                proc.kill()
+    
+    timer = threading.Timer(grace, kill)
+    timer.daemon = True
+    timer.start()
+
+def cancel_commands():
+    """Stop every running command and refuse to start new ones"""
+    CANCELLED.set()
+    with _running_lock:
+        running = list(_running)
+    for proc in running:
+        _stop(proc)
+    if BROKER:
+        BROKER.cancel()
+
+class RetryBudget:
+    """Retries left for the whole run, shared so an outage can't turn into a storm of retries"""
+
+    def __init__(self, retries: int):
+        self.left = retries
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+RETRY_BUDGET = RetryBudget(30)
+
+# Retries and seconds waited per kind of operation, for the run summary
+RETRY_STATS: Dict[str, List[float]] = collections.defaultdict(lambda: [0, 0.0])
+
+class RetryPolicy:
+    """Exponential backoff with full jitter for transient failures
+
+    Retry n waits a random time between 0 and min(cap, base * 2**n)
+    seconds, so machines that failed together against the same mirror
+    don't come back together, but never less than a server's Retry-After
+    asks for. Retrying stops after attempts tries, once the step has used
+    per_step retries or when the shared budget is spent.
+    """
+
+    def __init__(self, attempts: int = 5, base: float = 2.0, cap: float = 60.0, per_step: int = 8,
+                 budget: RetryBudget = RETRY_BUDGET):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.per_step = per_step
+        self.budget = budget
+
+    def wait(self, attempt: int, label: str, retry_after: Optional[float] = None) -> bool:
+        """Sleep before retry number attempt + 1, False when there must be no retry"""
+        span = getattr(_step_context, 'span', None)
+        if attempt + 1 >= self.attempts or (span or {}).get('retries', 0) >= self.per_step:
+            return False
+        if not self.budget.take():
+            print_status("Retry budget for this run is spent, not retrying", Colors.YELLOW)
+            return False
+        
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.cap))
+        print_status(f"Transient {label} failure, retry {attempt + 1} in {delay:.1f}s", Colors.YELLOW)
+        count_in_step('retries', 1)
+        with _print_lock:
+            RETRY_STATS[label][0] += 1
+            RETRY_STATS[label][1] += delay
+        return not CANCELLED.wait(delay)
+
+# For dnf, git and downloads
+NETWORK_RETRY = RetryPolicy()
+
+# Output of dnf and git failures that a later attempt can get past
+TRANSIENT_OUTPUT = re.compile(
+    r'Could not resolve host|Temporary failure in name resolution|Connection (timed out|reset|refused)'
+    r'|Timeout was reached|Operation timed out|Curl error|Failed to download|Cannot download'
+    r'|No more mirrors to try|Status code: (408|429|5\d\d)|The requested URL returned error: (408|429|5\d\d)'
+    r'|early EOF|RPC failed|remote end hung up unexpectedly|gnutls_handshake|SSL_read|unexpected disconnect',
+    re.IGNORECASE)
+
+def print_retry_stats():
+    """Print how often operations were retried"""
+    if not RETRY_STATS:
+        return
+    print_status("Retries:", Colors.YELLOW)
+    for label, (count, waited) in sorted(RETRY_STATS.items()):
+        print(f"  {label:<12} {count:3d} retries, {waited:6.1f}s waiting")
+    print(f"  {RETRY_BUDGET.left} retries left in the run's budget")
+    print()
 
-def run_command(cmd: List[str], check: bool = True, shell: bool = False) -> subprocess.CompletedProcess:
-    """Run shell command with error handling"""
-    try:
-        if shell:
-            result = subprocess.run(cmd, shell=True, check=check, capture_output=True, text=True)
+class CommandError(Exception):
+    """A checked command failed, fails the step that ran it"""
+
+    def __init__(self, display: str, returncode: int, reason: str):
+        super().__init__(f"{display} ({reason})")
+        self.returncode = returncode
+
+def run_command(cmd: List[str], check: bool = True, shell: bool = False,
+                cwd: Optional[Path] = None, env: Optional[Dict[str, str]] = None,
+                capture: bool = False, timeout: Optional[float] = None,
+                retry: Optional[RetryPolicy] = None) -> subprocess.CompletedProcess:
+    """Run shell command with error handling, streaming its output to the command log
+
+    env entries are added to the environment. Only the last lines of output
+    are kept in the result unless capture is set. A command running longer
+    than timeout seconds is stopped and counts as failed. sudo commands go
+    to the privileged broker once main() enabled it. With a retry policy,
+    failures that timed out or whose output looks like a network problem
+    are retried. A failure raises CommandError if check is set.
+    """
+    display = ' '.join(cmd) if isinstance(cmd, list) else cmd
+    argv = cmd if isinstance(cmd, list) else cmd.split()
+    label = os.path.basename(argv[1] if argv[0] == 'sudo' and len(argv) > 1 else argv[0])
+    if env is not None:
+        env = {**os.environ, **env}
+    if CANCELLED.is_set():
+        print_status(f"Cancelled before start: {display}", Colors.RED)
+        raise CommandError(display, -1, "cancelled")
+    
+    attempt = 0
+    while True:
+        with TRACE.span(label, 'command', cmd=display, attempt=attempt) as span:
+            if isinstance(cmd, list) and cmd[0] == 'sudo' and privileged_broker():
+                result = _run_brokered(cmd, display, label, cwd, capture, timeout, span)
+            else:
+                result = _run_streaming(cmd, display, label, shell, cwd, env, capture, timeout, span)
+        transient = span.get('timed_out') or TRANSIENT_OUTPUT.search(result.stdout + result.stderr)
+        if result.returncode == 0 or not retry or not transient or CANCELLED.is_set():
+            break
+        if not retry.wait(attempt, label):
+            break
+        attempt += 1
+    
+    if result.returncode != 0:
+        if span.get('timed_out'):
+            reason = f"timed out after {timeout}s"
+        elif CANCELLED.is_set():
+            reason = "cancelled"
         else:
-            result = subprocess.run(cmd, check=check, capture_output=True, text=True)
-        return result
-    except subprocess.CalledProcessError as e:
-        print_status(f"Error running command: {' '.join(cmd) if isinstance(cmd, list) else cmd}", Colors.RED)
-        print_status(f"Error message: {e.stderr}", Colors.RED)
+            reason = f"exit code {result.returncode}"
+        print_status(f"Error running command ({reason}): {display}", Colors.RED)
+        print_status(f"Error message: {result.stderr}", Colors.RED)
         if check:
-            sys.exit(1)
-        return e
+            raise CommandError(display, result.returncode, reason)
+    return result
+
+def _run_streaming(cmd, display: str, label: str, shell: bool, cwd: Optional[Path], env: Optional[Dict[str, str]],
+                   capture: bool, timeout: Optional[float], span: Dict) -> subprocess.CompletedProcess:
+    """Run cmd, tee its output to the command log and note exit code and usage in span"""
+    log = command_log()
+    started = time.monotonic()
+    proc = subprocess.Popen(cmd, shell=shell, cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace')
+    with _running_lock:
+        _running.add(proc)
+    log.info(f"[{proc.pid}] $ {display}")
+    
+    output = {'stdout': [] if capture else collections.deque(maxlen=50),
+              'stderr': [] if capture else collections.deque(maxlen=50)}
+    
+    def pump(name: str, stream):
+        for line in stream:
+            output[name].append(line)
+            log.info(f"[{proc.pid}] {line.rstrip()}")
+            show_progress(label, line)
+    
+    readers = [threading.Thread(target=pump, args=('stdout', proc.stdout), daemon=True),
+               threading.Thread(target=pump, args=('stderr', proc.stderr), daemon=True)]
+    for reader in readers:
+        reader.start()
+    
+    timed_out = threading.Event()
+    
+    def expire():
+        timed_out.set()
+        _stop(proc)
+    
+    timer = threading.Timer(timeout, expire) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    
+    # wait4 instead of Popen.wait to get the child's CPU time and peak RSS
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if timer:
+        timer.cancel()
+    with _running_lock:
+        _running.discard(proc)
+    for reader in readers:
+        # Daemons started by the command can hold the pipes open
+        reader.join(timeout=5)
+    
+    stats = CommandStats(display, proc.returncode, time.monotonic() - started,
+                         usage.ru_utime + usage.ru_stime, usage.ru_maxrss)
+    COMMAND_STATS.append(stats)
+    log.info(f"[{proc.pid}] exit {stats.returncode} wall {stats.wall:.2f}s cpu {stats.cpu:.2f}s "
+             f"maxrss {stats.max_rss_kb}KiB")
+    span.update(exit_code=stats.returncode, cpu=round(stats.cpu, 3), max_rss_kb=stats.max_rss_kb)
+    if timed_out.is_set():
+        span['timed_out'] = True
+    
+    return subprocess.CompletedProcess(cmd, proc.returncode, ''.join(output['stdout']), ''.join(output['stderr']))
+
+def _run_brokered(cmd: List[str], display: str, label: str, cwd: Optional[Path], capture: bool,
+                  timeout: Optional[float], span: Dict) -> subprocess.CompletedProcess:
+    """Run a sudo command in the privileged broker, logging its output like _run_streaming"""
+    log = command_log()
+    started = time.monotonic()
+    log.info(f"[broker] $ {display}")
+    
+    output = {'stdout': [] if capture else collections.deque(maxlen=50),
+              'stderr': [] if capture else collections.deque(maxlen=50)}
+    
+    def on_line(name: str, line: str):
+        output[name].append(line)
+        log.info(f"[broker] {line.rstrip()}")
+        show_progress(label, line)
+    
+    timed_out = threading.Event()
+    
+    def expire():
+        timed_out.set()
+        BROKER.cancel()
+    
+    timer = threading.Timer(timeout, expire) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    reply = BROKER.request({'op': 'run', 'argv': cmd[1:], 'cwd': str(cwd) if cwd else None}, on_line)
+    if timer:
+        timer.cancel()
+    if 'error' in reply:
+        output['stderr'].append(reply['error'])
+    
+    result = reply.get('done', {'returncode': 1, 'cpu': 0, 'max_rss_kb': 0})
+    stats = CommandStats(display, result['returncode'], time.monotonic() - started, result['cpu'],
+                         result['max_rss_kb'])
+    COMMAND_STATS.append(stats)
+    log.info(f"[broker] exit {stats.returncode} wall {stats.wall:.2f}s cpu {stats.cpu:.2f}s "
+             f"maxrss {stats.max_rss_kb}KiB")
+    span.update(exit_code=stats.returncode, cpu=round(stats.cpu, 3), max_rss_kb=stats.max_rss_kb, broker=True)
+    if timed_out.is_set():
+        span['timed_out'] = True
+    
+    return subprocess.CompletedProcess(cmd, stats.returncode, ''.join(output['stdout']), ''.join(output['stderr']))
+
+# Programs the broker runs as root, everything else it refuses
+BROKER_PROGRAMS = {'dnf', 'tar'}
+
+# Where the broker looks them up, like sudo's secure_path, whatever PATH it inherited
+BROKER_PATH = '/usr/sbin:/usr/bin:/sbin:/bin'
+
+class PrivilegedBroker:
+    """Root helper started with a single sudo and kept for the whole run
+
+    Requests are JSON lines {"id", "op", ...}. op is run (argv of one of
+    BROKER_PROGRAMS by bare name, found on BROKER_PATH), place_file (path, base64 data, mode, owner) or batch
+    (a list of ops run in order until one fails). Replies stream a command's
+    output lines and end with a done or error message for the request.
+    Commands run with the broker's environment, like sudo's env_reset.
+    """
+
+    def __init__(self, command: List[str]):
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._next_id = 0
+        hello = self.proc.stdout.readline()
+        if not hello:
+            raise RuntimeError("The privileged helper failed to start")
+
+    def _send(self, message: Dict):
+        with self._write_lock:
+            self.proc.stdin.write(json.dumps(message) + '\n')
+            self.proc.stdin.flush()
+
+    def request(self, message: Dict, on_line: Optional[Callable[[str, str], None]] = None) -> Dict:
+        """Send one request and wait for its final reply, one request at a time"""
+        with self._lock:
+            self._next_id += 1
+            self._send({**message, 'id': self._next_id})
+            for line in self.proc.stdout:
+                reply = json.loads(line)
+                if 'stream' in reply:
+                    if on_line:
+                        on_line(reply['stream'], reply['line'])
+                    continue
+                return reply
+        raise RuntimeError("The privileged helper exited")
+
+    def place_files(self, files: List[Tuple[Path, bytes, int]]) -> Dict:
+        """Atomically write (path, data, mode) files owned by root, in one round trip"""
+        return self.request({'op': 'batch', 'ops': [
+            {'op': 'place_file', 'path': str(path), 'data': base64.b64encode(data).decode(), 'mode': mode,
+             'owner': [0, 0]}
+            for path, data, mode in files]})
+
+    def cancel(self):
+        """Stop the command the broker is running"""
+        try:
+            self._send({'op': 'cancel'})
+        except (OSError, ValueError):
+            pass
+
+    def close(self, timeout: float = 10):
+        """Let the broker exit, terminating it (sudo relays the signal) if it doesn't in time"""
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.terminate()
+            self.proc.wait()
+
+# Broker for the current run, started by the first root operation once main() enabled it
+BROKER: Optional[PrivilegedBroker] = None
+_broker_enabled = False
+_broker_lock = threading.Lock()
+
+def enable_broker():
+    """Send root work to the broker from now on, without elevating yet"""
+    global _broker_enabled
+    _broker_enabled = True
+
+def privileged_broker() -> Optional[PrivilegedBroker]:
+    """The run's broker, elevating once on first use so runs that need no root never ask for sudo"""
+    global BROKER
+    with _broker_lock:
+        if BROKER is None and _broker_enabled and not CANCELLED.is_set():
+            print_status("Starting privileged helper...", Colors.YELLOW)
+            BROKER = PrivilegedBroker(['sudo', sys.executable, os.path.abspath(__file__), 'broker'])
+        return BROKER
+
+def stop_broker():
+    global BROKER, _broker_enabled
+    with _broker_lock:
+        _broker_enabled = False
+        if BROKER:
+            BROKER.close()
+            BROKER = None
+
+def serve_broker(root: Optional[Path] = None, path: str = BROKER_PATH):
+    """Broker side: execute requests from stdin, under root instead of / and with programs from path (for tests)"""
+    out_lock = threading.Lock()
+    requests = queue.Queue()
+    current = {}
+    
+    def send(message: Dict):
+        with out_lock:
+            sys.stdout.write(json.dumps(message) + '\n')
+            sys.stdout.flush()
+    
+    def read_requests():
+        for line in sys.stdin:
+            message = json.loads(line)
+            if message['op'] == 'cancel':
+                proc = current.get('proc')
+                if proc:
+                    proc.terminate()
+            else:
+                requests.put(message)
+        requests.put(None)
+    
+    def run(op: Dict, request_id: int) -> Dict:
+        name = op['argv'][0]
+        if '/' in name or name not in BROKER_PROGRAMS:
+            raise PermissionError(f"{name} is not run by the privileged helper")
+        program = shutil.which(name, path=path)
+        if not program:
+            raise FileNotFoundError(f"{name} is not installed")
+        proc = subprocess.Popen([program, *op['argv'][1:]], cwd=op.get('cwd'), env={**os.environ, 'PATH': path},
+                                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                errors='replace')
+        current['proc'] = proc
+        
+        def pump(name: str, stream):
+            for line in stream:
+                send({'id': request_id, 'stream': name, 'line': line})
+        
+        readers = [threading.Thread(target=pump, args=('stdout', proc.stdout), daemon=True),
+                   threading.Thread(target=pump, args=('stderr', proc.stderr), daemon=True)]
+        for reader in readers:
+            reader.start()
+        _, status, usage = os.wait4(proc.pid, 0)
+        current.pop('proc', None)
+        for reader in readers:
+            reader.join(timeout=5)
+        return {'returncode': os.waitstatus_to_exitcode(status), 'cpu': usage.ru_utime + usage.ru_stime,
+                'max_rss_kb': usage.ru_maxrss}
+    
+    def place_file(op: Dict) -> Dict:
+        path = Path(op['path'])
+        if root:
+            path = root / path.relative_to('/')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(base64.b64decode(op['data']))
+                os.fchmod(f.fileno(), op['mode'])
+                if os.geteuid() == 0:
+                    os.fchown(f.fileno(), *op['owner'])
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return {'returncode': 0, 'cpu': 0, 'max_rss_kb': 0}
+    
+    def execute(op: Dict, request_id: int) -> Dict:
+        if op['op'] == 'run':
+            return run(op, request_id)
+        if op['op'] == 'place_file':
+            return place_file(op)
+        if op['op'] == 'batch':
+            results = []
+            for sub in op['ops']:
+                results.append(execute(sub, request_id))
+                if results[-1]['returncode']:
+                    break
+            return {**(results[-1] if results else {'returncode': 0, 'cpu': 0, 'max_rss_kb': 0}),
+                    'results': results}
+        raise ValueError(f"Unknown operation {op['op']}")
+    
+    threading.Thread(target=read_requests, daemon=True).start()
+    send({'ready': os.getpid()})
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        try:
+            send({'id': message['id'], 'done': execute(message, message['id'])})
+        except Exception as e:
+            send({'id': message['id'], 'error': f"{type(e).__name__}: {e}"})
+
+async def run_command_async(cmd: List[str], **kwargs) -> subprocess.CompletedProcess:
+    """run_command for asyncio callers, commands awaited together run concurrently"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(run_command, cmd, **kwargs))
+
+def print_command_stats(limit: int = 5):
+    """Print the commands that took longest"""
+    if not COMMAND_STATS:
+        return
+    print_status("Slowest commands:", Colors.YELLOW)
+    for stats in sorted(COMMAND_STATS, key=lambda c: c.wall, reverse=True)[:limit]:
+        print(f"  {stats.wall:7.1f}s wall {stats.cpu:7.1f}s cpu {stats.max_rss_kb // 1024:6d} MiB  "
+              f"{stats.cmd[:60]}")
+    print(f"  Full output: {LOG_DIR / 'commands.log'}")
+    print()
 
 def create_directory(path: Path):
     """Create directory if it doesn't exist"""
     path.mkdir(parents=True, exist_ok=True)
     print_status(f"Created directory: {path}", Colors.BLUE)
 
-def write_file(path: Path, content: str):
-    """Write content to file"""
+# Mode for new files, read once because os.umask() can only be queried by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def record_output(path: Path, digest: Optional[str]):
+    """Note an output of the current step for the step journal, None for one it failed to produce"""
+    outputs = getattr(_step_context, 'outputs', None)
+    if outputs is not None:
+        outputs[str(path)] = digest
+
+class Manifest:
+    """SHA-256 of every file the script manages, persisted between runs"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            self.files = json.loads(path.read_text())
+        except (OSError, ValueError):
+            self.files = {}
+
+    def record(self, path: Path, digest: str):
+        record_output(path, digest)
+        with self._lock:
+            self.files[str(path)] = digest
+
+    def save(self):
+        """Write the manifest atomically"""
+        with self._lock:
+            write_json_atomic(self.path, self.files)
+
+MANIFEST = Manifest(CACHE_DIR / 'manifest.json')
+
+STAT_INDEX_FORMAT = 1
+
+# Timestamp granularity assumed for the filesystem, 1 s and coarser exist on NFS
+STAT_GRANULARITY_NS = 2 * 10**9
+
+class StatIndex:
+    """Content hashes of files keyed by their stat data, like git's index
+
+    A file whose size, mtime, ctime and inode match its entry is taken to
+    still hold the hashed content, so only files touched since are read.
+    An entry modified within STAT_GRANULARITY_NS of when the index was
+    written is racy, a later write in the same tick keeps the same stat
+    data, and is hashed again until the index is rewritten after it.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.dirty = False
+        try:
+            data = json.loads(path.read_text())
+            if data.get('format') != STAT_INDEX_FORMAT:
+                raise ValueError(path)
+            self.written_ns, self.files = data['written_ns'], data['files']
+        except (OSError, ValueError, KeyError):
+            self.written_ns, self.files = 0, {}
+
+    def digest(self, path: Path) -> Tuple[Optional[str], bool]:
+        """SHA-256 of path (None when it is missing) and whether the file had to be read"""
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            if self.files.pop(str(path), None):
+                self.dirty = True
+            return None, False
+        key = [st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino]
+        entry = self.files.get(str(path))
+        if entry and entry['stat'] == key and st.st_mtime_ns + STAT_GRANULARITY_NS < self.written_ns:
+            return entry['sha256'], False
+        
+        digest = sha256_file(path)
+        self.files[str(path)] = {'stat': key, 'sha256': digest}
+        self.dirty = True
+        return digest, True
+
+    def save(self):
+        """Write the index if any entry changed"""
+        if self.dirty:
+            self.written_ns = time.time_ns()
+            write_json_atomic(self.path, {'format': STAT_INDEX_FORMAT, 'written_ns': self.written_ns,
+                                          'files': self.files})
+            self.dirty = False
+
+STAT_INDEX = StatIndex(CACHE_DIR / 'stat-index.json')
+
+def verify_managed_files() -> bool:
+    """Compare every file in the manifest with what the script wrote, return whether none drifted"""
+    if not MANIFEST.files:
+        print_status(f"No managed files recorded in {MANIFEST.path}, run the setup first", Colors.YELLOW)
+        return False
+    
+    start = time.perf_counter()
+    drifted = hashed = 0
+    for name, expected in sorted(MANIFEST.files.items()):
+        try:
+            actual, read = STAT_INDEX.digest(Path(name))
+        except OSError as e:
+            print_status(f"Unreadable: {name} ({e.strerror})", Colors.RED)
+            drifted += 1
+            continue
+        hashed += read
+        if actual is None:
+            print_status(f"Missing:  {name}", Colors.RED)
+            drifted += 1
+        elif actual != expected:
+            print_status(f"Modified: {name}", Colors.YELLOW)
+            drifted += 1
+    STAT_INDEX.save()
+    
+    elapsed = (time.perf_counter() - start) * 1000
+    print_status(f"{len(MANIFEST.files)} managed files, {drifted} drifted, {hashed} re-hashed "
+                 f"({elapsed:.1f} ms)", Colors.GREEN if not drifted else Colors.YELLOW)
+    return not drifted
+
+def file_matches(path: Path, data: bytes) -> bool:
+    """Whether path already holds exactly data, without reading it when the size differs"""
+    try:
+        if path.stat().st_size != len(data):
+            return False
+        return hashlib.sha256(path.read_bytes()).digest() == hashlib.sha256(data).digest()
+    except OSError:
+        return False
+
+def write_file(path: Path, content: str, mode: Optional[int] = None) -> bool:
+    """Write content to file unless it is already there, return whether it changed"""
+    data = content.encode()
+    MANIFEST.record(path, hashlib.sha256(data).hexdigest())
+    
+    if file_matches(path, data):
+        if mode is not None and path.stat().st_mode & 0o7777 != mode:
+            path.chmod(mode)
+        print_status(f"Unchanged file: {path}", Colors.BLUE)
+        return False
+    
+    # Write next to the target and rename, readers never see a half-written config
+    existed = path.exists()
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(content)
-    print_status(f"Created file: {path}", Colors.BLUE)
+    if mode is None:
+        mode = path.stat().st_mode & 0o7777 if existed else 0o666 & ~_UMASK
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            os.fchmod(f.fileno(), mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    count_in_step('bytes_written', len(data))
+    print_status(f"{'Updated' if existed else 'Created'} file: {path}", Colors.BLUE)
+    return True
+
+def write_json_atomic(path: Path, data, durable: bool = False):
+    """Write data as JSON through a temporary file and rename, synced to disk first if durable"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def sha256_file(path: Path) -> str:
+    """SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections shared between download threads"""
+
+    def __init__(self, timeout: float = 30):
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        return self._new_connection(scheme, netloc)
+
+    def _new_connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        if scheme == 'http':
+            return http.client.HTTPConnection(netloc, timeout=self.timeout)
+        raise ValueError(f"Unsupported URL scheme: {scheme}")
+
+    def release(self, scheme: str, netloc: str, conn: http.client.HTTPConnection):
+        """Return a connection whose response has been fully read"""
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(conn)
+
+    def request(self, url: str, headers: Dict[str, str], max_redirects: int = 5):
+        """GET url following redirects, return (scheme, netloc, connection, response)"""
+        for _ in range(max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            
+            conn = self._connect(parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                # A pooled keep-alive connection may have been closed by the server
+                conn.close()
+                conn = self._new_connection(parts.scheme, parts.netloc)
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                location = response.getheader('Location')
+                response.read()
+                self.release(parts.scheme, parts.netloc, conn)
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return parts.scheme, parts.netloc, conn, response
+        raise OSError(f"Too many redirects: {url}")
+
+class HTTPStatusError(OSError):
+    """Server answered a download with an error status"""
+
+    def __init__(self, url: str, status: int, reason: str, retry_after: Optional[str] = None):
+        super().__init__(f"HTTP {status} {reason} for {url}")
+        self.status = status
+        self.retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+
+class ChecksumError(OSError):
+    """Downloaded content is not what was expected"""
+
+# Statuses worth asking again for: timeouts, rate limits and server-side trouble
+TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+def transient_error(error: BaseException) -> bool:
+    """Whether a download error may go away when retried"""
+    if isinstance(error, HTTPStatusError):
+        return error.status in TRANSIENT_STATUS
+    if isinstance(error, ChecksumError):
+        return False
+    if isinstance(error, socket.gaierror):
+        return error.errno == socket.EAI_AGAIN
+    return isinstance(error, (TimeoutError, ConnectionError, http.client.HTTPException)) or (
+        isinstance(error, OSError) and error.errno in (errno.ENETUNREACH, errno.EHOSTUNREACH, errno.ETIMEDOUT))
+
+def content_range_start(response: http.client.HTTPResponse) -> Optional[int]:
+    """First byte offset of a 206 response's Content-Range, None when it has none"""
+    match = re.match(r'bytes (\d+)-', response.getheader('Content-Range') or '')
+    return int(match.group(1)) if match else None
+
+class DownloadCache:
+    """Content-addressed download cache with resumable transfers
+
+    Blobs are stored as blobs/<sha256> and index.json maps each URL to the
+    digest of its blob, so a warm cache serves downloads without touching the
+    network. Interrupted transfers continue from partial/ with HTTP Range.
+    The ETag or Last-Modified of a transfer is kept next to its partial file
+    and sent as If-Range, so a file that changed upstream in between is
+    fetched from the start instead of being spliced onto the old bytes.
+    """
+
+    def __init__(self, root: Path, pool: Optional[ConnectionPool] = None):
+        self.root = root
+        self.pool = pool or ConnectionPool()
+        self._lock = threading.Lock()
+
+    def _load_index(self) -> Dict[str, str]:
+        try:
+            return json.loads((self.root / 'index.json').read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _record(self, url: str, digest: str):
+        with self._lock:
+            # Re-read so entries added by other processes sharing the cache survive
+            index = self._load_index()
+            index[url] = digest
+            write_json_atomic(self.root / 'index.json', index)
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / 'blobs' / digest
+
+    @staticmethod
+    def _validator(path: Path) -> Optional[str]:
+        """If-Range value for a partial file: its strong ETag, else its Last-Modified, None without either"""
+        try:
+            stored = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        etag = stored.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return stored.get('last_modified')
+
+    def lookup(self, url: str, sha256: Optional[str] = None) -> Optional[Path]:
+        """Cached blob for url (or for the expected digest), None on a miss"""
+        digest = sha256 or self._load_index().get(url)
+        if digest and self.blob_path(digest).exists():
+            return self.blob_path(digest)
+        return None
+
+    def fetch(self, url: str, sha256: Optional[str] = None) -> Path:
+        """Return the cached blob for url, downloading it first on a miss"""
+        cached = self.lookup(url, sha256)
+        if cached:
+            if sha256 is None or self._load_index().get(url) != sha256:
+                self._record(url, cached.name)
+            return cached
+        
+        (self.root / 'blobs').mkdir(parents=True, exist_ok=True)
+        (self.root / 'partial').mkdir(parents=True, exist_ok=True)
+        part = self.root / 'partial' / (hashlib.sha256(url.encode()).hexdigest() + '.part')
+        validators = part.with_suffix('.json')
+        
+        digest = hashlib.sha256()
+        offset = part.stat().st_size if part.exists() else 0
+        validator = self._validator(validators) if offset else None
+        headers = {'User-Agent': 'openbox-setup'}
+        if validator:
+            # If-Range makes a server whose file changed since send all of it instead of the rest
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = validator
+        else:
+            offset = 0
+        
+        scheme, netloc, conn, response = self.pool.request(rewrite_url(url), headers)
+        try:
+            if response.status == 416 and offset:
+                # Nothing left to fetch, the previous run got the whole file
+                response.read()
+                mode = None
+            elif response.status == 206 and offset and content_range_start(response) == offset:
+                mode = 'ab'
+            elif response.status == 200:
+                offset = 0
+                mode = 'wb'
+                write_json_atomic(validators, {'etag': response.getheader('ETag'),
+                                               'last_modified': response.getheader('Last-Modified')})
+            elif response.status == 206:
+                # A range that doesn't continue the partial file, start over
+                conn.close()
+                part.unlink()
+                validators.unlink(missing_ok=True)
+                return self.fetch(url, sha256)
+            else:
+                response.read()
+                raise HTTPStatusError(url, response.status, response.reason, response.getheader('Retry-After'))
+            
+            if offset:
+                with open(part, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+            if mode:
+                with open(part, mode) as f:
+                    for chunk in iter(lambda: response.read(1 << 16), b''):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        count_in_step('bytes_downloaded', len(chunk))
+                # http.client ends the body quietly when the connection drops before Content-Length
+                if response.length:
+                    raise http.client.IncompleteRead(b'', response.length)
+        except BaseException:
+            conn.close()
+            raise
+        self.pool.release(scheme, netloc, conn)
+        
+        actual = digest.hexdigest()
+        validators.unlink(missing_ok=True)
+        if sha256 and actual != sha256:
+            part.unlink()
+            raise ChecksumError(f"Checksum mismatch for {url}: expected {sha256}, got {actual}")
+        
+        os.replace(part, self.blob_path(actual))
+        self._record(url, actual)
+        return self.blob_path(actual)
+
+    def add(self, url: str, source: Path, sha256: str):
+        """Seed the cache with a blob obtained elsewhere, like an offline bundle"""
+        if sha256_file(source) != sha256:
+            raise OSError(f"Checksum mismatch for {source}")
+        if not self.blob_path(sha256).exists():
+            self.blob_path(sha256).parent.mkdir(parents=True, exist_ok=True)
+            place_blob(source, self.blob_path(sha256))
+        self._record(url, sha256)
+
+DOWNLOADS = DownloadCache(CACHE_DIR / 'downloads')
+
+def place_blob(blob: Path, destination: Path):
+    """Hard link a cached blob to destination, copying across filesystems"""
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if destination.exists():
+        if destination.samefile(blob):
+            return
+        destination.unlink()
+    try:
+        os.link(blob, destination)
+    except OSError:
+        shutil.copyfile(blob, destination)
 
-def download_file(url: str, destination: Path):
-    """Download file from URL"""
+def download_file(url: str, destination: Path, sha256: Optional[str] = None):
+    """Download file from URL through the download cache, retrying transient failures"""
     try:
-        destination.parent.mkdir(parents=True, exist_ok=True)
-        urllib.request.urlretrieve(url, destination)
+        attempt = 0
+        while True:
+            try:
+                blob = DOWNLOADS.fetch(url, sha256)
+                break
+            except Exception as e:
+                # The partial file stays, so the retry resumes where this attempt stopped
+                if not transient_error(e) or not NETWORK_RETRY.wait(attempt, 'download',
+                                                                    getattr(e, 'retry_after', None)):
+                    raise
+                attempt += 1
+        place_blob(blob, destination)
+        record_output(destination, blob.name)
         print_status(f"Downloaded: {destination}", Colors.GREEN)
         return True
     except Exception as e:
+        record_output(destination, None)
         print_status(f"Download failed: {e}", Colors.YELLOW)
         return False
 
+def download_files(downloads: List[Tuple[str, Path, Optional[str]]], max_workers: int = 4) -> bool:
+    """Download several (url, destination, sha256) entries concurrently"""
+    outputs = getattr(_step_context, 'outputs', None)
+    span = getattr(_step_context, 'span', None)
+    
+    def fetch(entry: Tuple[str, Path, Optional[str]]) -> bool:
+        # Downloads count as outputs of the step that asked for them
+        _step_context.outputs, _step_context.span = outputs, span
+        try:
+            return download_file(*entry)
+        finally:
+            _step_context.outputs = _step_context.span = None
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(fetch, downloads))
+    return all(results)
+
+# Mirror measurements are reused until they are this old
+MIRROR_TTL = 6 * 3600
+MIRROR_PROBE_BYTES = 1 << 20
+MIRROR_PROBE_TIMEOUT = 5.0
+
+# Mirrors are ranked by the estimated time to fetch this much, so latency and throughput both count
+MIRROR_REFERENCE_BYTES = 8 << 20
+
+# (prefix, mirror prefix) pairs pinned for asset downloads and git, set by pin_mirrors()
+ASSET_REWRITES: List[Tuple[str, str]] = []
+
+def rewrite_url(url: str) -> str:
+    """url on the pinned mirror for its prefix, unchanged if there is none"""
+    for prefix, mirror in ASSET_REWRITES:
+        if url.startswith(prefix):
+            return mirror + url[len(prefix):]
+    return url
+
+def git_command(*args: str) -> List[str]:
+    """git command line that fetches (submodules included) through the pinned mirrors"""
+    options = []
+    for prefix, mirror in ASSET_REWRITES:
+        options += ['-c', f'url.{mirror}.insteadOf={prefix}']
+    return ['git', *options, *args]
+
+REPOMD_NAMESPACE = {'repo': 'http://linux.duke.edu/metadata/repo'}
+
+def primary_metadata_url(pool: ConnectionPool, repomd_url: str) -> str:
+    """URL of the primary metadata a repomd.xml lists, big enough to measure throughput on"""
+    _, _, conn, response = pool.request(repomd_url, {'User-Agent': 'openbox-setup'})
+    try:
+        if response.status != 200:
+            raise ValueError(f"HTTP {response.status} {response.reason}")
+        repomd = ET.fromstring(response.read())
+    finally:
+        conn.close()
+    location = repomd.find("repo:data[@type='primary']/repo:location", REPOMD_NAMESPACE)
+    if location is None or not location.get('href'):
+        raise ValueError("repomd.xml lists no primary metadata")
+    # Locations are relative to the repository, one level above repodata/
+    return urllib.parse.urljoin(repomd_url, '../' + location.get('href'))
+
+def probe_mirror(pool: ConnectionPool, url: str) -> Dict:
+    """Time to the response headers and throughput of a ranged GET of url
+
+    A repomd.xml is only a few KB, so repositories are measured on the
+    primary metadata it lists instead.
+    """
+    measurement = {'probed': time.time()}
+    try:
+        if url.endswith('/repodata/repomd.xml'):
+            url = primary_metadata_url(pool, url)
+        start = time.monotonic()
+        _, _, conn, response = pool.request(url, {'User-Agent': 'openbox-setup',
+                                                  'Range': f'bytes=0-{MIRROR_PROBE_BYTES - 1}'})
+    except (OSError, http.client.HTTPException, ValueError, ET.ParseError) as e:
+        return {**measurement, 'error': str(e)}
+    
+    try:
+        latency = time.monotonic() - start
+        if response.status not in (200, 206):
+            return {**measurement, 'error': f"HTTP {response.status} {response.reason}"}
+        received = 0
+        first_byte = time.monotonic()
+        # Slow mirrors are cut off at the deadline and judged on what arrived by then
+        deadline = start + MIRROR_PROBE_TIMEOUT
+        while received < MIRROR_PROBE_BYTES and time.monotonic() < deadline:
+            chunk = response.read1(1 << 16)
+            if not chunk:
+                break
+            received += len(chunk)
+        elapsed = max(time.monotonic() - first_byte, 1e-3)
+    except (OSError, http.client.HTTPException) as e:
+        return {**measurement, 'error': str(e)}
+    finally:
+        conn.close()
+    return {**measurement, 'latency': latency, 'throughput': received / elapsed}
+
+def mirror_cost(measurement: Dict) -> float:
+    """Estimated seconds to fetch MIRROR_REFERENCE_BYTES, infinite for unreachable mirrors"""
+    if 'error' in measurement:
+        return float('inf')
+    return measurement['latency'] + MIRROR_REFERENCE_BYTES / max(measurement['throughput'], 1)
+
+class MirrorRanking:
+    """Mirror probe results by probe URL, kept on disk for MIRROR_TTL"""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def measure(self, urls: List[str], force: bool = False) -> Dict[str, Dict]:
+        """Measurements for urls, probing the stale ones concurrently"""
+        try:
+            cached = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            cached = {}
+        now = time.time()
+        stale = sorted({url for url in urls
+                        if force or url not in cached or now - cached[url]['probed'] > MIRROR_TTL})
+        
+        if stale:
+            print_status(f"Probing {len(stale)} mirrors...", Colors.YELLOW)
+            pool = ConnectionPool(timeout=MIRROR_PROBE_TIMEOUT)
+            with TRACE.span('probe mirrors', 'mirrors', urls=len(stale)):
+                with ThreadPoolExecutor(max_workers=min(len(stale), 16)) as executor:
+                    cached.update(zip(stale, executor.map(functools.partial(probe_mirror, pool), stale)))
+            write_json_atomic(self.path, cached)
+        return {url: cached[url] for url in urls}
+
+MIRRORS = MirrorRanking(CACHE_DIR / 'mirrors.json')
+
+def dnf_variables() -> Dict[str, str]:
+    """Values of the $releasever and $basearch variables in repository URLs"""
+    release = ''
+    try:
+        for line in Path('/etc/os-release').read_text().splitlines():
+            if line.startswith('VERSION_ID='):
+                release = line.split('=', 1)[1].strip('"')
+    except OSError:
+        pass
+    return {'releasever': release, 'basearch': os.uname().machine}
+
+def mirror_groups(config: Dict) -> List[Tuple[str, str, Dict[str, str]]]:
+    """(kind, name, {candidate: probe URL}) for each repository and asset prefix of a mirror config
+
+    The config is a JSON object like
+    {"dnf": {"fedora": ["http://mirror/fedora/linux/releases/$releasever/Everything/$basearch/os/"]},
+     "assets": [{"prefix": "https://raw.githubusercontent.com/", "probe": "user/repo/master/file.png",
+                 "mirrors": ["http://cache.lan/raw/"]}]}
+    Repositories are probed through the primary metadata their repomd.xml
+    lists. The original asset prefix competes with its mirrors, so a slow
+    mirror never replaces it.
+    """
+    variables = dnf_variables()
+    groups = []
+    for repo, baseurls in config.get('dnf', {}).items():
+        candidates = {}
+        for baseurl in baseurls:
+            expanded = re.sub(r'\$(\w+)', lambda m: variables.get(m.group(1), m.group(0)), baseurl)
+            candidates[baseurl] = expanded.rstrip('/') + '/repodata/repomd.xml'
+        groups.append(('dnf', repo, candidates))
+    for assets in config.get('assets', []):
+        candidates = {prefix: prefix + assets['probe'] for prefix in [assets['prefix'], *assets['mirrors']]}
+        groups.append(('assets', assets['prefix'], candidates))
+    return groups
+
+def rank_mirrors(config: Dict, force: bool = False) -> List[Tuple[str, str, List[Tuple[str, Dict]]]]:
+    """(kind, name, [(candidate, measurement)] fastest first) for each group of a mirror config"""
+    groups = mirror_groups(config)
+    measurements = MIRRORS.measure([url for _, _, candidates in groups for url in candidates.values()], force)
+    return [(kind, name, sorted(((candidate, measurements[url]) for candidate, url in candidates.items()),
+                                key=lambda entry: mirror_cost(entry[1])))
+            for kind, name, candidates in groups]
+
+def describe_measurement(measurement: Dict) -> str:
+    if 'error' in measurement:
+        return f"unreachable: {measurement['error']}"
+    return f"{measurement['latency'] * 1000:.0f} ms, {measurement['throughput'] / 1e6:.2f} MB/s"
+
+def pin_mirrors(config: Dict):
+    """Pin the fastest mirror of each group for dnf and asset downloads for the rest of the run"""
+    for kind, name, ranked in rank_mirrors(config):
+        best, measurement = ranked[0]
+        if 'error' in measurement:
+            print_status(f"No reachable mirror for {name}, keeping the default", Colors.YELLOW)
+            continue
+        if kind == 'dnf':
+            DNF_OPTIONS.extend([f'--setopt={name}.baseurl={best}', f'--setopt={name}.metalink=',
+                                f'--setopt={name}.mirrorlist='])
+        elif best != name:
+            ASSET_REWRITES.append((name, best))
+        print_status(f"Pinned {name}: {best} ({describe_measurement(measurement)})", Colors.GREEN)
+
+def print_mirror_ranking(config: Dict):
+    """Probe every mirror of a config and list them fastest first"""
+    for kind, name, ranked in rank_mirrors(config, force=True):
+        print_status(f"{name} ({kind}):", Colors.BLUE)
+        for candidate, measurement in ranked:
+            print(f"  {candidate}  {describe_measurement(measurement)}")
+
+WALLPAPER_URL = "https://raw.githubusercontent.com/linuxdotexe/nordic-wallpapers/master/wallpapers/nordic-mountain-range.png"
+WALLPAPER_DIR = Path.home() / 'Pictures' / 'Wallpapers'
+WALLPAPER_PATH = WALLPAPER_DIR / 'nord-mountain.png'
+
+# Nord palette and fonts shared by every config template
+PALETTE = {
+    'nord0': '#2E3440', 'nord1': '#3B4252', 'nord2': '#434C5E', 'nord3': '#4C566A',
+    'nord4': '#D8DEE9', 'nord5': '#E5E9F0', 'nord6': '#ECEFF4', 'nord7': '#8FBCBB',
+    'nord8': '#88C0D0', 'nord9': '#81A1C1', 'nord10': '#5E81AC', 'nord11': '#BF616A',
+    'nord12': '#D08770', 'nord13': '#EBCB8B', 'nord14': '#A3BE8C', 'nord15': '#B48EAD',
+}
+
+FONTS = {
+    'font': 'Noto Sans',
+    'font_mono': 'Noto Sans Mono',
+}
+
+class Template:
+    """Config text with {{name}} placeholders, compiled into alternating literal and variable parts"""
+
+    PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+    def __init__(self, parts: List[str]):
+        self.parts = parts
+
+    @classmethod
+    def parse(cls, source: str) -> 'Template':
+        return cls(cls.PLACEHOLDER.split(source))
+
+    def render(self, context: Dict[str, str]) -> str:
+        try:
+            return ''.join(part if i % 2 == 0 else context[part] for i, part in enumerate(self.parts))
+        except KeyError as e:
+            raise KeyError(f"Template variable {e.args[0]} is not defined") from None
+
+class TemplateCache:
+    """Compiled templates by source hash, in memory and under the cache directory"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def get(self, source: str) -> Template:
+        digest = hashlib.sha256(source.encode()).hexdigest()
+        with self._lock:
+            template = self._compiled.get(digest)
+        if template:
+            return template
+        
+        path = self.root / f'{digest}.json'
+        try:
+            template = Template(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            template = Template.parse(source)
+            write_json_atomic(path, template.parts)
+        with self._lock:
+            self._compiled[digest] = template
+        return template
+
+TEMPLATES = TemplateCache(CACHE_DIR / 'templates')
+
+# Overrides loaded with --theme, applied on top of PALETTE and FONTS
+THEME_OVERRIDES: Dict[str, str] = {}
+
+@functools.lru_cache(maxsize=None)
+def _context(overrides: Tuple[Tuple[str, str], ...]) -> Dict[str, str]:
+    context = {**PALETTE, **FONTS, **dict(overrides)}
+    context.update({f'{name}_hex': value.lstrip('#') for name, value in context.items()
+                    if name.startswith('nord')})
+    context.update(home=str(Path.home()), wallpaper_dir=str(WALLPAPER_DIR), wallpaper_path=str(WALLPAPER_PATH))
+    return context
+
+def template_context() -> Dict[str, str]:
+    """Palette, fonts and paths every config template renders from, built once per theme"""
+    return _context(tuple(sorted(THEME_OVERRIDES.items())))
+
+def load_theme(path: Path):
+    """Apply palette and font overrides from a JSON object like {"nord8": "#8FBCBB", "font": "Inter"}"""
+    overrides = json.loads(path.read_text())
+    unknown = set(overrides) - set(PALETTE) - set(FONTS)
+    if unknown:
+        raise ValueError(f"Unknown theme keys in {path}: {', '.join(sorted(unknown))}")
+    THEME_OVERRIDES.update(overrides)
+
+def render(source: str, **extra: str) -> str:
+    """Render a config template with the shared theme context plus any extra variables"""
+    context = template_context()
+    if extra:
+        context = {**context, **extra}
+    return TEMPLATES.get(source).render(context)
+
+BASE_PACKAGES = [
+    'openbox', 'obconf', 'nitrogen', 'picom',
+    'rofi', 'alacritty', 'dunst', 'feh', 'scrot', 'thunar',
+    'thunar-archive-plugin', 'thunar-volman', 'network-manager-applet',
+    'pavucontrol', 'brightnessctl', 'lxappearance',
+    'papirus-icon-theme', 'google-noto-sans-fonts', 'google-noto-sans-mono-fonts',
+    'google-noto-emoji-fonts', 'git', 'curl', 'wget', 'vim', 'htop',
+    'ranger', 'mpv', 'vlc', 'xfce4-power-manager', 'clipit', 'volumeicon', 'gedit',
+    'gnome-calculator', 'eog', 'file-roller', 'python3-pillow'
+]
+
+POLYBAR_BUILD_DEPS = [
+    'cmake', 'gcc-c++', 'cairo-devel', 'xcb-proto', 'xcb-util-devel',
+    'xcb-util-wm-devel', 'xcb-util-image-devel', 'xcb-util-cursor-devel',
+    'alsa-lib-devel', 'pulseaudio-libs-devel', 'libmpdclient-devel',
+    'libnl3-devel', 'jsoncpp-devel', 'libcurl-devel', 'ccache', 'ninja-build'
+]
+
+POLYBAR_REPO = 'https://github.com/polybar/polybar.git'
+
+# Source clone, build trees, ccache and packaged builds survive between runs
+POLYBAR_CACHE = CACHE_DIR / 'polybar'
+
+def rpmdb_fingerprint(rpmdb: Path = Path('/var/lib/rpm')) -> Optional[List]:
+    """Size and mtime of the rpm database files, changes with every transaction"""
+    try:
+        return sorted([entry.name, entry.stat().st_size, entry.stat().st_mtime_ns]
+                      for entry in os.scandir(rpmdb) if entry.is_file())
+    except OSError:
+        return None
+
+class InstalledPackages:
+    """Index of the rpm database built from a single rpm query
+
+    provides holds every capability of every installed package (package
+    names included), so requests like 'vim' that dnf resolves through a
+    provide are recognised as satisfied too. The index is kept on disk and
+    reused while the rpm database files are unchanged.
+    """
+
+    QUERY_FORMAT = '=%{NAME}-%{EPOCHNUM}:%{VERSION}-%{RELEASE}.%{ARCH}\\n[%{PROVIDENAME}\\n]'
+
+    def __init__(self, cache_path: Path):
+        self.cache_path = cache_path
+        self._provides = None
+        self._nevras = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._provides is not None:
+                return
+            
+            fingerprint = rpmdb_fingerprint()
+            try:
+                cached = json.loads(self.cache_path.read_text())
+                if fingerprint and cached['fingerprint'] == fingerprint:
+                    self._provides, self._nevras = set(cached['provides']), set(cached['nevras'])
+                    return
+            except (OSError, ValueError, KeyError):
+                pass
+            
+            result = run_command(['rpm', '-qa', '--queryformat', self.QUERY_FORMAT], check=False, capture=True)
+            provides, nevras = set(), set()
+            for line in result.stdout.splitlines():
+                if line.startswith('='):
+                    nevras.add(line[1:])
+                elif line:
+                    provides.add(line)
+            self._provides, self._nevras = provides, nevras
+            if fingerprint and result.returncode == 0:
+                write_json_atomic(self.cache_path, {'fingerprint': fingerprint,
+                                                    'provides': sorted(provides), 'nevras': sorted(nevras)})
+
+    @property
+    def provides(self) -> set:
+        self._load()
+        return self._provides
+
+    @property
+    def nevras(self) -> set:
+        self._load()
+        return self._nevras
+
+    def __contains__(self, package: str) -> bool:
+        return package in self.provides
+
+    def missing(self, packages: List[str]) -> List[str]:
+        """Packages that nothing installed provides yet"""
+        return [package for package in packages if package not in self]
+
+    def refresh(self):
+        """Forget the index, the next lookup re-reads the rpm database"""
+        with self._lock:
+            self._provides = None
+            self._nevras = None
+
+INSTALLED = InstalledPackages(CACHE_DIR / 'rpmdb-index.json')
+
+# Extra dnf options for the whole run, e.g. the repository of an offline bundle
+DNF_OPTIONS: List[str] = []
+
+def dnf_command(*args: str, sudo: bool = True) -> List[str]:
+    """dnf command line with the run's repository options"""
+    return (['sudo'] if sudo else []) + ['dnf'] + DNF_OPTIONS + list(args)
+
+class PackagePlan:
+    """Package requests from every step, resolved once and installed in one dnf transaction"""
+
+    def __init__(self):
+        self.packages = {}
+        self.fallbacks = {}
+        self.unavailable = set()
+        self.satisfied = set()
+        self._transaction = None
+        self._lock = threading.Lock()
+
+    def request(self, packages: List[str], fallback: Optional[List[str]] = None):
+        """Add packages, fallback is installed instead of a package the repos don't have"""
+        for package in packages:
+            self.packages.setdefault(package, None)
+            if fallback:
+                self.fallbacks[package] = list(fallback)
+
+    def all_packages(self) -> List[str]:
+        """Requested packages followed by every fallback package, without duplicates"""
+        names = dict.fromkeys(self.packages)
+        for fallback in self.fallbacks.values():
+            names.update(dict.fromkeys(fallback))
+        return list(names)
+
+    def resolve(self, packages: List[str]) -> Optional[set]:
+        """Specs among packages that the enabled repos can install, None if a query failed
+
+        Most specs are package names and are answered by one query. The rest
+        go to a second query as capabilities, the way dnf install turns e.g.
+        'vim' into vim-enhanced, and are matched against what each result
+        provides.
+        """
+        result = run_command(dnf_command('repoquery', '--available', '--queryformat', '%{name}\n', *packages,
+                                         sudo=False), check=False, capture=True, retry=NETWORK_RETRY)
+        if result.returncode != 0:
+            return None
+        names = set(result.stdout.split())
+        available = {package for package in packages if package in names}
+        
+        rest = [package for package in packages if package not in available]
+        if rest:
+            result = run_command(dnf_command('repoquery', '--available', '--queryformat', '=%{name}\n%{provides}\n',
+                                             f"--whatprovides={','.join(rest)}", sudo=False),
+                                 check=False, capture=True, retry=NETWORK_RETRY)
+            if result.returncode != 0:
+                return None
+            # Provides come as "name", "name = version" or "name >= version"
+            provided = {line.split()[0] for line in result.stdout.splitlines() if line and not line.startswith('=')}
+            available.update(package for package in rest if package in provided)
+        return available
+
+    def transaction(self) -> List[str]:
+        """Packages to hand to dnf, resolved once"""
+        with self._lock:
+            if self._transaction is None:
+                self._transaction = self._resolve_transaction()
+            return list(self._transaction)
+
+    def _resolve_transaction(self) -> List[str]:
+        """Missing packages, with fallbacks substituted for ones the repos don't have"""
+        self.satisfied = set(self.packages) - set(INSTALLED.missing(list(self.packages)))
+        wanted = [p for p in self.packages if p not in self.satisfied]
+        if not wanted:
+            return []
+        
+        candidates = wanted + [dep for p in wanted for dep in self.fallbacks.get(p, [])]
+        available = self.resolve(INSTALLED.missing(list(dict.fromkeys(candidates))))
+        if available is None:
+            # Without a resolution dnf skips what it can't find and fallbacks are decided afterwards
+            print_status("Could not query repositories, installing without pre-resolution", Colors.YELLOW)
+            return wanted
+        return [p for p in self.select(wanted, available) if p not in INSTALLED]
+
+    def select(self, wanted: List[str], available: set) -> List[str]:
+        """Available packages of wanted plus the fallbacks of the others"""
+        selected = {}
+        for package in wanted:
+            if package in available:
+                selected.setdefault(package, None)
+            else:
+                self.unavailable.add(package)
+                selected.update(dict.fromkeys(p for p in self.fallbacks.get(package, []) if p in available))
+        
+        if self.unavailable:
+            print_status(f"Not in repositories: {', '.join(sorted(self.unavailable))}", Colors.YELLOW)
+        return list(selected)
+
+    def full_set(self) -> List[str]:
+        """Packages a machine with nothing installed yet needs, ignoring this machine's rpm database"""
+        available = self.resolve(self.all_packages())
+        if available is None:
+            raise RuntimeError("Could not query the repositories")
+        return self.select(list(self.packages), available)
+
+    def apply(self, prefetched: Optional[List[Path]] = None):
+        """Resolve every request and install the result in one dnf transaction
+
+        Prefetched RPM files are installed from disk and the specs they
+        provide aren't looked up again, the repositories only supply the rest.
+        """
+        packages = self.transaction()
+        if not packages:
+            print_status("All requested packages are already installed", Colors.GREEN)
+            return
+        
+        rpms, provided = usable_rpms(prefetched or [])
+        specs = [package for package in packages if package not in provided]
+        if rpms:
+            print_status(f"Installing {len(rpms)} prefetched packages", Colors.BLUE)
+        run_command(dnf_command('install', '-y', '--skip-unavailable', '--skip-broken', *specs,
+                                *[str(rpm) for rpm in rpms]),
+                    retry=NETWORK_RETRY)
+        INSTALLED.refresh()
+        
+        # Fallbacks for packages that only turned out to be missing during the transaction
+        missing = [p for p in self.fallbacks if p in packages and p not in INSTALLED]
+        if missing:
+            self.unavailable.update(missing)
+            fallback = INSTALLED.missing([dep for p in missing for dep in self.fallbacks[p]])
+            if fallback:
+                run_command(dnf_command('install', '-y', '--skip-unavailable', '--skip-broken', *fallback),
+                            retry=NETWORK_RETRY)
+                INSTALLED.refresh()
+
+PACKAGE_PLAN = PackagePlan()
+PACKAGE_PLAN.request(BASE_PACKAGES)
+PACKAGE_PLAN.request(['polybar'], fallback=POLYBAR_BUILD_DEPS)
+
+def download_closure(packages: List[str], destdir: Path):
+    """Download packages and their complete dependency closure as RPM files"""
+    run_command(dnf_command('download', '--resolve', '--alldeps', '--destdir', str(destdir), *packages,
+                            sudo=False), retry=NETWORK_RETRY)
+
+LOCK_FORMAT = 1
+
+# Locked RPMs, verified against their lockfile checksums before installing
+LOCKED_RPMS = CACHE_DIR / 'rpms'
+
+_VERSION_SEGMENT = re.compile(r'[~^]|[0-9]+|[a-zA-Z]+')
+
+def rpm_vercmp(a: str, b: str) -> int:
+    """Compare two version or release strings the way rpm does, -1, 0 or 1"""
+    one, two = _VERSION_SEGMENT.findall(a), _VERSION_SEGMENT.findall(b)
+    while one or two:
+        first, second = (one[0] if one else ''), (two[0] if two else '')
+        # ~ sorts before anything, even the end of the string, ^ after the end but before anything else
+        if first == '~' or second == '~':
+            if first != second:
+                return -1 if first == '~' else 1
+        elif first == '^' or second == '^':
+            if not first:
+                return -1
+            if not second:
+                return 1
+            if first != second:
+                return 1 if second == '^' else -1
+        elif not first or not second:
+            return 1 if first else -1
+        elif first.isdigit() != second.isdigit():
+            return 1 if first.isdigit() else -1
+        elif first.isdigit():
+            left, right = int(first), int(second)
+            if left != right:
+                return 1 if left > right else -1
+        elif first != second:
+            return 1 if first > second else -1
+        one, two = one[1:], two[1:]
+    return 0
+
+def parse_nevra(nevra: str) -> Tuple[str, str, Tuple[int, str, str]]:
+    """(name, arch, (epoch, version, release)) of a name-epoch:version-release.arch string"""
+    name, epoch_version, release_arch = nevra.rsplit('-', 2)
+    epoch, _, version = epoch_version.rpartition(':')
+    release, _, arch = release_arch.rpartition('.')
+    return name, arch, (int(epoch or 0), version, release)
+
+def evr_compare(a: Tuple[int, str, str], b: Tuple[int, str, str]) -> int:
+    """Compare (epoch, version, release) triples like rpm, -1, 0 or 1"""
+    if a[0] != b[0]:
+        return 1 if a[0] > b[0] else -1
+    return rpm_vercmp(a[1], b[1]) or rpm_vercmp(a[2], b[2])
+
+def installed_versions() -> Dict[Tuple[str, str], List[Tuple[int, str, str]]]:
+    """(epoch, version, release) of every installed package by (name, arch)"""
+    installed = collections.defaultdict(list)
+    for nevra in INSTALLED.nevras:
+        name, arch, evr = parse_nevra(nevra)
+        installed[name, arch].append(evr)
+    return installed
+
+def usable_rpms(rpms: List[Path]) -> Tuple[List[Path], set]:
+    """RPM files among rpms that would add or upgrade a package, and everything those provide
+
+    Files the installed version already matches or is newer than, e.g.
+    because the system update ran after they were downloaded, are left out.
+    """
+    if not rpms:
+        return [], set()
+    result = run_command(['rpm', '-qp', '--nosignature', '--nodigest', '--queryformat',
+                          InstalledPackages.QUERY_FORMAT, *[str(rpm) for rpm in rpms]], check=False, capture=True)
+    if result.returncode != 0:
+        return [], set()
+    
+    headers = []
+    for line in result.stdout.splitlines():
+        if line.startswith('='):
+            headers.append((line[1:], set()))
+        elif line and headers:
+            headers[-1][1].add(line)
+    
+    installed = installed_versions()
+    usable, provided = [], set()
+    for rpm, (nevra, provides) in zip(rpms, headers):
+        name, arch, evr = parse_nevra(nevra)
+        if any(evr_compare(version, evr) >= 0 for version in installed.get((name, arch), [])):
+            continue
+        usable.append(rpm)
+        provided |= provides
+    return usable, provided
+
+class Lockfile:
+    """Exact NEVRAs and SHA-256 checksums of every RPM an install needs
+
+    Written by the lock command. Installing from it skips the system
+    update and dependency resolution against the repositories: dnf only
+    gets the verified RPM files, with every repository disabled.
+    """
+
+    def __init__(self, data: Dict):
+        if data.get('format') != LOCK_FORMAT:
+            raise ValueError("Unsupported lockfile format")
+        self.data = data
+        self.rpms = data['rpms']
+
+    @classmethod
+    def load(cls, path: Path) -> 'Lockfile':
+        return cls(json.loads(path.read_text()))
+
+    def missing(self) -> Tuple[List[Dict], List[Dict]]:
+        """Locked RPMs to install, and those kept back because a newer version of them is installed
+
+        Packages are matched by name and architecture. An older or absent one
+        is installed (or upgraded) from the locked file. One that updates
+        have moved past the lock stays, installing the locked file would be
+        a downgrade.
+        """
+        installed = installed_versions()
+        wanted, newer = [], []
+        for rpm in self.rpms:
+            name, arch, evr = parse_nevra(rpm['nevra'])
+            versions = installed.get((name, arch), [])
+            if evr in versions:
+                continue
+            if versions and all(evr_compare(version, evr) > 0 for version in versions):
+                newer.append(rpm)
+            else:
+                wanted.append(rpm)
+        return wanted, newer
+
+    def fetch(self, rpms: List[Dict]) -> List[Path]:
+        """Locked RPM files for rpms, downloading the ones not cached yet, all checksum-verified"""
+        absent = [rpm for rpm in rpms if not (LOCKED_RPMS / rpm['file']).exists()]
+        if absent:
+            run_command(dnf_command('download', '--destdir', str(LOCKED_RPMS), *[rpm['nevra'] for rpm in absent],
+                                    sudo=False), retry=NETWORK_RETRY)
+        
+        files = []
+        for rpm in rpms:
+            path = LOCKED_RPMS / rpm['file']
+            if not path.exists() or sha256_file(path) != rpm['sha256']:
+                raise RuntimeError(f"{rpm['nevra']} does not match the lockfile checksum")
+            files.append(path)
+        return files
+
+    def apply(self):
+        """Install the locked RPMs that are not installed yet"""
+        PACKAGE_PLAN.unavailable.update(self.data['unavailable'])
+        PACKAGE_PLAN.satisfied = set(PACKAGE_PLAN.packages) - set(INSTALLED.missing(list(PACKAGE_PLAN.packages)))
+        rpms, newer = self.missing()
+        if newer:
+            print_status(f"Installed versions newer than the lockfile, kept: "
+                         f"{', '.join(parse_nevra(rpm['nevra'])[0] for rpm in newer)}", Colors.YELLOW)
+        if not rpms:
+            print_status("All locked packages are already installed", Colors.GREEN)
+            return
+        
+        files = self.fetch(rpms)
+        run_command(['sudo', 'dnf', 'install', '-y', '--disablerepo=*', '--setopt=install_weak_deps=False',
+                     *[str(path) for path in files]])
+        INSTALLED.refresh()
+
+# Lockfile given with --lockfile
+LOCKFILE: Optional[Lockfile] = None
+
+def use_lockfile(path: Path):
+    """Install packages from a lockfile instead of resolving them"""
+    global LOCKFILE
+    LOCKFILE = Lockfile.load(path)
+    print_status(f"Using lockfile {path} ({len(LOCKFILE.rpms)} RPMs)", Colors.GREEN)
+
+def package_inputs() -> List[str]:
+    """What the package steps install, for the step journal"""
+    if LOCKFILE:
+        return [rpm['nevra'] for rpm in LOCKFILE.rpms]
+    return PACKAGE_PLAN.all_packages()
+
+def create_lockfile(output: Path):
+    """Resolve the package closure once and write its exact NEVRAs and checksums"""
+    print_status("Resolving packages...", Colors.YELLOW)
+    packages = PACKAGE_PLAN.full_set()
+    
+    LOCKED_RPMS.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=LOCKED_RPMS, prefix='lock-') as work:
+        print_status(f"Downloading {len(packages)} packages with dependencies...", Colors.YELLOW)
+        download_closure(packages, Path(work))
+        files = sorted(Path(work).glob('*.rpm'))
+        query = run_command(['rpm', '-qp', '--nosignature', '--nodigest', '--queryformat',
+                             '%{NAME}-%{EPOCHNUM}:%{VERSION}-%{RELEASE}.%{ARCH}\n', *[str(f) for f in files]],
+                            capture=True)
+        
+        rpms = []
+        for path, nevra in zip(files, query.stdout.split()):
+            rpms.append({'nevra': nevra, 'file': path.name, 'sha256': sha256_file(path)})
+            # Keep the verified files so installs on this machine don't download them again
+            os.replace(path, LOCKED_RPMS / path.name)
+    
+    write_json_atomic(output, {
+        'format': LOCK_FORMAT,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'packages': packages,
+        'unavailable': sorted(PACKAGE_PLAN.unavailable),
+        'rpms': rpms,
+    })
+    print_status(f"Lockfile written: {output} ({len(rpms)} RPMs)", Colors.GREEN)
+
+# RPMs of the package plan, downloaded without root while the system update runs
+PREFETCH_DIR = CACHE_DIR / 'prefetch'
+
+def prefetch_packages():
+    """Download the package plan and its missing dependencies while the system update runs"""
+    if LOCKFILE:
+        print_status("Fetching locked packages...", Colors.YELLOW)
+        LOCKFILE.fetch(LOCKFILE.missing()[0])
+        return
+    
+    if PREFETCH_DIR.exists():
+        shutil.rmtree(PREFETCH_DIR)
+    packages = PACKAGE_PLAN.transaction()
+    if not packages:
+        return
+    print_status(f"Prefetching {len(packages)} packages...", Colors.YELLOW)
+    PREFETCH_DIR.mkdir(parents=True)
+    # dnf download needs no root, so it runs next to the update in the broker. Failures only
+    # cost the head start, the install gets whatever is missing from the repositories
+    run_command(dnf_command('download', '--resolve', '--destdir', str(PREFETCH_DIR), *packages, sudo=False),
+                check=False, retry=NETWORK_RETRY)
+
+def update_system():
+    """Update the installed packages, locked installs keep them as they are"""
+    if LOCKFILE:
+        return
+    print_status("Updating system...", Colors.YELLOW)
+    run_command(dnf_command('update', '-y'), retry=NETWORK_RETRY)
+    INSTALLED.refresh()
+
 def install_packages():
     """Install all required packages"""
-    print_status("Updating system...", Colors.YELLOW)
-    run_command(['sudo', 'dnf', 'update', '-y'])
-    
-    print_status("Installing base packages...", Colors.YELLOW)
-    packages = [
-        'openbox', 'obconf', 'nitrogen', 'picom',
-        'rofi', 'alacritty', 'dunst', 'feh', 'scrot', 'thunar',
-        'thunar-archive-plugin', 'thunar-volman', 'network-manager-applet',
-        'pavucontrol', 'brightnessctl', 'lxappearance',
-        'papirus-icon-theme', 'google-noto-sans-fonts', 'google-noto-sans-mono-fonts',
-        'google-noto-emoji-fonts', 'git', 'curl', 'wget', 'vim', 'htop',
-        'ranger', 'mpv', 'vlc', 'xfce4-power-manager', 'clipit', 'volumeicon', 'gedit',
-        'gnome-calculator', 'eog', 'file-roller'
-    ]
+    if LOCKFILE:
+        print_status("Installing locked packages...", Colors.YELLOW)
+        LOCKFILE.apply()
+        return
     
-    run_command(['sudo', 'dnf', 'install', '-y', '--skip-unavailable', '--skip-broken'] + packages)
+    print_status("Installing packages...", Colors.YELLOW)
+    PACKAGE_PLAN.apply(sorted(PREFETCH_DIR.glob('*.rpm')))
+    shutil.rmtree(PREFETCH_DIR, ignore_errors=True)
 
 def install_polybar():
     """Install Polybar"""
     print_status("Installing Polybar...", Colors.YELLOW)
     
-    # Try to install from repos first
-    result = run_command(['dnf', 'list', 'installed', 'polybar'], check=False)
-    if result.returncode == 0:
-        print_status("Polybar already installed", Colors.GREEN)
+    # The package plan installed it, or its build deps when the repos don't have it
+    if 'polybar' in INSTALLED:
+        if 'polybar' in PACKAGE_PLAN.satisfied:
+            print_status("Polybar already installed", Colors.GREEN)
+        else:
+            print_status("Polybar installed from repository", Colors.GREEN)
         return
     
-    result = run_command(['sudo', 'dnf', 'install', '-y', 'polybar'], check=False)
-    if result.returncode == 0:
-        print_status("Polybar installed from repository", Colors.GREEN)
-        return
+    if BUNDLE_POLYBAR_ARTIFACT:
+        print_status(f"Using Polybar build {BUNDLE_POLYBAR_ARTIFACT.name} from the bundle", Colors.GREEN)
+        artifact = BUNDLE_POLYBAR_ARTIFACT
+    else:
+        artifact = polybar_artifact()
     
-    # Build from source if not in repos
-    print_status("Building Polybar from source...", Colors.YELLOW)
-    build_deps = [
-        'cmake', 'gcc-c++', 'cairo-devel', 'xcb-proto', 'xcb-util-devel',
-        'xcb-util-wm-devel', 'xcb-util-image-devel', 'xcb-util-cursor-devel',
-        'alsa-lib-devel', 'pulseaudio-libs-devel', 'libmpdclient-devel',
-        'libnl3-devel', 'jsoncpp-devel', 'libcurl-devel'
-    ]
-    run_command(['sudo', 'dnf', 'install', '-y'] + build_deps)
+    # Directories that exist keep their owner and mode, the archive only adds files below them
+    run_command(['sudo', 'tar', '-xzf', str(artifact), '-C', '/', '--no-same-owner', '--no-overwrite-dir'])
+
+def polybar_artifact() -> Path:
+    """Packaged build of upstream HEAD, built from source unless one is cached"""
+    commit = run_command(git_command('ls-remote', POLYBAR_REPO, 'HEAD'), capture=True,
+                         retry=NETWORK_RETRY).stdout.split()[0]
+    artifact = polybar_artifact_path(commit)
+    if artifact.exists():
+        print_status(f"Using cached Polybar build {artifact.name}", Colors.GREEN)
+    else:
+        print_status("Building Polybar from source...", Colors.YELLOW)
+        build_polybar(commit, artifact)
+    return artifact
+
+def compiler_fingerprint() -> str:
+    """Short hash of the C++ compiler version, part of the build artifact key"""
+    version = run_command(['c++', '--version'], capture=True).stdout.splitlines()[0]
+    return hashlib.sha256(version.encode()).hexdigest()[:12]
+
+# Bumped when the layout of the packaged build changes, so older artifacts are rebuilt
+POLYBAR_ARTIFACT_FORMAT = 2
+
+def polybar_artifact_path(commit: str) -> Path:
+    """Packaged build of commit for the installed compiler"""
+    return POLYBAR_CACHE / 'artifacts' / (f'polybar-{commit[:12]}-{compiler_fingerprint()}'
+                                          f'-{POLYBAR_ARTIFACT_FORMAT}.tar.gz')
+
+def update_polybar_source(commit: str) -> Path:
+    """Check out commit in the persistent clone, fetching instead of re-cloning"""
+    src = POLYBAR_CACHE / 'src'
+    if (src / '.git').exists():
+        run_command(git_command('fetch', '--tags', '--force', POLYBAR_REPO, 'HEAD'), cwd=src, retry=NETWORK_RETRY)
+    else:
+        run_command(git_command('clone', '--recursive', POLYBAR_REPO, str(src)), retry=NETWORK_RETRY)
+    run_command(['git', 'checkout', '--force', '--detach', commit], cwd=src)
+    run_command(git_command('submodule', 'update', '--init', '--recursive'), cwd=src, retry=NETWORK_RETRY)
+    return src
+
+# Peak memory of one polybar compile job (template-heavy C++ at -O2) and what the rest of the machine keeps
+BUILD_JOB_MEMORY = 768 << 20
+BUILD_MEMORY_RESERVE = 512 << 20
+
+def memory_available(proc_root: Path = Path('/proc')) -> Optional[int]:
+    """MemAvailable in bytes, None when the kernel doesn't report it"""
+    try:
+        for line in (proc_root / 'meminfo').read_text().splitlines():
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def build_jobs(proc_root: Path = Path('/proc')) -> Tuple[int, str]:
+    """Parallel jobs the machine can take right now and why, limited by CPUs, memory and load"""
+    cpus = len(os.sched_getaffinity(0))
+    limits = [cpus]
+    reasons = [f"{cpus} CPUs"]
+    
+    available = memory_available(proc_root)
+    if available is not None:
+        limits.append((available - BUILD_MEMORY_RESERVE) // BUILD_JOB_MEMORY)
+        reasons.append(f"{available >> 20} MiB available")
     
-    tmp_dir = Path('/tmp/polybar')
-    if tmp_dir.exists():
-        shutil.rmtree(tmp_dir)
+    # Work that is already running keeps its CPUs
+    load = os.getloadavg()[0]
+    limits.append(cpus - int(load))
+    reasons.append(f"load {load:.1f}")
+    return max(1, min(limits)), ', '.join(reasons)
+
+def _tool_version(cmd: List[str]) -> Tuple[int, ...]:
+    """(major, minor) of a tool from its --version output, (0,) when unknown"""
+    match = re.search(r'(\d+)\.(\d+)', _probe_output(cmd) or '')
+    return tuple(map(int, match.groups())) if match else (0,)
+
+class Jobserver:
+    """GNU make jobserver shared by the polybar build and other heavy steps
+
+    Tokens live in a named pipe: make 4.4 and ninja 1.13 and later join it
+    through MAKEFLAGS, steps take one with slot() for their heavy part. Like
+    a top-level make this process owns one job without a token, the pipe
+    holds the rest, so everything together never runs more than jobs at once.
+    """
+
+    def __init__(self, jobs: int):
+        self.jobs = jobs
+        self.dir = Path(tempfile.mkdtemp(prefix='openbox-setup-jobs-'))
+        self.path = self.dir / 'fifo'
+        os.mkfifo(self.path, 0o600)
+        # Opened read-write so the pipe stays usable while no client has it open
+        self.fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+        os.write(self.fd, b'+' * (jobs - 1))
+        self._implicit = threading.Lock()
+
+    @property
+    def makeflags(self) -> str:
+        return f'-j{self.jobs} --jobserver-auth=fifo:{self.path}'
+
+    def joins(self, generator: str) -> bool:
+        """Whether the build tool for generator understands this jobserver"""
+        if generator == 'Ninja':
+            return _tool_version(['ninja', '--version']) >= (1, 13)
+        return _tool_version(['make', '--version']) >= (4, 4)
+
+    def _take(self) -> bytes:
+        while True:
+            try:
+                token = os.read(self.fd, 1)
+                if token:
+                    return token
+            except BlockingIOError:
+                pass
+            if CANCELLED.is_set():
+                raise CommandError('job slot', -1, "cancelled")
+            select.select([self.fd], [], [], 0.5)
+
+    @contextmanager
+    def slot(self):
+        """Hold one job for the duration of the with block"""
+        if self._implicit.acquire(blocking=False):
+            try:
+                yield
+            finally:
+                self._implicit.release()
+            return
+        token = self._take()
+        try:
+            yield
+        finally:
+            os.write(self.fd, token)
+
+    def close(self):
+        os.close(self.fd)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+# Created by the first step that needs it, closed by main()
+JOBSERVER: Optional[Jobserver] = None
+_jobserver_lock = threading.Lock()
+
+def build_jobserver() -> Jobserver:
+    """The run's jobserver, sized when it is first needed"""
+    global JOBSERVER
+    with _jobserver_lock:
+        if JOBSERVER is None:
+            jobs, reasons = build_jobs()
+            print_status(f"Running up to {jobs} build jobs ({reasons})", Colors.BLUE)
+            JOBSERVER = Jobserver(jobs)
+        return JOBSERVER
+
+def stop_jobserver():
+    global JOBSERVER
+    with _jobserver_lock:
+        if JOBSERVER:
+            JOBSERVER.close()
+            JOBSERVER = None
+
+def build_limits(memory_high: int) -> Tuple[str, ...]:
+    """Command prefix that keeps a build from starving the desktop
+
+    A transient systemd user scope caps memory with reclaim pressure
+    instead of the OOM killer and lowers CPU and IO weight. Without a user
+    manager the build only runs niced.
+    """
+    niced = ('nice', '-n', '10')
+    if shutil.which('ionice'):
+        niced += ('ionice', '-c', '2', '-n', '7')
+    if not shutil.which('systemd-run'):
+        return niced
+    scope = ('systemd-run', '--user', '--scope', '--quiet', '--collect', '-p', f'MemoryHigh={memory_high}',
+             '-p', 'CPUWeight=20', '-p', 'IOWeight=20')
+    # The user manager may be missing (no login session) or refuse the properties
+    if _probe_output([*scope, 'true']) is None:
+        return niced
+    return scope + niced
+
+def build_polybar(commit: str, artifact: Path):
+    """Compile commit through ccache and package the install tree as artifact"""
+    src = update_polybar_source(commit)
     
-    run_command(['git', 'clone', '--recursive', 'https://github.com/polybar/polybar.git', str(tmp_dir)])
-    build_dir = tmp_dir / 'build'
-    build_dir.mkdir(exist_ok=True)
+    # One build tree per generator, cmake refuses to switch generators in place
+    generator = 'Ninja' if shutil.which('ninja') else 'Unix Makefiles'
+    build_dir = POLYBAR_CACHE / ('build-ninja' if generator == 'Ninja' else 'build-make')
+    cmake_cmd = ['cmake', '-S', str(src), '-B', str(build_dir), '-G', generator,
+                 '-DCMAKE_BUILD_TYPE=Release', '-DCMAKE_INSTALL_PREFIX=/usr/local']
+    env = {}
+    if shutil.which('ccache'):
+        cmake_cmd += ['-DCMAKE_C_COMPILER_LAUNCHER=ccache', '-DCMAKE_CXX_COMPILER_LAUNCHER=ccache']
+        env['CCACHE_DIR'] = str(POLYBAR_CACHE / 'ccache')
     
-    os.chdir(build_dir)
-    run_command(['cmake', '..'])
-    run_command(['make', f'-j{os.cpu_count()}'])
-    run_command(['sudo', 'make', 'install'])
-    os.chdir(Path.home())
+    run_command(cmake_cmd, env=env)
+    
+    # make and ninja share the run's job pool when they can, otherwise they get their own of the same size
+    jobserver = build_jobserver()
+    build_cmd = ['cmake', '--build', str(build_dir)]
+    if jobserver.joins(generator):
+        env['MAKEFLAGS'] = jobserver.makeflags
+    else:
+        build_cmd += ['--parallel', str(jobserver.jobs)]
+    memory = max((memory_available() or 0) - BUILD_MEMORY_RESERVE, jobserver.jobs * BUILD_JOB_MEMORY)
+    with jobserver.slot():
+        run_command([*build_limits(memory), *build_cmd], env=env)
+    
+    stage = POLYBAR_CACHE / 'stage'
+    if stage.exists():
+        shutil.rmtree(stage)
+    run_command(['cmake', '--install', str(build_dir)], env={'DESTDIR': str(stage)})
+    
+    # Publish under a temporary name so machines sharing the cache never see a partial tarball
+    artifact.parent.mkdir(parents=True, exist_ok=True)
+    tmp = artifact.with_name(f'.{artifact.name}.{os.getpid()}')
+    # Only the payload (usr/...), a ./ entry would carry the stage's mode onto / when extracted.
+    # Modes are normalized so a restrictive umask during the build doesn't hide files from users
+    run_command(['tar', '-czf', str(tmp), '-C', str(stage), '--owner=0', '--group=0', '--numeric-owner',
+                 '--mode=u+w,go+rX,go-w', *sorted(entry.name for entry in stage.iterdir())])
+    os.replace(tmp, artifact)
+    shutil.rmtree(stage)
 
 def setup_directory_structure():
     """Create all necessary directories"""
@@ -144,15 +2099,109 @@ def setup_directory_structure():
 def download_wallpaper():
     """Download Nord wallpaper"""
     print_status("Downloading Nord wallpaper...", Colors.YELLOW)
-    wallpaper_url = "https://raw.githubusercontent.com/linuxdotexe/nordic-wallpapers/master/wallpapers/nordic-mountain-range.png"
-    wallpaper_path = Path.home() / 'Pictures' / 'Wallpapers' / 'nord-mountain.png'
-    download_file(wallpaper_url, wallpaper_path)
+    download_files([(WALLPAPER_URL, WALLPAPER_PATH, None)])
+
+# Resolutions given with --resolution, in monitor order
+WALLPAPER_RESOLUTIONS: List[Tuple[int, int]] = []
+
+# Pre-scaled wallpapers named by source hash and geometry. nitrogen shows
+# them at every login, so they live with user data, not in the purgeable cache
+WALLPAPER_VARIANTS = Path.home() / '.local' / 'share' / 'openbox-setup' / 'wallpapers'
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    match = re.fullmatch(r'(\d+)x(\d+)', value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {value!r}")
+    return int(match.group(1)), int(match.group(2))
+
+def display_resolutions(drm: Path = Path('/sys/class/drm')) -> List[Tuple[int, int]]:
+    """Resolution of each monitor: --resolution, else the preferred mode of every connected output"""
+    if WALLPAPER_RESOLUTIONS:
+        return list(WALLPAPER_RESOLUTIONS)
+    resolutions = []
+    for connector in sorted(drm.glob('card*-*')):
+        try:
+            if (connector / 'status').read_text().strip() != 'connected':
+                continue
+            modes = (connector / 'modes').read_text().split()
+        except OSError:
+            continue
+        if modes:
+            resolutions.append(parse_resolution(modes[0].rstrip('i')))
+    return resolutions
+
+def wallpaper_variant(digest: str, width: int, height: int) -> Path:
+    return WALLPAPER_VARIANTS / f'{digest[:16]}-{width}x{height}.jpg'
+
+def wallpaper_heads() -> List[Path]:
+    """Image nitrogen shows on each monitor, its pre-scaled variant when there is one"""
+    try:
+        digest = sha256_file(WALLPAPER_PATH)
+    except OSError:
+        return [WALLPAPER_PATH]
+    heads = []
+    for width, height in display_resolutions():
+        variant = wallpaper_variant(digest, width, height)
+        heads.append(variant if variant.exists() else WALLPAPER_PATH)
+    return heads or [WALLPAPER_PATH]
+
+def scale_wallpaper(source: Path, destination: Path, width: int, height: int) -> bool:
+    """Scale and center-crop source to fill width x height, like nitrogen's zoom-fill, as a baseline JPEG"""
+    tmp = destination.with_name(f'.{destination.name}.tmp')
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        magick = shutil.which('magick') or shutil.which('convert')
+        if not magick:
+            return False
+        run_command([magick, str(source), '-resize', f'{width}x{height}^', '-gravity', 'center',
+                     '-extent', f'{width}x{height}', '-strip', '-quality', '92', f'jpg:{tmp}'])
+    else:
+        with Image.open(source) as image:
+            # draft lets JPEG sources decode straight at a reduced scale
+            image.draft('RGB', (width, height))
+            ImageOps.fit(image.convert('RGB'), (width, height), Image.LANCZOS).save(tmp, 'JPEG', quality=92)
+    os.replace(tmp, destination)
+    return True
+
+def prepare_wallpaper():
+    """Pre-scale the wallpaper for each monitor so logins don't decode and rescale the full image"""
+    resolutions = sorted(set(display_resolutions()))
+    if not resolutions:
+        print_status("No monitor resolution found, nitrogen will scale the wallpaper at login", Colors.YELLOW)
+        return
+    try:
+        digest = sha256_file(WALLPAPER_PATH)
+    except OSError:
+        print_status("Wallpaper missing, skipping pre-scaled variants", Colors.YELLOW)
+        return
+    
+    WALLPAPER_VARIANTS.mkdir(parents=True, exist_ok=True)
+    # Variants of a replaced wallpaper are never shown again
+    for stale in WALLPAPER_VARIANTS.glob('*.jpg'):
+        if not stale.name.startswith(digest[:16] + '-'):
+            stale.unlink()
+    for width, height in resolutions:
+        variant = wallpaper_variant(digest, width, height)
+        if variant.exists():
+            print_status(f"Wallpaper for {width}x{height} already prepared", Colors.GREEN)
+            record_output(variant, sha256_file(variant))
+            continue
+        with build_jobserver().slot():
+            scaled = scale_wallpaper(WALLPAPER_PATH, variant, width, height)
+        if scaled:
+            print_status(f"Prepared wallpaper for {width}x{height}", Colors.GREEN)
+        else:
+            print_status("Neither Pillow nor ImageMagick is available, keeping the full-size wallpaper",
+                         Colors.YELLOW)
+            return
+        record_output(variant, sha256_file(variant))
 
 def create_openbox_theme():
     """Create Nord Openbox theme"""
     print_status("Creating Nord Openbox theme...", Colors.YELLOW)
     
-    theme_content = """# Nord Aurora Openbox Theme
+    theme_content = render("""# Nord Aurora Openbox Theme
 
 # Window geometry
 padding.width: 8
@@ -168,137 +2217,137 @@ menu.overlap.x: -8
 menu.overlap.y: 0
 
 # Border colors
-window.active.border.color: #88C0D0
-window.inactive.border.color: #3B4252
-menu.border.color: #88C0D0
-window.active.client.color: #2E3440
-window.inactive.client.color: #2E3440
+window.active.border.color: {{nord8}}
+window.inactive.border.color: {{nord1}}
+menu.border.color: {{nord8}}
+window.active.client.color: {{nord0}}
+window.inactive.client.color: {{nord0}}
 
 # Titlebar
 window.active.title.bg: flat solid
-window.active.title.bg.color: #2E3440
-window.active.title.separator.color: #2E3440
+window.active.title.bg.color: {{nord0}}
+window.active.title.separator.color: {{nord0}}
 window.inactive.title.bg: flat solid
-window.inactive.title.bg.color: #2E3440
-window.inactive.title.separator.color: #2E3440
+window.inactive.title.bg.color: {{nord0}}
+window.inactive.title.separator.color: {{nord0}}
 
 # Titlebar text
 window.label.text.justify: left
 window.active.label.bg: parentrelative
-window.active.label.text.color: #88C0D0
+window.active.label.text.color: {{nord8}}
 window.inactive.label.bg: parentrelative
-window.inactive.label.text.color: #4C566A
+window.inactive.label.text.color: {{nord3}}
 
 # Window buttons
 window.active.button.unpressed.bg: flat solid
-window.active.button.unpressed.bg.color: #2E3440
-window.active.button.unpressed.image.color: #88C0D0
+window.active.button.unpressed.bg.color: {{nord0}}
+window.active.button.unpressed.image.color: {{nord8}}
 
 window.active.button.pressed.bg: flat solid
-window.active.button.pressed.bg.color: #3B4252
-window.active.button.pressed.image.color: #8FBCBB
+window.active.button.pressed.bg.color: {{nord1}}
+window.active.button.pressed.image.color: {{nord7}}
 
 window.active.button.disabled.bg: flat solid
-window.active.button.disabled.bg.color: #2E3440
-window.active.button.disabled.image.color: #4C566A
+window.active.button.disabled.bg.color: {{nord0}}
+window.active.button.disabled.image.color: {{nord3}}
 
 window.active.button.hover.bg: flat solid
-window.active.button.hover.bg.color: #3B4252
-window.active.button.hover.image.color: #8FBCBB
+window.active.button.hover.bg.color: {{nord1}}
+window.active.button.hover.image.color: {{nord7}}
 
 window.active.button.toggled.unpressed.bg: flat solid
-window.active.button.toggled.unpressed.bg.color: #2E3440
-window.active.button.toggled.unpressed.image.color: #88C0D0
+window.active.button.toggled.unpressed.bg.color: {{nord0}}
+window.active.button.toggled.unpressed.image.color: {{nord8}}
 
 window.active.button.toggled.pressed.bg: flat solid
-window.active.button.toggled.pressed.bg.color: #3B4252
-window.active.button.toggled.pressed.image.color: #8FBCBB
+window.active.button.toggled.pressed.bg.color: {{nord1}}
+window.active.button.toggled.pressed.image.color: {{nord7}}
 
 window.active.button.toggled.hover.bg: flat solid
-window.active.button.toggled.hover.bg.color: #3B4252
-window.active.button.toggled.hover.image.color: #8FBCBB
+window.active.button.toggled.hover.bg.color: {{nord1}}
+window.active.button.toggled.hover.image.color: {{nord7}}
 
 window.inactive.button.unpressed.bg: flat solid
-window.inactive.button.unpressed.bg.color: #2E3440
-window.inactive.button.unpressed.image.color: #4C566A
+window.inactive.button.unpressed.bg.color: {{nord0}}
+window.inactive.button.unpressed.image.color: {{nord3}}
 
 window.inactive.button.pressed.bg: flat solid
-window.inactive.button.pressed.bg.color: #3B4252
-window.inactive.button.pressed.image.color: #4C566A
+window.inactive.button.pressed.bg.color: {{nord1}}
+window.inactive.button.pressed.image.color: {{nord3}}
 
 window.inactive.button.disabled.bg: flat solid
-window.inactive.button.disabled.bg.color: #2E3440
-window.inactive.button.disabled.image.color: #3B4252
+window.inactive.button.disabled.bg.color: {{nord0}}
+window.inactive.button.disabled.image.color: {{nord1}}
 
 window.inactive.button.hover.bg: flat solid
-window.inactive.button.hover.bg.color: #3B4252
-window.inactive.button.hover.image.color: #D8DEE9
+window.inactive.button.hover.bg.color: {{nord1}}
+window.inactive.button.hover.image.color: {{nord4}}
 
 window.inactive.button.toggled.unpressed.bg: flat solid
-window.inactive.button.toggled.unpressed.bg.color: #2E3440
-window.inactive.button.toggled.unpressed.image.color: #4C566A
+window.inactive.button.toggled.unpressed.bg.color: {{nord0}}
+window.inactive.button.toggled.unpressed.image.color: {{nord3}}
 
 window.inactive.button.toggled.pressed.bg: flat solid
-window.inactive.button.toggled.pressed.bg.color: #3B4252
-window.inactive.button.toggled.pressed.image.color: #4C566A
+window.inactive.button.toggled.pressed.bg.color: {{nord1}}
+window.inactive.button.toggled.pressed.image.color: {{nord3}}
 
 window.inactive.button.toggled.hover.bg: flat solid
-window.inactive.button.toggled.hover.bg.color: #3B4252
-window.inactive.button.toggled.hover.image.color: #D8DEE9
+window.inactive.button.toggled.hover.bg.color: {{nord1}}
+window.inactive.button.toggled.hover.image.color: {{nord4}}
 
 # Menu
 menu.title.bg: flat solid
-menu.title.bg.color: #2E3440
-menu.title.text.color: #88C0D0
+menu.title.bg.color: {{nord0}}
+menu.title.text.color: {{nord8}}
 menu.title.text.justify: center
 
 menu.items.bg: flat solid
-menu.items.bg.color: #2E3440
-menu.items.text.color: #D8DEE9
-menu.items.disabled.text.color: #4C566A
+menu.items.bg.color: {{nord0}}
+menu.items.text.color: {{nord4}}
+menu.items.disabled.text.color: {{nord3}}
 
 menu.items.active.bg: flat solid
-menu.items.active.bg.color: #88C0D0
-menu.items.active.text.color: #2E3440
+menu.items.active.bg.color: {{nord8}}
+menu.items.active.text.color: {{nord0}}
 
-menu.separator.color: #3B4252
+menu.separator.color: {{nord1}}
 menu.separator.width: 1
 menu.separator.padding.width: 6
 menu.separator.padding.height: 3
 
 # OSD
 osd.border.width: 2
-osd.border.color: #88C0D0
+osd.border.color: {{nord8}}
 
 osd.bg: flat solid
-osd.bg.color: #2E3440
+osd.bg.color: {{nord0}}
 osd.label.bg: flat solid
-osd.label.bg.color: #2E3440
-osd.label.text.color: #D8DEE9
+osd.label.bg.color: {{nord0}}
+osd.label.text.color: {{nord4}}
 
 osd.hilight.bg: flat solid
-osd.hilight.bg.color: #88C0D0
+osd.hilight.bg.color: {{nord8}}
 
 osd.unhilight.bg: flat solid
-osd.unhilight.bg.color: #3B4252
+osd.unhilight.bg.color: {{nord1}}
 
 osd.button.unpressed.bg: flat border
-osd.button.unpressed.bg.color: #2E3440
-osd.button.unpressed.*.border.color: #3B4252
-osd.button.unpressed.text.color: #D8DEE9
+osd.button.unpressed.bg.color: {{nord0}}
+osd.button.unpressed.*.border.color: {{nord1}}
+osd.button.unpressed.text.color: {{nord4}}
 
 osd.button.pressed.bg: flat border
-osd.button.pressed.bg.color: #88C0D0
-osd.button.pressed.*.border.color: #88C0D0
-osd.button.pressed.text.color: #2E3440
-osd.button.pressed.box.color: #88C0D0
+osd.button.pressed.bg.color: {{nord8}}
+osd.button.pressed.*.border.color: {{nord8}}
+osd.button.pressed.text.color: {{nord0}}
+osd.button.pressed.box.color: {{nord8}}
 
 osd.button.focused.bg: flat solid border
-osd.button.focused.bg.color: #2E3440
-osd.button.focused.*.border.color: #88C0D0
-osd.button.focused.text.color: #88C0D0
-osd.button.focused.box.color: #88C0D0
-"""
+osd.button.focused.bg.color: {{nord0}}
+osd.button.focused.*.border.color: {{nord8}}
+osd.button.focused.text.color: {{nord8}}
+osd.button.focused.box.color: {{nord8}}
+""")
     
     theme_path = Path.home() / '.themes' / 'Nord' / 'openbox-3' / 'themerc'
     write_file(theme_path, theme_content)
@@ -307,7 +2356,7 @@ def create_openbox_config():
     """Create Openbox configuration"""
     print_status("Configuring Openbox...", Colors.YELLOW)
     
-    rc_xml = """<?xml version="1.0" encoding="UTF-8"?>
+    rc_xml = render("""<?xml version="1.0" encoding="UTF-8"?>
 <openbox_config xmlns="http://openbox.org/3.4/rc" xmlns:xi="http://www.w3.org/2001/XInclude">
   <resistance>
     <strength>10</strength>
@@ -326,37 +2375,37 @@ def create_openbox_config():
     <keepBorder>yes</keepBorder>
     <animateIconify>yes</animateIconify>
     <font place="ActiveWindow">
-      <name>Noto Sans</name>
+      <name>{{font}}</name>
       <size>10</size>
       <weight>Bold</weight>
       <slant>Normal</slant>
     </font>
     <font place="InactiveWindow">
-      <name>Noto Sans</name>
+      <name>{{font}}</name>
       <size>10</size>
       <weight>Normal</weight>
       <slant>Normal</slant>
     </font>
     <font place="MenuHeader">
-      <name>Noto Sans</name>
+      <name>{{font}}</name>
       <size>10</size>
       <weight>Bold</weight>
       <slant>Normal</slant>
     </font>
     <font place="MenuItem">
-      <name>Noto Sans</name>
+      <name>{{font}}</name>
       <size>10</size>
       <weight>Normal</weight>
       <slant>Normal</slant>
     </font>
     <font place="ActiveOnScreenDisplay">
-      <name>Noto Sans</name>
+      <name>{{font}}</name>
       <size>10</size>
       <weight>Bold</weight>
       <slant>Normal</slant>
     </font>
     <font place="InactiveOnScreenDisplay">
-      <name>Noto Sans</name>
+      <name>{{font}}</name>
       <size>10</size>
       <weight>Normal</weight>
       <slant>Normal</slant>
@@ -448,61 +2497,382 @@ def create_openbox_config():
     </context>
   </mouse>
 </openbox_config>
-"""
+""")
     
     config_path = Path.home() / '.config' / 'openbox' / 'rc.xml'
     write_file(config_path, rc_xml)
 
+NETWORK_CACHE_HELPER = Path.home() / '.config' / 'rofi' / 'network-cache'
+
+# Refreshes the rofi network menu's Wi-Fi list on NetworkManager events and on a timer, since
+# new scan results arrive without an event. Reads NetworkManager's last scan, never rescans.
+NETWORK_CACHE_SCRIPT = r"""#!/usr/bin/env python3
+# Pre-parsed Wi-Fi list for the rofi network menu: network-cache refresh | watch
+
+import os
+import re
+import select
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+CACHE = Path(os.environ.get('XDG_RUNTIME_DIR') or Path.home() / '.cache') / 'openbox-network' / 'networks'
+PERIOD = 20
+SETTLE = 0.3
+
+
+def nmcli(*args):
+    result = subprocess.run(['nmcli', '--terse', *args], capture_output=True, text=True)
+    return result.stdout.splitlines() if result.returncode == 0 else []
+
+
+def fields(line):
+    # Terse output escapes ':' and '\\' inside values with a backslash
+    return [re.sub(r'\\(.)', r'\1', value) for value in re.split(r'(?<!\\):', line)]
+
+
+def refresh():
+    wifi = next(iter(nmcli('--fields', 'WIFI', 'general')), 'unknown')
+    active = ''
+    for line in nmcli('--fields', 'NAME,TYPE', 'connection', 'show', '--active'):
+        name, kind = fields(line)[:2]
+        if kind != 'loopback':
+            active = name
+            break
+    
+    networks = {}
+    for line in nmcli('--fields', 'SSID,SIGNAL,SECURITY', 'device', 'wifi', 'list', '--rescan', 'no'):
+        ssid, signal, security = fields(line)[:3]
+        if ssid and int(signal or 0) > networks.get(ssid, (-1, ''))[0]:
+            networks[ssid] = (int(signal or 0), security or '--')
+    
+    rows = [f'{wifi}\t{active}']
+    rows += [f'{ssid}\t{signal}\t{security}'
+             for ssid, (signal, security) in sorted(networks.items(), key=lambda item: -item[1][0])]
+    CACHE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE.with_name(f'.networks.{os.getpid()}')
+    tmp.write_text('\n'.join(rows) + '\n')
+    os.replace(tmp, CACHE)
+
+
+def watch():
+    while True:
+        refresh()
+        monitor = subprocess.Popen(['nmcli', 'monitor'], stdout=subprocess.PIPE)
+        fd = monitor.stdout.fileno()
+        while True:
+            if not select.select([fd], [], [], PERIOD)[0]:
+                refresh()
+                continue
+            if not os.read(fd, 65536):
+                break
+            # Events come in bursts, refresh once they settle
+            while select.select([fd], [], [], SETTLE)[0]:
+                if not os.read(fd, 65536):
+                    break
+            refresh()
+        # NetworkManager restarted, give it a moment before monitoring again
+        monitor.wait()
+        time.sleep(5)
+
+
+if __name__ == '__main__':
+    {'refresh': refresh, 'watch': watch}[sys.argv[1] if len(sys.argv) > 1 else 'refresh']()
+"""
+
+class SessionService:
+    """A program the Openbox session starts at login
+
+    Critical services start together right away, the others once every
+    critical one is ready. ready is 'exit' for commands that return when
+    the service is up (picom -b forks after initialising, launch.sh waits
+    for the bar's IPC socket), a D-Bus name the service claims, or None
+    when having started it is all there is to wait for.
+    """
+
+    def __init__(self, name: str, command: List[str], critical: bool = False, ready: Optional[str] = None,
+                 binary: Optional[str] = None):
+        self.name = name
+        self.command = command
+        self.critical = critical
+        self.ready = ready
+        self.binary = binary or command[0]
+
+SESSION_SERVICES = [
+    # nitrogen restores bg-saved.cfg, which already holds the wallpaper in zoom-fill mode
+    SessionService('wallpaper', ['nitrogen', '--restore'], critical=True, ready='exit'),
+    SessionService('picom', ['picom', '-b', '--config', str(Path.home() / '.config' / 'picom' / 'picom.conf')],
+                   critical=True, ready='exit'),
+    SessionService('dunst', ['dunst'], critical=True, ready='org.freedesktop.Notifications'),
+    SessionService('polybar', [str(Path.home() / '.config' / 'polybar' / 'launch.sh')], critical=True,
+                   ready='exit', binary='polybar'),
+    SessionService('nm-applet', ['nm-applet']),
+    SessionService('network-cache', [str(NETWORK_CACHE_HELPER), 'watch'], binary='nmcli'),
+    SessionService('volumeicon', ['volumeicon']),
+    SessionService('polkit-agent', ['/usr/libexec/polkit-gnome-authentication-agent-1']),
+    SessionService('clipit', ['clipit']),
+]
+
+def session_commands() -> List[Tuple[str, Optional[List[str]]]]:
+    """(name, command with the binary resolved) per session service, None when it isn't installed"""
+    commands = []
+    for service in SESSION_SERVICES:
+        binary = shutil.which(service.binary)
+        command = service.command
+        if binary and service.binary == command[0]:
+            command = [binary, *command[1:]]
+        commands.append((service.name, command if binary else None))
+    return commands
+
 def create_openbox_autostart():
     """Create Openbox autostart script"""
     print_status("Creating Openbox autostart...", Colors.YELLOW)
     
-    wallpaper_path = Path.home() / 'Pictures' / 'Wallpapers' / 'nord-mountain.png'
+    # Everything is resolved now, so a login runs no command -v probes
+    gdbus = shutil.which('gdbus')
+    critical = []
+    deferred = []
+    for service, (name, command) in zip(SESSION_SERVICES, session_commands()):
+        lines = critical if service.critical else deferred
+        if command is None:
+            lines.append(f"# {name}: {service.binary} is not installed")
+            continue
+        
+        command = shlex.join(command)
+        if service.ready == 'exit':
+            lines.append(f"{{ {command} && mark {name} ready || mark {name} failed; }} &")
+            lines.append("waiting+=($!)")
+        elif service.ready and gdbus:
+            lines.append(f"{command} &")
+            lines.append(f"{{ {shlex.quote(gdbus)} wait --session --timeout 10 {service.ready}; mark {name} ready; }} &")
+            lines.append("waiting+=($!)")
+        else:
+            lines.append(f"{command} &")
+            lines.append(f"mark {name} started")
     
-    autostart = f"""#!/bin/bash
+    autostart = """#!/bin/bash
+# Generated by openbox-setup: critical services start first, the rest once
+# those are ready. Time to ready per service is logged for tuning logins.
 
-# Set wallpaper
-if [ -f {wallpaper_path} ]; then
-    nitrogen --set-zoom-fill {wallpaper_path} &
-else
-    nitrogen --restore &
-fi
+log="${XDG_CACHE_HOME:-$HOME/.cache}/openbox-session.log"
+t0=${EPOCHREALTIME//[!0-9]/}
+waiting=()
 
-# Compositor for transparency and effects
-picom -b --config ~/.config/picom/picom.conf &
+mark() {
+    printf '%(%F %T)T %-14s %-7s after %d ms\\n' -1 "$1" "$2" $(( (${EPOCHREALTIME//[!0-9]/} - t0) / 1000 )) >> "$log"
+}
 
-# Notification daemon
-dunst &
+# Wallpaper, compositor, notifications and bar
+""" + '\n'.join(critical) + """
 
-# Polybar
-~/.config/polybar/launch.sh &
+wait "${waiting[@]}"
+mark desktop ready
 
-# Network manager applet
-nm-applet &
+# Tray applets and helpers
+""" + '\n'.join(deferred) + '\n'
+    
+    autostart_path = Path.home() / '.config' / 'openbox' / 'autostart'
+    write_file(autostart_path, autostart, mode=0o755)
 
-# Volume icon in system tray (if available)
-if command -v volumeicon &> /dev/null; then
-    volumeicon &
-fi
+XDG_MENU_HELPER = Path.home() / '.config' / 'openbox' / 'xdg-menu'
 
-# Polkit authentication agent
-/usr/libexec/polkit-gnome-authentication-agent-1 &
+# Openbox pipe menu of the installed applications. The index keeps every parsed .desktop file
+# with its stat data and every application directory's mtime. A right-click only stats the
+# directories and prints the last rendered menu; changed directories are rescanned and only
+# the files in them whose stat data changed are parsed again.
+XDG_MENU_SCRIPT = r"""#!/usr/bin/env -S python3 -S
+# Openbox pipe menu of XDG applications, served from an incrementally updated index
 
-# Clipboard manager
-if command -v clipit &> /dev/null; then
-    clipit &
-fi
-"""
+import json
+import os
+import sys
+
+CACHE = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+INDEX = os.path.join(CACHE, 'openbox-xdg-menu.json')
+# The rendered menu after a line with the directory mtimes it was built from
+MENU = os.path.join(CACHE, 'openbox-xdg-menu.xml')
+TERMINAL = 'alacritty -e'
+
+CATEGORIES = [
+    ('AudioVideo', 'Multimedia'), ('Development', 'Development'), ('Education', 'Education'),
+    ('Game', 'Games'), ('Graphics', 'Graphics'), ('Network', 'Internet'), ('Office', 'Office'),
+    ('Science', 'Science'), ('Settings', 'Settings'), ('System', 'System'), ('Utility', 'Accessories'),
+]
+
+
+def application_dirs():
+    data_home = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    data_dirs = (os.environ.get('XDG_DATA_DIRS') or '/usr/local/share:/usr/share').split(':')
+    return [os.path.join(d, 'applications') for d in [data_home, *data_dirs] if d]
+
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def on_path(program):
+    if os.sep in program:
+        return os.access(program, os.X_OK)
+    return any(os.access(os.path.join(d, program), os.X_OK) for d in os.environ.get('PATH', '').split(':') if d)
+
+
+def parse(path):
+    # The [Desktop Entry] group of a .desktop file, None when it is not shown in an Openbox menu
+    entry = {}
+    group = None
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    group = line
+                elif group == '[Desktop Entry]' and '=' in line and not line.startswith('#'):
+                    key, value = line.split('=', 1)
+                    entry.setdefault(key.strip(), value.strip())
+    except OSError:
+        return None
     
-    autostart_path = Path.home() / '.config' / 'openbox' / 'autostart'
-    write_file(autostart_path, autostart)
-    autostart_path.chmod(0o755)
+    desktops = lambda key: [d for d in entry.get(key, '').split(';') if d]
+    if (entry.get('Type') != 'Application' or 'Exec' not in entry or 'Name' not in entry
+            or entry.get('NoDisplay') == 'true' or entry.get('Hidden') == 'true'
+            or (desktops('OnlyShowIn') and 'Openbox' not in desktops('OnlyShowIn'))
+            or 'Openbox' in desktops('NotShowIn')
+            or (entry.get('TryExec') and not on_path(entry['TryExec']))):
+        return None
+    
+    # Drop field codes, the menu starts applications without files or URLs
+    words = [word for word in entry['Exec'].split() if not (len(word) == 2 and word[0] == '%' and word != '%%')]
+    command = ' '.join(words).replace('%%', '%')
+    if entry.get('Terminal') == 'true':
+        command = f'{TERMINAL} {command}'
+    return {'name': entry['Name'], 'command': command, 'categories': desktops('Categories')}
+
+
+def update(index):
+    # Rescan directories whose mtime changed, returns whether anything did
+    roots = application_dirs()
+    if index.get('roots') != roots:
+        index.clear()
+        index.update(roots=roots, dirs={}, files={})
+    dirs, files = index['dirs'], index['files']
+    
+    pending = [d for d in roots if d not in dirs] + [d for d, seen in dirs.items() if mtime(d) != seen]
+    changed = bool(pending)
+    while pending:
+        directory = pending.pop()
+        stamp = mtime(directory)
+        dirs[directory] = stamp
+        prefix = directory + os.sep
+        children = {}
+        if stamp is not None:
+            try:
+                with os.scandir(directory) as scan:
+                    for item in scan:
+                        if item.is_dir():
+                            if item.path not in dirs:
+                                pending.append(item.path)
+                        elif item.name.endswith('.desktop'):
+                            children[item.path] = item.stat()
+            except OSError:
+                pass
+        
+        for path in [p for p in files if p.startswith(prefix) and os.sep not in p[len(prefix):]]:
+            if path not in children:
+                del files[path]
+        for sub in [d for d in dirs if d.startswith(prefix) and stamp is None]:
+            dirs[sub] = None
+            pending.append(sub)
+        for path, st in children.items():
+            known = files.get(path)
+            if not known or known[:2] != [st.st_mtime_ns, st.st_size]:
+                files[path] = [st.st_mtime_ns, st.st_size, parse(path)]
+    
+    for directory in [d for d, seen in dirs.items() if seen is None and d not in roots]:
+        del dirs[directory]
+    return changed
+
+
+def escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+def render(index):
+    # Desktop IDs from earlier directories win, like the XDG spec says
+    applications = {}
+    for root in index['roots']:
+        prefix = root + os.sep
+        for path, (_, _, entry) in sorted(index['files'].items()):
+            if path.startswith(prefix):
+                desktop_id = path[len(prefix):].replace(os.sep, '-')
+                applications.setdefault(desktop_id, entry)
+    
+    menus = {label: [] for _, label in CATEGORIES}
+    menus['Other'] = []
+    for entry in applications.values():
+        if entry:
+            label = next((label for category, label in CATEGORIES if category in entry['categories']), 'Other')
+            menus[label].append(entry)
+    
+    out = ['<openbox_pipe_menu>']
+    for label, entries in menus.items():
+        if not entries:
+            continue
+        out.append(f'<menu id="xdg-menu-{label.lower()}" label="{label}">')
+        for entry in sorted(entries, key=lambda e: e['name'].lower()):
+            out.append(f'<item label="{escape(entry["name"])}"><action name="Execute">'
+                       f'<command>{escape(entry["command"])}</command></action></item>')
+        out.append('</menu>')
+    out.append('</openbox_pipe_menu>')
+    return '\n'.join(out) + '\n'
+
+
+def write_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def main():
+    # Fast path: nothing changed since the menu was rendered, so the index isn't even read
+    try:
+        with open(MENU) as f:
+            stamps = json.loads(f.readline())
+            if stamps['roots'] == application_dirs() and all(mtime(d) == m for d, m in stamps['dirs'].items()):
+                sys.stdout.write(f.read())
+                return
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    try:
+        with open(INDEX) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    if update(index):
+        write_atomic(INDEX, json.dumps(index))
+    menu = render(index)
+    write_atomic(MENU, json.dumps({'roots': index['roots'], 'dirs': index['dirs']}) + '\n' + menu)
+    sys.stdout.write(menu)
+
+
+if __name__ == '__main__':
+    main()
+"""
 
 def create_openbox_menu():
     """Create Openbox right-click menu"""
     print_status("Creating Openbox menu...", Colors.YELLOW)
     
-    menu_xml = """<?xml version="1.0" encoding="UTF-8"?>
+    # Applications come from the installed .desktop files through the xdg-menu pipe menu
+    write_file(XDG_MENU_HELPER, XDG_MENU_SCRIPT, mode=0o755)
+    
+    menu_xml = render("""<?xml version="1.0" encoding="UTF-8"?>
 <openbox_menu xmlns="http://openbox.org/3.4/menu">
     <menu id="root-menu" label="Openbox">
         <item label="Terminal">
@@ -526,28 +2896,7 @@ def create_openbox_menu():
             </action>
         </item>
         <separator />
-        <menu id="applications-menu" label="Applications">
-            <item label="Calculator">
-                <action name="Execute">
-                    <command>gnome-calculator</command>
-                </action>
-            </item>
-            <item label="Image Viewer">
-                <action name="Execute">
-                    <command>eog</command>
-                </action>
-            </item>
-            <item label="Video Player">
-                <action name="Execute">
-                    <command>mpv</command>
-                </action>
-            </item>
-            <item label="Archive Manager">
-                <action name="Execute">
-                    <command>file-roller</command>
-                </action>
-            </item>
-        </menu>
+        <menu id="applications-menu" label="Applications" execute="{{home}}/.config/openbox/xdg-menu" />
         <separator />
         <menu id="settings-menu" label="Settings">
             <item label="Openbox Configuration">
@@ -587,23 +2936,89 @@ def create_openbox_menu():
         </item>
     </menu>
 </openbox_menu>
-"""
+""")
     
     menu_path = Path.home() / '.config' / 'openbox' / 'menu.xml'
     write_file(menu_path, menu_xml)
 
-def create_picom_config():
-    """Create Picom compositor configuration"""
-    print_status("Configuring picom compositor...", Colors.YELLOW)
+# Compositor effects per tier, from everything on down to what software rendering copes with
+PICOM_TIERS = {
+    'full': {
+        'backend': 'glx', 'vsync': 'true', 'shadow': 'true', 'shadow_radius': '12', 'fading': 'true',
+        'blur': 'true', 'blur_method': 'dual_kawase', 'corner_radius': '8',
+    },
+    'reduced': {
+        'backend': 'glx', 'vsync': 'true', 'shadow': 'true', 'shadow_radius': '6', 'fading': 'true',
+        'blur': 'false', 'blur_method': 'none', 'corner_radius': '8',
+    },
+    'minimal': {
+        'backend': 'xrender', 'vsync': 'false', 'shadow': 'false', 'shadow_radius': '12', 'fading': 'false',
+        'blur': 'false', 'blur_method': 'none', 'corner_radius': '0',
+    },
+}
+
+# Tier set with --picom-tier, auto picks one from probe_graphics()
+PICOM_TIER = 'auto'
+
+# Kernel DRM drivers of GPUs with 3D acceleration, others (simpledrm, bochs, qxl, ...) mean software GL
+ACCELERATED_DRIVERS = {'i915', 'xe', 'amdgpu', 'radeon', 'nouveau', 'nvidia', 'msm', 'panfrost', 'lima', 'v3d',
+                       'vc4', 'virtio_gpu', 'vmwgfx'}
+
+SOFTWARE_RENDERERS = ('llvmpipe', 'softpipe', 'swrast')
+
+def _probe_output(cmd: List[str]) -> Optional[str]:
+    """Output of a probe command, None if it is missing or fails"""
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout if result.returncode == 0 else None
+
+@functools.lru_cache(maxsize=None)
+def probe_graphics(sys_root: Path = Path('/sys'), dev_root: Path = Path('/dev')) -> Dict:
+    """GPU drivers, render node, GL renderer (with an X display) and virtualization of this machine"""
+    drivers = set()
+    for card in (sys_root / 'class' / 'drm').glob('card*'):
+        driver = card / 'device' / 'driver'
+        if re.fullmatch(r'card\d+', card.name) and driver.exists():
+            drivers.add(driver.resolve().name)
     
-    picom_config = """# Nord-themed Picom Configuration
+    renderer = None
+    if os.environ.get('DISPLAY'):
+        match = re.search(r'OpenGL renderer string: (.*)', _probe_output(['glxinfo', '-B']) or '')
+        renderer = match.group(1).strip() if match else None
+    
+    virtualization = (_probe_output(['systemd-detect-virt', '--vm']) or '').strip() or None
+    return {
+        'drivers': sorted(drivers),
+        'render_node': any((dev_root / 'dri').glob('renderD*')),
+        'renderer': renderer,
+        'virtualization': virtualization,
+    }
+
+def picom_tier(graphics: Dict) -> Tuple[str, str]:
+    """(tier, reason) for the compositor on probed graphics"""
+    if graphics['renderer'] and any(name in graphics['renderer'].lower() for name in SOFTWARE_RENDERERS):
+        return 'minimal', f"software OpenGL ({graphics['renderer']})"
+    if not graphics['render_node'] or not ACCELERATED_DRIVERS.intersection(graphics['drivers']):
+        return 'minimal', f"no accelerated GPU (drivers: {', '.join(graphics['drivers']) or 'none'})"
+    if graphics['virtualization']:
+        return 'reduced', f"virtual GPU in {graphics['virtualization']}"
+    return 'full', f"accelerated GPU ({graphics['renderer'] or ', '.join(graphics['drivers'])})"
+
+def selected_picom_tier() -> Tuple[str, str]:
+    if PICOM_TIER != 'auto':
+        return PICOM_TIER, "chosen with --picom-tier"
+    return picom_tier(probe_graphics())
+
+PICOM_CONFIG = """# Nord-themed Picom Configuration
 
 # Shadow
-shadow = true;
-shadow-radius = 12;
+shadow = {{shadow}};
+shadow-radius = {{shadow_radius}};
 shadow-opacity = 0.75;
-shadow-offset-x = -12;
-shadow-offset-y = -12;
+shadow-offset-x = -{{shadow_radius}};
+shadow-offset-y = -{{shadow_radius}};
 shadow-color = "#000000"
 
 shadow-exclude = [
@@ -615,7 +3030,7 @@ shadow-exclude = [
 ];
 
 # Fading
-fading = true;
+fading = {{fading}};
 fade-in-step = 0.03;
 fade-out-step = 0.03;
 fade-delta = 5;
@@ -636,9 +3051,9 @@ opacity-rule = [
 ];
 
 # Background blurring
-blur-method = "dual_kawase";
+blur-method = "{{blur_method}}";
 blur-strength = 5;
-blur-background = true;
+blur-background = {{blur}};
 blur-background-frame = true;
 blur-background-fixed = true;
 
@@ -649,15 +3064,15 @@ blur-background-exclude = [
 ];
 
 # Corners
-corner-radius = 8;
+corner-radius = {{corner_radius}};
 rounded-corners-exclude = [
   "window_type = 'dock'",
   "window_type = 'desktop'"
 ];
 
 # General Settings
-backend = "glx";
-vsync = true;
+backend = "{{backend}}";
+vsync = {{vsync}};
 mark-wmwin-focused = true;
 mark-ovredir-focused = true;
 detect-rounded-corners = true;
@@ -677,36 +3092,156 @@ wintypes:
   dropdown_menu = { opacity = 0.95; }
 };
 """
+
+def create_picom_config():
+    """Create Picom compositor configuration"""
+    print_status("Configuring picom compositor...", Colors.YELLOW)
+    
+    tier, reason = selected_picom_tier()
+    print_status(f"Compositor tier: {tier}, {reason}", Colors.BLUE)
+    picom_config = render(PICOM_CONFIG, **PICOM_TIERS[tier])
     
     picom_path = Path.home() / '.config' / 'picom' / 'picom.conf'
     write_file(picom_path, picom_config)
 
-def create_polybar_config():
-    """Create Polybar configuration"""
-    print_status("Configuring Polybar...", Colors.YELLOW)
+# Module polling per bar profile, slower profiles wake the CPU less often
+POLYBAR_PROFILES = {
+    'performance': {
+        'date_interval': '1', 'time_format': '%H:%M:%S', 'cpu_interval': '1', 'memory_interval': '2',
+        'temperature_interval': '2', 'network_interval': '2.0', 'battery_poll': '5',
+        'charging_format': '<animation-charging> <label-charging>',
+    },
+    'balanced': {
+        'date_interval': '1', 'time_format': '%H:%M:%S', 'cpu_interval': '2', 'memory_interval': '3',
+        'temperature_interval': '5', 'network_interval': '3.0', 'battery_poll': '5',
+        'charging_format': '<animation-charging> <label-charging>',
+    },
+    'power-saver': {
+        'date_interval': '5', 'time_format': '%H:%M', 'cpu_interval': '10', 'memory_interval': '10',
+        'temperature_interval': '15', 'network_interval': '10.0', 'battery_poll': '30',
+        'charging_format': '<ramp-capacity> <label-charging>',
+    },
+}
+
+# Profile set with --polybar-profile
+POLYBAR_PROFILE = 'balanced'
+
+# Package temperature sensors by hwmon driver, preferred over ACPI thermal zones
+CPU_SENSORS = {'coretemp': 'Package id 0', 'k10temp': 'Tctl', 'zenpower': 'Tctl'}
+
+def find_power_supplies(sys_root: Path = Path('/sys')) -> Tuple[Optional[str], Optional[str]]:
+    """(battery, AC adapter) names from the power supply class, None for what the machine doesn't have"""
+    battery = adapter = None
+    for supply in sorted((sys_root / 'class' / 'power_supply').glob('*')):
+        try:
+            kind = (supply / 'type').read_text().strip()
+            # Wireless mice and other peripherals report their batteries here too
+            scope = (supply / 'scope').read_text().strip() if (supply / 'scope').exists() else 'System'
+        except OSError:
+            continue
+        if kind == 'Battery' and scope != 'Device' and battery is None:
+            battery = supply.name
+        elif kind == 'Mains' and adapter is None:
+            adapter = supply.name
+    return battery, adapter
+
+def find_temperature_source(sys_root: Path = Path('/sys')) -> Optional[str]:
+    """polybar setting reading the CPU temperature: a package hwmon sensor, else a thermal zone"""
+    for hwmon in sorted((sys_root / 'class' / 'hwmon').glob('hwmon*')):
+        try:
+            label = CPU_SENSORS.get((hwmon / 'name').read_text().strip())
+        except OSError:
+            continue
+        if not label:
+            continue
+        for sensor in sorted(hwmon.glob('temp*_label')):
+            if sensor.read_text().strip() == label:
+                # hwmonN numbering changes between boots, the device path doesn't
+                return f"hwmon-path = {(hwmon / sensor.name.replace('_label', '_input')).resolve()}"
     
-    polybar_config = """;==========================================================
+    zones = sorted((sys_root / 'class' / 'thermal').glob('thermal_zone*'), key=lambda p: int(p.name[12:]))
+    for zone in zones:
+        try:
+            if (zone / 'type').read_text().strip() == 'x86_pkg_temp':
+                return f"thermal-zone = {zone.name[12:]}"
+        except OSError:
+            continue
+    return f"thermal-zone = {zones[0].name[12:]}" if zones else None
+
+def find_network_interface(sys_root: Path = Path('/sys'), proc_root: Path = Path('/proc')) -> Optional[Tuple[str, str]]:
+    """(interface, 'wireless' or 'wired') carrying the default route, else the first wireless one"""
+    interface = None
+    try:
+        for line in (proc_root / 'net' / 'route').read_text().splitlines()[1:]:
+            fields = line.split()
+            if len(fields) > 1 and fields[1] == '00000000':
+                interface = fields[0]
+                break
+    except OSError:
+        pass
+    if interface is None:
+        wireless = sorted(path.parent.name for path in (sys_root / 'class' / 'net').glob('*/wireless'))
+        interface = wireless[0] if wireless else None
+    if interface is None:
+        return None
+    wireless = (sys_root / 'class' / 'net' / interface / 'wireless').exists()
+    return interface, 'wireless' if wireless else 'wired'
+
+def polybar_settings(profile: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """Polling intervals of a profile plus the hardware the bar modules read"""
+    battery, adapter = find_power_supplies()
+    network = find_network_interface()
+    return {
+        **POLYBAR_PROFILES[profile or POLYBAR_PROFILE],
+        'battery': battery,
+        'adapter': adapter or 'AC',
+        'temperature_source': find_temperature_source(),
+        'interface': network[0] if network else None,
+        'interface_type': network[1] if network else None,
+        'network_label': '📶 %essid%' if network and network[1] == 'wireless' else '🌐 %local_ip%',
+    }
+
+def polybar_config(settings: Dict[str, Optional[str]]) -> str:
+    """Bar config with the modules the hardware supports, polled as the profile says"""
+    modules = ['pulseaudio', 'memory', 'cpu']
+    sections = []
+    if settings['temperature_source']:
+        modules.append('temperature')
+        sections.append(POLYBAR_TEMPERATURE)
+    if settings['interface']:
+        modules.append('network')
+        sections.append(POLYBAR_NETWORK)
+    if settings['battery']:
+        modules.append('battery')
+        sections.append(POLYBAR_BATTERY)
+    modules.append('powermenu')
+    
+    values = {name: value for name, value in settings.items() if value is not None}
+    values['modules_right'] = ' '.join(modules)
+    return ''.join(render(source, **values) for source in [POLYBAR_HEAD, *sections, POLYBAR_TAIL])
+
+POLYBAR_HEAD = """;==========================================================
 ;   Polybar Nord Aurora Theme Configuration
 ;==========================================================
 
 [colors]
 ; Nord Aurora colors
-nord0 = #2E3440
-nord1 = #3B4252
-nord2 = #434C5E
-nord3 = #4C566A
-nord4 = #D8DEE9
-nord5 = #E5E9F0
-nord6 = #ECEFF4
-nord7 = #8FBCBB
-nord8 = #88C0D0
-nord9 = #81A1C1
-nord10 = #5E81AC
-nord11 = #BF616A
-nord12 = #D08770
-nord13 = #EBCB8B
-nord14 = #A3BE8C
-nord15 = #B48EAD
+nord0 = {{nord0}}
+nord1 = {{nord1}}
+nord2 = {{nord2}}
+nord3 = {{nord3}}
+nord4 = {{nord4}}
+nord5 = {{nord5}}
+nord6 = {{nord6}}
+nord7 = {{nord7}}
+nord8 = {{nord8}}
+nord9 = {{nord9}}
+nord10 = {{nord10}}
+nord11 = {{nord11}}
+nord12 = {{nord12}}
+nord13 = {{nord13}}
+nord14 = {{nord14}}
+nord15 = {{nord15}}
 
 background = ${colors.nord0}
 background-alt = ${colors.nord1}
@@ -737,13 +3272,13 @@ padding-right = 1
 module-margin-left = 1
 module-margin-right = 1
 
-font-0 = "Noto Sans:size=10;2"
-font-1 = "Noto Sans:size=10:style=Bold;2"
+font-0 = "{{font}}:size=10;2"
+font-1 = "{{font}}:size=10:style=Bold;2"
 font-2 = "Noto Emoji:scale=10;2"
 
 modules-left = workspaces xwindow
 modules-center = date
-modules-right = pulseaudio memory cpu temperature network battery powermenu
+modules-right = {{modules_right}}
 
 tray-position = right
 tray-padding = 2
@@ -780,10 +3315,10 @@ label-foreground = ${colors.primary}
 
 [module/date]
 type = internal/date
-interval = 1
+interval = {{date_interval}}
 
 date = %Y-%m-%d%
-time = %H:%M:%S
+time = {{time_format}}
 
 label = %date% %time%
 label-foreground = ${colors.secondary}
@@ -807,7 +3342,7 @@ click-right = pavucontrol
 
 [module/memory]
 type = internal/memory
-interval = 3
+interval = {{memory_interval}}
 
 format-prefix = "💾 "
 format-prefix-foreground = ${colors.primary}
@@ -815,15 +3350,18 @@ label = %percentage_used%%
 
 [module/cpu]
 type = internal/cpu
-interval = 2
+interval = {{cpu_interval}}
 
 format-prefix = "⚡ "
 format-prefix-foreground = ${colors.primary}
 label = %percentage%%
 
-[module/temperature]
+"""
+
+POLYBAR_TEMPERATURE = """[module/temperature]
 type = internal/temperature
-thermal-zone = 0
+{{temperature_source}}
+interval = {{temperature_interval}}
 warn-temperature = 70
 
 format = <ramp> <label>
@@ -838,27 +3376,33 @@ ramp-1 = 🌡️
 ramp-2 = 🌡️
 ramp-foreground = ${colors.primary}
 
-[module/network]
+"""
+
+POLYBAR_NETWORK = """[module/network]
 type = internal/network
-interface-type = wireless
-interval = 3.0
+interface = {{interface}}
+interface-type = {{interface_type}}
+interval = {{network_interval}}
 
 format-connected = <label-connected>
 format-disconnected = <label-disconnected>
 
-label-connected = 📶 %essid%
+label-connected = {{network_label}}
 label-connected-foreground = ${colors.success}
 
 label-disconnected = 📡
 label-disconnected-foreground = ${colors.alert}
 
-[module/battery]
+"""
+
+POLYBAR_BATTERY = """[module/battery]
 type = internal/battery
-battery = BAT0
-adapter = AC
+battery = {{battery}}
+adapter = {{adapter}}
 full-at = 98
+poll-interval = {{battery_poll}}
 
-format-charging = <animation-charging> <label-charging>
+format-charging = {{charging_format}}
 format-discharging = <ramp-capacity> <label-discharging>
 format-full = <ramp-capacity> <label-full>
 
@@ -881,7 +3425,9 @@ animation-charging-4 = 🔌
 animation-charging-foreground = ${colors.success}
 animation-charging-framerate = 750
 
-[module/powermenu]
+"""
+
+POLYBAR_TAIL = """[module/powermenu]
 type = custom/text
 content = ⏻
 content-foreground = ${colors.alert}
@@ -894,35 +3440,59 @@ screenchange-reload = true
 margin-top = 0
 margin-bottom = 0
 """
+
+def create_polybar_config():
+    """Create Polybar configuration"""
+    print_status("Configuring Polybar...", Colors.YELLOW)
     
     polybar_path = Path.home() / '.config' / 'polybar' / 'config.ini'
-    write_file(polybar_path, polybar_config)
+    write_file(polybar_path, polybar_config(polybar_settings()))
     
-    # Create launch script
-    launch_script = """#!/bin/bash
+    launch_path = Path.home() / '.config' / 'polybar' / 'launch.sh'
+    write_file(launch_path, polybar_launch_script(), mode=0o755)
+
+def polybar_launch_script() -> str:
+    """Script restarting the bar and returning once it is up
 
-# Terminate already running bar instances
-killall -q polybar
+    Old bars are waited for with pidwait (procps-ng 4) or pwait instead of
+    polling when either is there. The script exits once the new bar opens
+    its IPC socket, so the session's ready mark means the bar is shown.
+    """
+    waiter = shutil.which('pidwait') or shutil.which('pwait')
+    if waiter:
+        wait_for_exit = f'{os.path.basename(waiter)} -u "$UID" -x polybar'
+    else:
+        wait_for_exit = 'while pgrep -u "$UID" -x polybar >/dev/null; do sleep 0.1; done'
+    return f"""#!/bin/bash
 
-# Wait until the processes have been shut down
-while pgrep -u $UID -x polybar >/dev/null; do sleep 1; done
+# Terminate already running bar instances and wait until they have exited
+pkill -u "$UID" -x polybar && {wait_for_exit}
 
 # Launch Polybar
-polybar main 2>&1 | tee -a /tmp/polybar.log & disown
+polybar main >>/tmp/polybar.log 2>&1 &
+pid=$!
+disown
+
+# Wait up to 10 s for its IPC socket, created once the bar window is up
+runtime="${{XDG_RUNTIME_DIR:-}}"
+socket="${{runtime:+$runtime/polybar}}"
+socket="${{socket:-/tmp/polybar-$UID}}/ipc.$pid.sock"
+for _ in {{1..100}}; do
+    [[ -S $socket ]] && exit 0
+    kill -0 "$pid" 2>/dev/null || exit 1
+    sleep 0.1
+done
+exit 1
 """
-    
-    launch_path = Path.home() / '.config' / 'polybar' / 'launch.sh'
-    write_file(launch_path, launch_script)
-    launch_path.chmod(0o755)
 
 def create_rofi_config():
     """Create Rofi configuration and menus"""
     print_status("Configuring Rofi...", Colors.YELLOW)
     
     # Main Rofi config
-    rofi_config = """configuration {
+    rofi_config = render("""configuration {
     modi: "drun,run,window";
-    font: "Noto Sans 11";
+    font: "{{font}} 11";
     show-icons: true;
     icon-theme: "Papirus";
     display-drun: "Applications";
@@ -933,17 +3503,17 @@ def create_rofi_config():
 }
 
 * {
-    nord0: #2E3440;
-    nord1: #3B4252;
-    nord2: #434C5E;
-    nord3: #4C566A;
-    nord4: #D8DEE9;
-    nord5: #E5E9F0;
-    nord6: #ECEFF4;
-    nord8: #88C0D0;
-    nord9: #81A1C1;
-    nord11: #BF616A;
-    nord13: #EBCB8B;
+    nord0: {{nord0}};
+    nord1: {{nord1}};
+    nord2: {{nord2}};
+    nord3: {{nord3}};
+    nord4: {{nord4}};
+    nord5: {{nord5}};
+    nord6: {{nord6}};
+    nord8: {{nord8}};
+    nord9: {{nord9}};
+    nord11: {{nord11}};
+    nord13: {{nord13}};
     
     background-color: @nord0;
     text-color: @nord4;
@@ -1006,13 +3576,13 @@ element-icon {
 element-text {
     vertical-align: 0.5;
 }
-"""
+""")
     
     rofi_config_path = Path.home() / '.config' / 'rofi' / 'config.rasi'
     write_file(rofi_config_path, rofi_config)
     
     # Power menu script
-    powermenu_script = """#!/bin/bash
+    powermenu_script = render("""#!/bin/bash
 
 options="⏻ Shutdown\\n⟲ Reboot\\n⏾ Suspend\\n Lock\\n Logout"
 
@@ -1029,61 +3599,82 @@ case $chosen in
         systemctl suspend
         ;;
     *Lock)
-        i3lock -c 2E3440
+        i3lock -c {{nord0_hex}}
         ;;
     *Logout)
         openbox --exit
         ;;
 esac
-"""
+""")
     
     powermenu_path = Path.home() / '.config' / 'rofi' / 'powermenu.sh'
-    write_file(powermenu_path, powermenu_script)
-    powermenu_path.chmod(0o755)
+    write_file(powermenu_path, powermenu_script, mode=0o755)
     
     # Network menu script
+    # Wi-Fi list kept up to date by network-cache, so the menu opens without waiting for nmcli
+    write_file(NETWORK_CACHE_HELPER, NETWORK_CACHE_SCRIPT, mode=0o755)
+    
     network_script = """#!/bin/bash
 
-# Get network status
-wifi_status=$(nmcli -t -f WIFI g)
-active_conn=$(nmcli -t -f NAME c show --active | head -1)
+# Networks come pre-parsed from the cache network-cache keeps, refreshed in the background
+cache="${XDG_RUNTIME_DIR:-$HOME/.cache}/openbox-network/networks"
+helper=~/.config/rofi/network-cache
 
-if [ "$wifi_status" = "enabled" ]; then
-    networks=$(nmcli -f SSID,SIGNAL,SECURITY d wifi list | tail -n +2)
-    
-    # Add disconnect option if connected
-    if [ -n "$active_conn" ]; then
-        options=" Disconnect from $active_conn\\n$networks"
-    else
-        options="$networks"
-    fi
-    
-    chosen=$(echo -e "$options" | rofi -dmenu -i -p "WiFi Networks")
+[ -s "$cache" ] || "$helper" refresh
+{ IFS=$'\\t' read -r wifi_status active_conn; mapfile -t networks; } < "$cache"
+"$helper" refresh & disown
+
+if [ "$wifi_status" != "enabled" ]; then
+    echo "WiFi is disabled" | rofi -dmenu -p "Network"
+    exit
+fi
+
+labels=()
+ssids=()
+secured=()
+if [ -n "$active_conn" ]; then
+    labels+=(" Disconnect from $active_conn")
+    ssids+=("")
+    secured+=("")
+fi
+for row in "${networks[@]}"; do
+    IFS=$'\\t' read -r ssid signal security <<< "$row"
+    printf -v label '%-32s %3s%%  %s' "$ssid" "$signal" "$security"
+    labels+=("$label")
+    ssids+=("$ssid")
+    secured+=("$security")
+done
+labels+=(" Rescan")
+
+# rofi returns the index of the choice, so SSIDs with spaces survive
+index=$(printf '%s\\n' "${labels[@]}" | rofi -dmenu -i -no-custom -format i -p "WiFi Networks")
+# Typed text that matches no entry comes back as -1, ${ssids[-1]} would be the last network
+[[ $index =~ ^[0-9]+$ ]] || exit
+
+if [ "$index" -eq $(( ${#labels[@]} - 1 )) ]; then
+    nmcli d wifi rescan
+    "$helper" refresh
+    exec "$0"
+elif [ -z "${ssids[$index]}" ]; then
+    nmcli c down "$active_conn"
+    notify-send "Network" "Disconnected from $active_conn"
+else
+    ssid=${ssids[$index]}
     
-    if echo "$chosen" | grep -q "Disconnect"; then
-        nmcli c down "$active_conn"
-        notify-send "Network" "Disconnected from $active_conn"
-    elif [ -n "$chosen" ]; then
-        ssid=$(echo "$chosen" | awk '{print $1}')
-        
-        # Check if network is secured
-        if echo "$chosen" | grep -q "WPA"; then
-            password=$(rofi -dmenu -password -p "Password for $ssid")
-            if [ -n "$password" ]; then
-                nmcli d wifi connect "$ssid" password "$password"
-            fi
-        else
-            nmcli d wifi connect "$ssid"
+    # Check if network is secured
+    if [[ "${secured[$index]}" == *WPA* ]]; then
+        password=$(rofi -dmenu -password -p "Password for $ssid")
+        if [ -n "$password" ]; then
+            nmcli d wifi connect "$ssid" password "$password"
         fi
+    else
+        nmcli d wifi connect "$ssid"
     fi
-else
-    echo "WiFi is disabled" | rofi -dmenu -p "Network"
 fi
 """
     
     network_path = Path.home() / '.config' / 'rofi' / 'network.sh'
-    write_file(network_path, network_script)
-    network_path.chmod(0o755)
+    write_file(network_path, network_script, mode=0o755)
     
     # Audio menu script
     audio_script = """#!/bin/bash
@@ -1119,53 +3710,52 @@ esac
 """
     
     audio_path = Path.home() / '.config' / 'rofi' / 'audio.sh'
-    write_file(audio_path, audio_script)
-    audio_path.chmod(0o755)
+    write_file(audio_path, audio_script, mode=0o755)
 
 def create_alacritty_config():
     """Create Alacritty configuration"""
     print_status("Configuring Alacritty...", Colors.YELLOW)
     
-    alacritty_config = """[window]
+    alacritty_config = render("""[window]
 opacity = 0.95
 padding = { x = 10, y = 10 }
 decorations = "full"
 
 [font]
-normal = { family = "Noto Sans Mono", style = "Regular" }
-bold = { family = "Noto Sans Mono", style = "Bold" }
-italic = { family = "Noto Sans Mono", style = "Italic" }
+normal = { family = "{{font_mono}}", style = "Regular" }
+bold = { family = "{{font_mono}}", style = "Bold" }
+italic = { family = "{{font_mono}}", style = "Italic" }
 size = 11.0
 
 [colors.primary]
-background = "#2E3440"
-foreground = "#D8DEE9"
+background = "{{nord0}}"
+foreground = "{{nord4}}"
 dim_foreground = "#A5ABB6"
 
 [colors.cursor]
-text = "#2E3440"
-cursor = "#D8DEE9"
+text = "{{nord0}}"
+cursor = "{{nord4}}"
 
 [colors.normal]
-black = "#3B4252"
-red = "#BF616A"
-green = "#A3BE8C"
-yellow = "#EBCB8B"
-blue = "#81A1C1"
-magenta = "#B48EAD"
-cyan = "#88C0D0"
-white = "#E5E9F0"
+black = "{{nord1}}"
+red = "{{nord11}}"
+green = "{{nord14}}"
+yellow = "{{nord13}}"
+blue = "{{nord9}}"
+magenta = "{{nord15}}"
+cyan = "{{nord8}}"
+white = "{{nord5}}"
 
 [colors.bright]
-black = "#4C566A"
-red = "#BF616A"
-green = "#A3BE8C"
-yellow = "#EBCB8B"
-blue = "#81A1C1"
-magenta = "#B48EAD"
-cyan = "#8FBCBB"
-white = "#ECEFF4"
-"""
+black = "{{nord3}}"
+red = "{{nord11}}"
+green = "{{nord14}}"
+yellow = "{{nord13}}"
+blue = "{{nord9}}"
+magenta = "{{nord15}}"
+cyan = "{{nord7}}"
+white = "{{nord6}}"
+""")
     
     alacritty_path = Path.home() / '.config' / 'alacritty' / 'alacritty.toml'
     write_file(alacritty_path, alacritty_config)
@@ -1174,8 +3764,8 @@ def create_dunst_config():
     """Create Dunst notification daemon configuration"""
     print_status("Configuring Dunst...", Colors.YELLOW)
     
-    dunst_config = """[global]
-    font = Noto Sans 10
+    dunst_config = render("""[global]
+    font = {{font}} 10
     markup = yes
     format = "<b>%s</b>\\n%b"
     sort = yes
@@ -1200,20 +3790,20 @@ def create_dunst_config():
     corner_radius = 8
 
 [urgency_low]
-    background = "#2E3440"
-    foreground = "#D8DEE9"
+    background = "{{nord0}}"
+    foreground = "{{nord4}}"
     timeout = 5
 
 [urgency_normal]
-    background = "#2E3440"
-    foreground = "#88C0D0"
+    background = "{{nord0}}"
+    foreground = "{{nord8}}"
     timeout = 10
 
 [urgency_critical]
-    background = "#2E3440"
-    foreground = "#BF616A"
+    background = "{{nord0}}"
+    foreground = "{{nord11}}"
     timeout = 0
-"""
+""")
     
     dunst_path = Path.home() / '.config' / 'dunst' / 'dunstrc'
     write_file(dunst_path, dunst_config)
@@ -1222,10 +3812,10 @@ def create_gtk_config():
     """Configure GTK theme settings"""
     print_status("Configuring GTK theme...", Colors.YELLOW)
     
-    gtk3_settings = """[Settings]
+    gtk3_settings = render("""[Settings]
 gtk-theme-name=Adwaita-dark
 gtk-icon-theme-name=Papirus-Dark
-gtk-font-name=Noto Sans 10
+gtk-font-name={{font}} 10
 gtk-cursor-theme-name=Adwaita
 gtk-cursor-theme-size=24
 gtk-toolbar-style=GTK_TOOLBAR_BOTH_HORIZ
@@ -1239,14 +3829,14 @@ gtk-xft-hinting=1
 gtk-xft-hintstyle=hintslight
 gtk-xft-rgba=rgb
 gtk-application-prefer-dark-theme=1
-"""
+""")
     
     gtk3_path = Path.home() / '.config' / 'gtk-3.0' / 'settings.ini'
     write_file(gtk3_path, gtk3_settings)
     
-    gtk2_settings = """gtk-theme-name="Adwaita-dark"
+    gtk2_settings = render("""gtk-theme-name="Adwaita-dark"
 gtk-icon-theme-name="Papirus-Dark"
-gtk-font-name="Noto Sans 10"
+gtk-font-name="{{font}} 10"
 gtk-cursor-theme-name="Adwaita"
 gtk-cursor-theme-size=24
 gtk-toolbar-style=GTK_TOOLBAR_BOTH_HORIZ
@@ -1259,7 +3849,7 @@ gtk-xft-antialias=1
 gtk-xft-hinting=1
 gtk-xft-hintstyle="hintslight"
 gtk-xft-rgba="rgb"
-"""
+""")
     
     gtk2_path = Path.home() / '.gtkrc-2.0'
     write_file(gtk2_path, gtk2_settings)
@@ -1268,16 +3858,17 @@ def create_nitrogen_config():
     """Configure nitrogen wallpaper manager"""
     print_status("Configuring nitrogen...", Colors.YELLOW)
     
-    wallpaper_path = Path.home() / 'Pictures' / 'Wallpapers' / 'nord-mountain.png'
-    wallpaper_dir = Path.home() / 'Pictures' / 'Wallpapers'
-    
-    bg_saved = f"""[xin_-1]
-file={wallpaper_path}
+    # One section for the whole screen, or one per Xinerama head when monitors differ
+    heads = wallpaper_heads()
+    if len(set(heads)) == 1:
+        heads = heads[:1]
+    bg_saved = '\n'.join(render("""[xin_{{head}}]
+file={{file}}
 mode=5
-bgcolor=#2e3440
-"""
+bgcolor={{nord0}}
+""", head=str(index) if len(heads) > 1 else '-1', file=str(image)) for index, image in enumerate(heads))
     
-    nitrogen_cfg = f"""[geometry]
+    nitrogen_cfg = render("""[geometry]
 posx=450
 posy=200
 sizex=600
@@ -1288,8 +3879,8 @@ view=icon
 recurse=true
 sort=alpha
 icon_caps=false
-dirs={wallpaper_dir};
-"""
+dirs={{wallpaper_dir}};
+""")
     
     bg_saved_path = Path.home() / '.config' / 'nitrogen' / 'bg-saved.cfg'
     nitrogen_cfg_path = Path.home() / '.config' / 'nitrogen' / 'nitrogen.cfg'
@@ -1317,8 +3908,21 @@ Type=Application
 """
     
     desktop_entry_path = Path('/usr/share/xsessions/openbox.desktop')
+    MANIFEST.record(desktop_entry_path, hashlib.sha256(desktop_entry.encode()).hexdigest())
+    if file_matches(desktop_entry_path, desktop_entry.encode()):
+        print_status(f"Unchanged file: {desktop_entry_path}", Colors.BLUE)
+        return
+    
+    broker = privileged_broker()
+    if broker:
+        reply = broker.place_files([(desktop_entry_path, desktop_entry.encode(), 0o644)])
+        if reply.get('done', {}).get('returncode') != 0:
+            raise RuntimeError(f"Could not write {desktop_entry_path}: {reply.get('error')}")
+        print_status(f"Created file: {desktop_entry_path}", Colors.BLUE)
+        return
+    
     tmp_path = Path('/tmp/openbox.desktop')
-    write_file(tmp_path, desktop_entry)
+    tmp_path.write_text(desktop_entry)
     run_command(['sudo', 'mv', str(tmp_path), str(desktop_entry_path)])
 
 def print_summary():
@@ -1377,8 +3981,551 @@ def print_summary():
     print_status("━" * 60, Colors.YELLOW)
     print()
 
+BENCH_DIR = CACHE_DIR / 'bench'
+
+def process_counters(pid: int) -> Tuple[float, int]:
+    """CPU seconds used by pid and how many times its threads have woken up from sleeping"""
+    stat = Path(f'/proc/{pid}/stat').read_text()
+    fields = stat[stat.rindex(')') + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    
+    wakeups = 0
+    for task in Path(f'/proc/{pid}/task').iterdir():
+        try:
+            status = (task / 'status').read_text()
+        except OSError:
+            continue
+        match = re.search(r'^voluntary_ctxt_switches:\s*(\d+)', status, re.M)
+        wakeups += int(match.group(1)) if match else 0
+    return cpu, wakeups
+
+def measure_process(command: List[str], duration: float, warmup: float) -> Dict[str, float]:
+    """CPU use and wakeups per second of a program left running for duration, startup excluded"""
+    proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(warmup)
+        if proc.poll() is not None:
+            raise RuntimeError(f"{command[0]} exited with status {proc.returncode} during warmup")
+        cpu, wakeups = process_counters(proc.pid)
+        start = time.monotonic()
+        time.sleep(duration)
+        cpu_end, wakeups_end = process_counters(proc.pid)
+        elapsed = time.monotonic() - start
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    return {'cpu_percent': 100 * (cpu_end - cpu) / elapsed, 'wakeups_per_second': (wakeups_end - wakeups) / elapsed}
+
+def run_benchmark(name: str, variants: Dict[str, List[str]], duration: float, warmup: float) -> Dict[str, Dict]:
+    """Measure each variant's command in turn, print a table and keep the results under the cache"""
+    results = {}
+    for variant, command in variants.items():
+        print_status(f"Measuring {name} with {variant} for {duration:g}s...", Colors.YELLOW)
+        results[variant] = measure_process(command, duration, warmup)
+    
+    print_status(f"{name} benchmark:", Colors.BLUE)
+    for variant, result in results.items():
+        print(f"  {variant:<14} {result['cpu_percent']:6.2f}% CPU  {result['wakeups_per_second']:7.1f} wakeups/s")
+    
+    path = BENCH_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    write_json_atomic(path, {'host': socket.gethostname(), 'duration': duration, 'results': results})
+    print_status(f"Results written to {path}", Colors.BLUE)
+    return results
+
+def bench_polybar(profiles: List[str], duration: float = 30, warmup: float = 3):
+    """Run the bar with each profile's config on the current display and compare their polling cost"""
+    unknown = set(profiles) - set(POLYBAR_PROFILES)
+    if unknown:
+        raise ValueError(f"Unknown polybar profiles: {', '.join(sorted(unknown))}")
+    polybar = shutil.which('polybar')
+    if not polybar or not os.environ.get('DISPLAY'):
+        raise RuntimeError("The polybar benchmark needs polybar and an X display")
+    with tempfile.TemporaryDirectory(prefix='polybar-bench-') as tmp:
+        variants = {}
+        for profile in profiles:
+            config = Path(tmp) / f'{profile}.ini'
+            config.write_text(polybar_config(polybar_settings(profile)))
+            variants[profile] = [polybar, '--quiet', '--config', str(config), 'main']
+        run_benchmark('polybar', variants, duration, warmup)
+
+def bench_picom(tiers: List[str], duration: float = 30, warmup: float = 3):
+    """Run the compositor with each tier's config on the current display and compare their CPU use"""
+    unknown = set(tiers) - set(PICOM_TIERS)
+    if unknown:
+        raise ValueError(f"Unknown picom tiers: {', '.join(sorted(unknown))}")
+    picom = shutil.which('picom')
+    if not picom or not os.environ.get('DISPLAY'):
+        raise RuntimeError("The picom benchmark needs picom and an X display")
+    if _probe_output(['pgrep', '-u', str(os.getuid()), '-x', 'picom']):
+        raise RuntimeError("Stop the running picom first, only one compositor can run at a time")
+    with tempfile.TemporaryDirectory(prefix='picom-bench-') as tmp:
+        variants = {}
+        for tier in tiers:
+            config = Path(tmp) / f'{tier}.conf'
+            config.write_text(render(PICOM_CONFIG, **PICOM_TIERS[tier]))
+            variants[tier] = [picom, '--config', str(config)]
+        run_benchmark('picom', variants, duration, warmup)
+
+BUNDLE_FORMAT = 1
+BUNDLE_REPO_ID = 'openbox-setup-bundle'
+
+# Polybar build shipped in the bundle given with --from-bundle
+BUNDLE_POLYBAR_ARTIFACT: Optional[Path] = None
+
+def create_bundle(output: Path):
+    """Resolve and download everything an install needs into one zip archive
+
+    The archive holds index.json, a dnf repository (repo/) with the full
+    dependency closure, the downloaded assets (downloads/<sha256>) and,
+    when polybar is not packaged, a polybar build (polybar/). RPMs and
+    tarballs are already compressed and stored as is, so the zip's central
+    directory gives random access without recompressing hundreds of MB.
+    """
+    print_status("Resolving packages...", Colors.YELLOW)
+    packages = PACKAGE_PLAN.full_set()
+    
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=CACHE_DIR, prefix='bundle-') as work:
+        repo = Path(work) / 'repo'
+        print_status(f"Downloading {len(packages)} packages with dependencies...", Colors.YELLOW)
+        download_closure(packages, repo)
+        run_command(['createrepo_c', '--quiet', str(repo)])
+        
+        print_status("Fetching assets...", Colors.YELLOW)
+        downloads = {WALLPAPER_URL: DOWNLOADS.fetch(WALLPAPER_URL)}
+        
+        artifact = polybar_artifact() if 'polybar' in PACKAGE_PLAN.unavailable else None
+        
+        index = {
+            'format': BUNDLE_FORMAT,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'packages': packages,
+            'rpms': sorted(p.name for p in repo.glob('*.rpm')),
+            'downloads': {url: blob.name for url, blob in downloads.items()},
+            'polybar_artifact': artifact.name if artifact else None,
+        }
+        
+        print_status(f"Writing {output}...", Colors.YELLOW)
+        tmp = output.with_name(f'.{output.name}.{os.getpid()}')
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED) as archive:
+            archive.writestr('index.json', json.dumps(index, indent=1), compress_type=zipfile.ZIP_DEFLATED)
+            for path in sorted(repo.rglob('*')):
+                if path.is_file():
+                    compress = zipfile.ZIP_STORED if path.suffix == '.rpm' else zipfile.ZIP_DEFLATED
+                    archive.write(path, f'repo/{path.relative_to(repo)}', compress_type=compress)
+            for blob in downloads.values():
+                archive.write(blob, f'downloads/{blob.name}')
+            if artifact:
+                archive.write(artifact, f'polybar/{artifact.name}')
+        os.replace(tmp, output)
+    
+    print_status(f"Bundle written: {output} ({output.stat().st_size >> 20} MiB, {len(index['rpms'])} RPMs)",
+                 Colors.GREEN)
+
+def use_bundle(bundle: Path):
+    """Install from an offline bundle: its repo for dnf, its assets and its polybar build"""
+    global BUNDLE_POLYBAR_ARTIFACT
+    target = CACHE_DIR / 'bundle'
+    
+    with zipfile.ZipFile(bundle) as archive:
+        index_data = archive.read('index.json')
+        index = json.loads(index_data)
+        if index.get('format') != BUNDLE_FORMAT:
+            raise ValueError(f"{bundle} is not a bundle this script can read")
+        
+        # Extracting is skipped when the same bundle was used before
+        try:
+            extracted = (target / 'index.json').read_bytes() == index_data
+        except OSError:
+            extracted = False
+        if not extracted:
+            print_status(f"Extracting {bundle}...", Colors.YELLOW)
+            if target.exists():
+                shutil.rmtree(target)
+            archive.extractall(target)
+    
+    for url, digest in index['downloads'].items():
+        DOWNLOADS.add(url, target / 'downloads' / digest, digest)
+    if index['polybar_artifact']:
+        BUNDLE_POLYBAR_ARTIFACT = target / 'polybar' / index['polybar_artifact']
+    
+    # Only the bundle's repository, nothing that needs the network
+    DNF_OPTIONS[:] = ['--repofrompath', f"{BUNDLE_REPO_ID},{(target / 'repo').as_uri()}", '--repo', BUNDLE_REPO_ID]
+    print_status(f"Installing from bundle created {index['created']}", Colors.GREEN)
+
+class Step:
+    """Installation step and the steps that must finish before it starts
+
+    inputs returns data the step depends on besides its own code, state
+    returns the part of the system it manages that isn't a file it writes.
+    Both must be JSON serializable and feed the converge journal.
+    """
+
+    def __init__(self, func: Callable[[], None], requires: Tuple[str, ...] = (),
+                 inputs: Optional[Callable[[], object]] = None,
+                 state: Optional[Callable[[], object]] = None):
+        self.func = func
+        self.name = func.__name__
+        self.requires = requires
+        self.inputs = inputs
+        self.state = state
+
+def output_unchanged(path: Path, record: Optional[Dict]) -> bool:
+    """Whether a recorded step output is still on disk as written"""
+    if record is None:
+        return False
+    try:
+        st = path.stat()
+    except OSError:
+        return False
+    if st.st_size != record['size']:
+        return False
+    if st.st_mtime_ns == record['mtime_ns']:
+        return True
+    return sha256_file(path) == record['sha256']
+
+class Journal:
+    """Inputs and outputs of every completed step, persisted for --converge
+
+    A step is converged when its code and inputs hash the same as last
+    time, its state callback returns the same value and every file it
+    produced is still there unchanged.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            self.entries = json.loads(path.read_text())
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def inputs_hash(step: Step) -> str:
+        digest = hashlib.sha256(inspect.getsource(step.func).encode())
+        if step.inputs:
+            digest.update(json.dumps(step.inputs(), sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def is_converged(self, step: Step) -> bool:
+        entry = self.entries.get(step.name)
+        if not entry or entry['inputs'] != self.inputs_hash(step):
+            return False
+        if step.state and entry['state'] != step.state():
+            return False
+        return all(output_unchanged(Path(path), record) for path, record in entry['outputs'].items())
+
+    def record(self, step: Step, outputs: Dict[str, str]):
+        """Store a successful run of step"""
+        records = {}
+        for path, digest in outputs.items():
+            try:
+                st = Path(path).stat()
+            except OSError:
+                digest = None
+            # Outputs the step could not produce keep it from converging
+            records[path] = {'sha256': digest, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns} if digest else None
+        
+        entry = {'inputs': self.inputs_hash(step), 'outputs': records,
+                 'state': step.state() if step.state else None}
+        with self._lock:
+            self.entries[step.name] = entry
+            write_json_atomic(self.path, self.entries)
+
+JOURNAL = Journal(CACHE_DIR / 'journal.json')
+
+class Checkpoint:
+    """Steps the current run has completed, synced to disk after each one for --resume
+
+    A run that fails leaves its checkpoint behind. Resuming skips the steps
+    it completed whose inputs still hash the same and starts again at the
+    failed one, which picks up the artifacts earlier attempts left in the
+    cache: downloaded packages and files, the polybar clone and build trees.
+    A run that completes removes the checkpoint.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = {}
+        self.resumed = {}
+        self.failed = None
+
+    def begin(self, resume: bool):
+        """Start a run, keeping what the previous run completed when resuming"""
+        if resume:
+            try:
+                previous = json.loads(self.path.read_text())
+                self.resumed = previous['completed']
+                self.failed = previous.get('failed')
+            except (OSError, ValueError, KeyError):
+                print_status("No failed run to resume, running every step", Colors.YELLOW)
+        self._save()
+
+    def is_done(self, step: Step, inputs: str) -> bool:
+        return self.resumed.get(step.name) == inputs
+
+    def record(self, step: Step, inputs: str):
+        with self._lock:
+            self.completed[step.name] = inputs
+            self._save()
+
+    def fail(self, step: Step, error: BaseException):
+        with self._lock:
+            self.failed = {'step': step.name, 'error': str(error) or type(error).__name__}
+            self._save()
+
+    def _save(self):
+        # Steps resumed past stay completed, so a second failure can be resumed too
+        write_json_atomic(self.path, {'completed': {**self.resumed, **self.completed}, 'failed': self.failed},
+                          durable=True)
+
+    def finish(self):
+        """The run completed, the next one starts from scratch"""
+        self.path.unlink(missing_ok=True)
+
+CHECKPOINT = Checkpoint(CACHE_DIR / 'checkpoint.json')
+
+def print_resume_hint():
+    if CHECKPOINT.failed:
+        print_status(f"Run again with --resume to continue from {CHECKPOINT.failed['step']}", Colors.YELLOW)
+
+def installed_requests() -> List[str]:
+    """Requested packages that are currently installed"""
+    return sorted(set(PACKAGE_PLAN.packages) - set(INSTALLED.missing(list(PACKAGE_PLAN.packages))))
+
+def config_step(func: Callable[[], None], *sources: str) -> Step:
+    """Step writing config files, rerun by --converge when the theme or one of sources changes
+
+    sources are module-level texts the step writes out, which the step's
+    own source code doesn't contain.
+    """
+    inputs = (lambda: [template_context(), *sources]) if sources else template_context
+    return Step(func, requires=('setup_directory_structure',), inputs=inputs)
+
+# Config writers only need the directory tree, so they run while dnf is busy
+STEPS = [
+    Step(prefetch_packages, inputs=package_inputs, state=installed_requests),
+    Step(update_system, inputs=package_inputs, state=installed_requests),
+    Step(install_packages, requires=('prefetch_packages', 'update_system'), inputs=package_inputs,
+         state=installed_requests),
+    Step(install_polybar, requires=('install_packages',), inputs=lambda: POLYBAR_BUILD_DEPS,
+         state=lambda: shutil.which('polybar')),
+    Step(setup_directory_structure),
+    Step(download_wallpaper, requires=('setup_directory_structure',)),
+    Step(prepare_wallpaper, requires=('download_wallpaper', 'install_packages'), inputs=display_resolutions),
+    config_step(create_openbox_theme),
+    config_step(create_openbox_config),
+    # Needs the packages in place to resolve the binaries the session starts
+    Step(create_openbox_autostart, requires=('setup_directory_structure', 'install_packages', 'install_polybar'),
+         inputs=session_commands),
+    config_step(create_openbox_menu, XDG_MENU_SCRIPT),
+    Step(create_picom_config, requires=('setup_directory_structure',),
+         inputs=lambda: [template_context(), PICOM_CONFIG, PICOM_TIERS[selected_picom_tier()[0]]]),
+    Step(create_polybar_config, requires=('setup_directory_structure',),
+         inputs=lambda: [template_context(), polybar_settings(), POLYBAR_HEAD, POLYBAR_TEMPERATURE,
+                         POLYBAR_NETWORK, POLYBAR_BATTERY, POLYBAR_TAIL, polybar_launch_script()]),
+    config_step(create_rofi_config, NETWORK_CACHE_SCRIPT),
+    config_step(create_alacritty_config),
+    config_step(create_dunst_config),
+    config_step(create_gtk_config),
+    Step(create_nitrogen_config, requires=('setup_directory_structure', 'prepare_wallpaper'),
+         inputs=lambda: [template_context(), [str(path) for path in wallpaper_heads()]]),
+    Step(create_xinitrc),
+    Step(create_desktop_entry, requires=('install_packages',)),
+]
+
+MAX_PARALLEL_STEPS = 8
+
+def check_step_graph(steps: List[Step]):
+    """Reject unknown prerequisites and dependency cycles"""
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        for dep in step.requires:
+            if dep not in by_name:
+                raise ValueError(f"Step {step.name} requires unknown step {dep}")
+    
+    resolved = set()
+    remaining = list(steps)
+    while remaining:
+        ready = [step for step in remaining if all(dep in resolved for dep in step.requires)]
+        if not ready:
+            raise ValueError(f"Dependency cycle between steps: {', '.join(s.name for s in remaining)}")
+        for step in ready:
+            resolved.add(step.name)
+            remaining.remove(step)
+
+def run_steps(steps: List[Step], max_workers: int = MAX_PARALLEL_STEPS, journal: Optional[Journal] = None,
+              converge: bool = False, checkpoint: Optional[Checkpoint] = None) -> Dict[str, Tuple[float, float]]:
+    """Run each step as soon as its prerequisites are done, return (start, end) offsets per step
+
+    Completed steps are recorded in journal and checkpoint. With converge
+    set steps the journal shows as still converged are skipped, steps the
+    checkpoint carries over from a failed run always are.
+    """
+    check_step_graph(steps)
+    
+    origin = time.monotonic()
+    timings = {}
+    pending = list(steps)
+    running = {}
+    failure = None
+    
+    def timed(step: Step) -> Tuple[float, float]:
+        started = time.monotonic() - origin
+        with TRACE.span(step.name, 'step') as span:
+            inputs = Journal.inputs_hash(step) if checkpoint else None
+            if checkpoint and checkpoint.is_done(step, inputs):
+                print_status(f"Completed before the failure, skipping: {step.name}", Colors.GREEN)
+                checkpoint.record(step, inputs)
+                span['resumed'] = True
+                return started, time.monotonic() - origin
+            if converge and journal and journal.is_converged(step):
+                print_status(f"Already converged: {step.name}", Colors.GREEN)
+                span['converged'] = True
+                if checkpoint:
+                    checkpoint.record(step, inputs)
+                return started, time.monotonic() - origin
+            
+            _step_context.outputs, _step_context.span = {}, span
+            try:
+                step.func()
+                outputs = _step_context.outputs
+            except BaseException as e:
+                if checkpoint:
+                    checkpoint.fail(step, e)
+                raise
+            finally:
+                _step_context.outputs = _step_context.span = None
+            if journal:
+                journal.record(step, outputs)
+            if checkpoint:
+                checkpoint.record(step, inputs)
+        return started, time.monotonic() - origin
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        try:
+            while pending or running:
+                # After a failure let the running steps finish but start nothing new
+                if failure is None:
+                    for step in [s for s in pending if all(dep in timings for dep in s.requires)]:
+                        pending.remove(step)
+                        running[pool.submit(timed, step)] = step
+                if not running:
+                    break
+                
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    try:
+                        timings[step.name] = future.result()
+                    except BaseException as e:
+                        if failure is None:
+                            failure = e
+        except KeyboardInterrupt:
+            # Leaving the with block waits for the running steps, stop their commands first
+            cancel_commands()
+            raise
+    
+    if failure is not None:
+        raise failure
+    return timings
+
+def critical_path(steps: List[Step], timings: Dict[str, Tuple[float, float]]) -> List[str]:
+    """Chain of steps, each waiting on the next, that ended last"""
+    by_name = {step.name: step for step in steps}
+    current = max(timings, key=lambda name: timings[name][1])
+    path = [current]
+    while by_name[current].requires:
+        current = max(by_name[current].requires, key=lambda name: timings[name][1])
+        path.append(current)
+    return path[::-1]
+
+def print_critical_path(steps: List[Step], timings: Dict[str, Tuple[float, float]]):
+    """Print the steps that determined the total run time"""
+    path = critical_path(steps, timings)
+    total = timings[path[-1]][1]
+    busy = sum(end - start for start, end in timings.values())
+    
+    print_status(f"Critical path ({total:.1f}s wall, {busy:.1f}s of step time):", Colors.YELLOW)
+    for name in path:
+        start, end = timings[name]
+        print(f"  {Colors.GREEN}{name:28}{Colors.NC} {end - start:7.1f}s  (started at {start:.1f}s)")
+    print()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line options, installing is the default command"""
+    parser = argparse.ArgumentParser(description="Fedora Openbox post-install setup with Nord Aurora theme")
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    
+    bundle = commands.add_parser('bundle', help="write an offline bundle for --from-bundle")
+    bundle.add_argument('output', type=Path, help="archive to write, e.g. openbox-setup.zip")
+    
+    lock = commands.add_parser('lock', help="resolve packages once and write a lockfile for --lockfile")
+    lock.add_argument('output', type=Path, nargs='?', default=Path('openbox-setup.lock'),
+                      help="lockfile to write (default: %(default)s)")
+    
+    bench = commands.add_parser('bench-polybar', help="measure CPU use and wakeups of the bar per profile")
+    bench.add_argument('profiles', nargs='*', metavar='PROFILE',
+                       help=f"profiles to compare (default: all of {', '.join(POLYBAR_PROFILES)})")
+    bench.add_argument('--duration', type=float, default=30, help="seconds to measure each profile")
+    
+    bench = commands.add_parser('bench-picom', help="measure CPU use and wakeups of the compositor per tier")
+    bench.add_argument('tiers', nargs='*', metavar='TIER',
+                       help=f"tiers to compare (default: all of {', '.join(PICOM_TIERS)})")
+    bench.add_argument('--duration', type=float, default=30, help="seconds to measure each tier")
+    
+    broker = commands.add_parser('broker', help="serve privileged operations on stdin (started by the script)")
+    broker.add_argument('--root', type=Path, help="place files under this directory instead of / (for tests)")
+    broker.add_argument('--path', default=BROKER_PATH, help="look programs up on this PATH (for tests)")
+    
+    commands.add_parser('verify', help="report managed files that changed since the setup wrote them")
+    
+    mirrors = commands.add_parser('mirrors', help="probe the mirrors of a mirror config and rank them")
+    mirrors.add_argument('config', type=Path, help="mirror config, see mirror_groups()")
+    
+    parser.add_argument('--mirrors', type=Path, metavar='CONFIG',
+                        help="pin the fastest dnf and asset mirrors of a JSON mirror config")
+    parser.add_argument('--lockfile', type=Path,
+                        help="install exactly the packages of a lockfile made by the lock command")
+    
+    parser.add_argument('--from-bundle', type=Path, metavar='BUNDLE',
+                        help="install without network access from a bundle made by the bundle command")
+    parser.add_argument('--resume', action='store_true',
+                        help="after a failed run, skip the steps it completed and continue from the failed one")
+    parser.add_argument('--converge', action='store_true',
+                        help="skip steps whose inputs and outputs are unchanged since they last ran")
+    parser.add_argument('--theme', type=Path,
+                        help="JSON file overriding palette colors (nord0..nord15) and fonts (font, font_mono)")
+    parser.add_argument('--polybar-profile', choices=list(POLYBAR_PROFILES), default=POLYBAR_PROFILE,
+                        help="how often bar modules poll (default: %(default)s)")
+    parser.add_argument('--picom-tier', choices=['auto', *PICOM_TIERS], default=PICOM_TIER,
+                        help="compositor effects, auto probes the GPU (default: %(default)s)")
+    parser.add_argument('--resolution', type=parse_resolution, action='append', metavar='WIDTHxHEIGHT',
+                        help="monitor resolution to pre-scale the wallpaper for, once per monitor in order "
+                             "(default: the preferred mode of each connected output)")
+    parser.add_argument('--trace-dir', type=Path, default=CACHE_DIR / 'traces',
+                        help="where to write the timing report (default: %(default)s)")
+    return parser.parse_args(argv)
+
 def main():
     """Main installation function"""
+    global POLYBAR_PROFILE, PICOM_TIER
+    args = parse_args()
+    POLYBAR_PROFILE = args.polybar_profile
+    PICOM_TIER = args.picom_tier
+    if args.command == 'broker':
+        serve_broker(args.root, args.path)
+        return
+    if args.command == 'verify':
+        sys.exit(0 if verify_managed_files() else 1)
+    if args.theme:
+        load_theme(args.theme)
+    WALLPAPER_RESOLUTIONS.extend(args.resolution or [])
     print_status("Starting Fedora 43 Openbox Setup...", Colors.GREEN)
     print()
     
@@ -1388,37 +4535,68 @@ def main():
         sys.exit(1)
     
     try:
-        # Installation steps
-        install_packages()
-        install_polybar()
-        setup_directory_structure()
-        download_wallpaper()
-        create_openbox_theme()
-        create_openbox_config()
-        create_openbox_autostart()
-        create_openbox_menu()
-        create_picom_config()
-        create_polybar_config()
-        create_rofi_config()
-        create_alacritty_config()
-        create_dunst_config()
-        create_gtk_config()
-        create_nitrogen_config()
-        create_xinitrc()
-        create_desktop_entry()
+        if args.command == 'bundle':
+            create_bundle(args.output)
+            return
+        if args.command == 'bench-polybar':
+            bench_polybar(args.profiles or list(POLYBAR_PROFILES), args.duration)
+            return
+        if args.command == 'bench-picom':
+            bench_picom(args.tiers or list(PICOM_TIERS), args.duration)
+            return
+        if args.command == 'mirrors':
+            print_mirror_ranking(json.loads(args.config.read_text()))
+            return
+        if args.mirrors:
+            pin_mirrors(json.loads(args.mirrors.read_text()))
+        if args.command == 'lock':
+            create_lockfile(args.output)
+            return
+        if args.from_bundle:
+            use_bundle(args.from_bundle)
+        if args.lockfile:
+            use_lockfile(args.lockfile)
+        
+        # Installation steps, root is only requested once a step needs it
+        enable_broker()
+        CHECKPOINT.begin(args.resume)
+        if CHECKPOINT.failed:
+            print_status(f"Resuming at {CHECKPOINT.failed['step']}, which failed: {CHECKPOINT.failed['error']}",
+                         Colors.YELLOW)
+        try:
+            with TRACE.span('main', 'run', converge=args.converge, resume=args.resume):
+                timings = run_steps(STEPS, journal=JOURNAL, converge=args.converge, checkpoint=CHECKPOINT)
+            CHECKPOINT.finish()
+        finally:
+            stop_broker()
+            MANIFEST.save()
+            jsonl, trace = TRACE.write(args.trace_dir)
         
         # Print summary
         print_summary()
+        print_critical_path(STEPS, timings)
+        print_command_stats()
+        print_retry_stats()
+        print_status(f"Timing report: {jsonl} (Chrome trace: {trace})", Colors.BLUE)
         
     except KeyboardInterrupt:
+        cancel_commands()
         print()
         print_status("Installation interrupted by user!", Colors.RED)
+        print_resume_hint()
+        sys.exit(1)
+    except CommandError as e:
+        print_status(f"Command failed: {e}", Colors.RED)
+        print_resume_hint()
         sys.exit(1)
     except Exception as e:
         print_status(f"An error occurred: {e}", Colors.RED)
         import traceback
         traceback.print_exc()
+        print_resume_hint()
         sys.exit(1)
+    finally:
+        stop_jobserver()
 
 if __name__ == "__main__":
     main()
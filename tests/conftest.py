@@ -0,0 +1,68 @@
+"""Shared fixtures: a fresh copy of the setup script per test, fake tools and local HTTP servers"""
+
+import http.server
+import importlib.util
+import itertools
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / 'Openbox-setup.py'
+
+_loaded = itertools.count()
+
+
+@pytest.fixture
+def setup(tmp_path, monkeypatch):
+    """The setup script loaded with its home and cache under tmp_path"""
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    monkeypatch.setenv('OPENBOX_SETUP_CACHE', str(tmp_path / 'cache'))
+    spec = importlib.util.spec_from_file_location(f'openbox_setup_{next(_loaded)}', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    module.stop_broker()
+    module.stop_jobserver()
+
+
+@pytest.fixture
+def fake_bin(tmp_path, monkeypatch):
+    """Install executable shell scripts that shadow real tools on PATH"""
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    def install(name: str, script: str) -> Path:
+        path = bin_dir / name
+        path.write_text('#!/bin/bash\n' + script)
+        path.chmod(0o755)
+        return path
+
+    return install
+
+
+@pytest.fixture
+def serve():
+    """Start a local HTTP server for a handler class, return its base URL"""
+    servers = []
+
+    def start(handler) -> str:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}/'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class QuietHandler(http.server.BaseHTTPRequestHandler):
+    """Request handler that doesn't log to stderr"""
+
+    def log_message(self, *args):
+        pass
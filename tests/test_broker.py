@@ -0,0 +1,102 @@
+import sys
+import time
+
+import pytest
+
+from conftest import SCRIPT
+
+FAKE_DNF = '''
+case "$1" in
+    install) echo "Installing $2"; echo "warning: weak deps skipped" >&2;;
+    missing) echo "No match for argument: $2" >&2; exit 1;;
+    hang) exec sleep 30;;
+esac
+'''
+
+
+@pytest.fixture
+def broker(setup, fake_bin, tmp_path):
+    """An unprivileged broker placing files under tmp_path/root, running a fake dnf"""
+    dnf = fake_bin('dnf', FAKE_DNF)
+    root = tmp_path / 'root'
+    setup.BROKER = setup.PrivilegedBroker([sys.executable, str(SCRIPT), 'broker', '--root', str(root),
+                                           '--path', f'{dnf.parent}:{setup.BROKER_PATH}'])
+    return root
+
+
+def test_commands_stream_through_the_broker(setup, broker):
+    result = setup.run_command(['sudo', 'dnf', 'install', 'htop'], capture=True)
+
+    assert result.stdout == 'Installing htop\n'
+    assert result.stderr == 'warning: weak deps skipped\n'
+    assert setup.COMMAND_STATS[-1].cmd == 'sudo dnf install htop'
+
+
+def test_failures_raise_with_the_exit_code(setup, broker):
+    with pytest.raises(setup.CommandError) as failure:
+        setup.run_command(['sudo', 'dnf', 'missing', 'nonexistent'])
+
+    assert failure.value.returncode == 1
+
+
+def test_programs_outside_the_allowlist_are_refused(setup, broker, tmp_path):
+    victim = tmp_path / 'victim'
+    victim.touch()
+
+    result = setup.run_command(['sudo', 'rm', str(victim)], check=False, capture=True)
+
+    assert result.returncode == 1
+    assert 'not run by the privileged helper' in result.stderr
+    assert victim.exists()
+
+
+@pytest.mark.parametrize('program', ['{bin}/dnf', './dnf', '/usr/bin/tar'])
+def test_programs_given_by_path_are_refused(setup, broker, tmp_path, program):
+    result = setup.run_command(['sudo', program.format(bin=tmp_path / 'bin'), 'install', 'htop'],
+                               check=False, capture=True)
+
+    assert result.returncode == 1
+    assert 'not run by the privileged helper' in result.stderr
+    assert 'Installing' not in result.stdout
+
+
+def test_allowed_programs_come_from_the_broker_path_not_the_inherited_one(setup, fake_bin, tmp_path):
+    fake_bin('tar', 'echo planted')
+    trusted = tmp_path / 'trusted'
+    trusted.mkdir()
+    (trusted / 'tar').write_text('#!/bin/bash\necho trusted\n')
+    (trusted / 'tar').chmod(0o755)
+    setup.BROKER = setup.PrivilegedBroker([sys.executable, str(SCRIPT), 'broker', '--path', str(trusted)])
+
+    assert setup.run_command(['sudo', 'tar', '--version'], capture=True).stdout == 'trusted\n'
+
+
+def test_desktop_entry_is_placed_by_the_broker(setup, broker):
+    setup.create_desktop_entry()
+
+    placed = broker / 'usr' / 'share' / 'xsessions' / 'openbox.desktop'
+    assert 'Exec=openbox-session' in placed.read_text()
+    assert placed.stat().st_mode & 0o777 == 0o644
+
+
+def test_timeout_cancels_the_running_command(setup, broker):
+    started = time.monotonic()
+    with pytest.raises(setup.CommandError):
+        setup.run_command(['sudo', 'dnf', 'hang'], timeout=0.5)
+
+    assert time.monotonic() - started < 5
+    assert setup.run_command(['sudo', 'dnf', 'install', 'htop'], capture=True).stdout == 'Installing htop\n'
+
+
+def test_broker_starts_on_the_first_root_command(setup, fake_bin, tmp_path):
+    fake_bin('dnf', FAKE_DNF)
+    fake_bin('sudo', f'echo "$*" >> {tmp_path}/sudo.log\nexec "$@" --path "$PATH"\n')
+    setup.enable_broker()
+
+    setup.run_steps([setup.Step(lambda: setup.run_command(['true']))])
+    assert setup.BROKER is None
+    assert not (tmp_path / 'sudo.log').exists()
+
+    setup.run_command(['sudo', 'dnf', 'install', 'htop'])
+    setup.run_command(['sudo', 'dnf', 'install', 'vim'])
+    assert (tmp_path / 'sudo.log').read_text().splitlines() == [f'{sys.executable} {SCRIPT} broker']
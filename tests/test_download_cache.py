@@ -0,0 +1,148 @@
+import hashlib
+import json
+
+import pytest
+
+from conftest import QuietHandler
+
+PAYLOAD = bytes(range(256)) * 4096
+DIGEST = hashlib.sha256(PAYLOAD).hexdigest()
+UPDATED = bytes(reversed(range(256))) * 4096
+
+
+class Upstream:
+    """File served by a test server, which can change, honor Range or misreport Content-Range"""
+
+    def __init__(self):
+        self.body = PAYLOAD
+        self.etag = '"v1"'
+        self.honor_range = True
+        self.range_offset = 0
+        self.cut_after = None
+        self.requests = []
+
+    def handler(self):
+        upstream = self
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                ranged, if_range = self.headers.get('Range'), self.headers.get('If-Range')
+                upstream.requests.append((ranged, if_range))
+                body = upstream.body
+                if ranged and upstream.honor_range and if_range in (None, upstream.etag):
+                    start = int(ranged.split('=')[1].rstrip('-'))
+                    if start >= len(body):
+                        self.send_response(416)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    start += upstream.range_offset
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+                    body = body[start:]
+                else:
+                    self.send_response(200)
+                self.send_header('ETag', upstream.etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body[:upstream.cut_after])
+
+        return Handler
+
+
+@pytest.fixture
+def upstream(serve):
+    server = Upstream()
+    server.url = serve(server.handler()) + 'wallpaper.png'
+    return server
+
+
+@pytest.fixture
+def cache(setup, tmp_path):
+    return setup.DownloadCache(tmp_path / 'downloads')
+
+
+def partial_file(cache, url, data, etag='"v1"'):
+    """Leave an interrupted transfer of url behind, with the validators it was started under"""
+    part = cache.root / 'partial' / (hashlib.sha256(url.encode()).hexdigest() + '.part')
+    part.parent.mkdir(parents=True)
+    part.write_bytes(data)
+    if etag:
+        part.with_suffix('.json').write_text(json.dumps({'etag': etag, 'last_modified': None}))
+    return part
+
+
+def test_resumes_partial_download_with_if_range(upstream, cache):
+    partial_file(cache, upstream.url, PAYLOAD[:300000])
+
+    blob = cache.fetch(upstream.url, DIGEST)
+
+    assert upstream.requests == [('bytes=300000-', '"v1"')]
+    assert blob.read_bytes() == PAYLOAD
+    assert not list((cache.root / 'partial').iterdir())
+
+
+def test_interrupted_transfer_keeps_its_validators(setup, upstream, cache):
+    upstream.cut_after = 300000
+    with pytest.raises(Exception):
+        cache.fetch(upstream.url)
+
+    [validators] = (cache.root / 'partial').glob('*.json')
+    assert json.loads(validators.read_text())['etag'] == '"v1"'
+
+    upstream.cut_after = None
+    assert cache.fetch(upstream.url).read_bytes() == PAYLOAD
+    assert upstream.requests[-1][1] == '"v1"'
+
+
+def test_file_changed_upstream_is_fetched_from_the_start(upstream, cache):
+    partial_file(cache, upstream.url, PAYLOAD[:300000])
+    upstream.body, upstream.etag = UPDATED, '"v2"'
+
+    blob = cache.fetch(upstream.url)
+
+    assert blob.read_bytes() == UPDATED
+    assert blob.name == hashlib.sha256(UPDATED).hexdigest()
+
+
+def test_partial_file_without_validators_is_not_resumed(upstream, cache):
+    partial_file(cache, upstream.url, b'bytes of unknown origin', etag=None)
+
+    assert cache.fetch(upstream.url).read_bytes() == PAYLOAD
+    assert upstream.requests == [(None, None)]
+
+
+def test_range_that_does_not_continue_the_file_restarts(upstream, cache):
+    partial_file(cache, upstream.url, PAYLOAD[:300000])
+    upstream.range_offset = -1000
+
+    assert cache.fetch(upstream.url, DIGEST).read_bytes() == PAYLOAD
+    assert upstream.requests == [('bytes=300000-', '"v1"'), (None, None)]
+
+
+def test_complete_partial_file_is_not_fetched_again(upstream, cache):
+    partial_file(cache, upstream.url, PAYLOAD)
+
+    assert cache.fetch(upstream.url, DIGEST).read_bytes() == PAYLOAD
+    assert upstream.requests == [(f'bytes={len(PAYLOAD)}-', '"v1"')]
+
+
+def test_server_without_range_support_restarts(upstream, cache):
+    partial_file(cache, upstream.url, b'stale bytes from another file')
+    upstream.honor_range = False
+
+    assert cache.fetch(upstream.url, DIGEST).read_bytes() == PAYLOAD
+
+
+def test_warm_cache_does_not_touch_the_network(setup, upstream, cache):
+    first = cache.fetch(upstream.url)
+    assert cache.fetch(upstream.url) == first
+    assert setup.DownloadCache(cache.root).lookup(upstream.url) == first
+    assert len(upstream.requests) == 1
+
+
+def test_checksum_mismatch_discards_the_transfer(setup, upstream, cache):
+    with pytest.raises(setup.ChecksumError):
+        cache.fetch(upstream.url, '0' * 64)
+    assert not list((cache.root / 'partial').iterdir())
+    assert not (cache.root / 'blobs' / ('0' * 64)).exists()
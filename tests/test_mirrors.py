@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+from conftest import QuietHandler
+
+CHUNK = 16 << 10
+PROBE_BYTES = 256 << 10
+REPOMD = b"""<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="filelists"><location href="repodata/abc-filelists.xml.zst"/></data>
+  <data type="primary"><location href="repodata/abc-primary.xml.zst"/></data>
+</repomd>
+"""
+
+
+def mirror_handler(requests, delay=0.0, status=200):
+    """Serve a repomd.xml at once and PROBE_BYTES of zeros for anything else, sleeping delay seconds between chunks"""
+    class Handler(QuietHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            if status == 200 and self.path.endswith('/repomd.xml'):
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(REPOMD)))
+                self.end_headers()
+                self.wfile.write(REPOMD)
+                return
+            if status != 200:
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Length', str(PROBE_BYTES))
+            self.end_headers()
+            for _ in range(PROBE_BYTES // CHUNK):
+                self.wfile.write(bytes(CHUNK))
+                time.sleep(delay)
+
+    return Handler
+
+
+@pytest.fixture
+def mirrors(setup, serve, monkeypatch):
+    """A fast, a throttled and a broken mirror with their request logs"""
+    monkeypatch.setattr(setup, 'MIRROR_PROBE_BYTES', PROBE_BYTES)
+    logs = {'fast': [], 'slow': [], 'broken': []}
+    return {
+        'fast': serve(mirror_handler(logs['fast'])),
+        'slow': serve(mirror_handler(logs['slow'], delay=0.02)),
+        'broken': serve(mirror_handler(logs['broken'], status=404)),
+        'logs': logs,
+    }
+
+
+def test_assets_rank_fastest_first_and_unreachable_last(setup, mirrors):
+    config = {'assets': [{'prefix': mirrors['slow'], 'probe': 'wallpaper.png',
+                          'mirrors': [mirrors['broken'], mirrors['fast']]}]}
+
+    [(kind, name, ranked)] = setup.rank_mirrors(config)
+
+    assert (kind, name) == ('assets', mirrors['slow'])
+    assert [candidate for candidate, _ in ranked] == [mirrors['fast'], mirrors['slow'], mirrors['broken']]
+    assert ranked[-1][1]['error'] == 'HTTP 404 Not Found'
+    assert mirrors['logs']['fast'] == ['/wallpaper.png']
+
+
+def test_dnf_repositories_are_probed_on_the_primary_metadata_of_their_repomd(setup, mirrors):
+    config = {'dnf': {'fedora': [mirrors['slow'] + 'fedora/$basearch/os/', mirrors['fast'] + 'fedora/$basearch/os/']}}
+
+    setup.pin_mirrors(config)
+
+    arch = setup.dnf_variables()['basearch']
+    assert mirrors['logs']['fast'] == [f'/fedora/{arch}/os/repodata/repomd.xml',
+                                       f'/fedora/{arch}/os/repodata/abc-primary.xml.zst']
+    assert setup.DNF_OPTIONS == [f"--setopt=fedora.baseurl={mirrors['fast']}fedora/$basearch/os/",
+                                 '--setopt=fedora.metalink=', '--setopt=fedora.mirrorlist=']
+
+
+def test_repositories_without_usable_repomd_are_unreachable(setup, mirrors, serve):
+    class NoPrimary(QuietHandler):
+        def do_GET(self):
+            body = b'<repomd xmlns="http://linux.duke.edu/metadata/repo"/>'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    config = {'dnf': {'fedora': [serve(NoPrimary), mirrors['broken'], mirrors['fast']]}}
+
+    [(_, _, ranked)] = setup.rank_mirrors(config)
+
+    assert ranked[0][0] == mirrors['fast']
+    assert sorted(measurement['error'] for _, measurement in ranked[1:]) == [
+        'HTTP 404 Not Found', 'repomd.xml lists no primary metadata']
+
+
+def test_pinned_asset_mirror_rewrites_urls_and_git(setup, mirrors):
+    prefix = 'https://raw.githubusercontent.com/'
+    config = {'assets': [{'prefix': mirrors['slow'], 'probe': 'x', 'mirrors': [mirrors['fast']]},
+                         {'prefix': prefix, 'probe': 'x', 'mirrors': []}]}
+
+    setup.pin_mirrors(config)
+
+    assert setup.rewrite_url(mirrors['slow'] + 'a/b.png') == mirrors['fast'] + 'a/b.png'
+    assert setup.rewrite_url(prefix + 'a/b.png') == prefix + 'a/b.png'
+    assert setup.git_command('fetch') == ['git', '-c', f"url.{mirrors['fast']}.insteadOf={mirrors['slow']}",
+                                          'fetch']
+
+
+def test_measurements_are_reused_until_they_expire(setup, mirrors, monkeypatch):
+    config = {'assets': [{'prefix': mirrors['fast'], 'probe': 'x', 'mirrors': []}]}
+
+    setup.rank_mirrors(config)
+    setup.rank_mirrors(config)
+    assert len(mirrors['logs']['fast']) == 1
+
+    setup.rank_mirrors(config, force=True)
+    assert len(mirrors['logs']['fast']) == 2
+
+    monkeypatch.setattr(setup, 'MIRROR_TTL', -1)
+    setup.rank_mirrors(config)
+    assert len(mirrors['logs']['fast']) == 3
@@ -0,0 +1,82 @@
+import os
+import signal
+import subprocess
+import time
+
+import pytest
+
+NETWORKS = r'''Cafe:40:WPA2
+Cafe:70:WPA2
+Home\: 5G:90:WPA2 WPA3
+:30:WPA2
+Open:55:
+'''
+
+
+def stub_nmcli(state):
+    """nmcli answering from files under state, monitor reports one event once state/event exists"""
+    return f'''
+case "$*" in
+    *general) cat {state}/wifi;;
+    *--active) cat {state}/active;;
+    *"wifi list"*) cat {state}/networks;;
+    monitor) while [ ! -e {state}/event ]; do sleep 0.05; done; echo "wlp1s0: connected"; exec sleep 30;;
+    *) exit 1;;
+esac
+'''
+
+
+@pytest.fixture
+def network(setup, fake_bin, tmp_path, monkeypatch):
+    """The deployed network-cache helper, its cache file and the stub NetworkManager state"""
+    state = tmp_path / 'nm'
+    state.mkdir()
+    (state / 'wifi').write_text('enabled\n')
+    (state / 'active').write_text('lo:loopback\nHome\\: 5G:802-11-wireless\n')
+    (state / 'networks').write_text(NETWORKS)
+    fake_bin('nmcli', stub_nmcli(state))
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path / 'run'))
+    setup.create_rofi_config()
+    return setup.NETWORK_CACHE_HELPER, tmp_path / 'run' / 'openbox-network' / 'networks', state
+
+
+def test_refresh_writes_the_parsed_strongest_first_list(setup, network):
+    helper, cache, _ = network
+
+    subprocess.run([str(helper), 'refresh'], check=True)
+
+    assert cache.read_text() == ('enabled\tHome: 5G\n'
+                                 'Home: 5G\t90\tWPA2 WPA3\n'
+                                 'Cafe\t70\tWPA2\n'
+                                 'Open\t55\t--\n')
+    assert [path.name for path in cache.parent.iterdir()] == ['networks']
+
+
+def test_refresh_without_networkmanager_keeps_the_menu_usable(setup, network, fake_bin):
+    helper, cache, _ = network
+    fake_bin('nmcli', 'exit 8\n')
+
+    subprocess.run([str(helper), 'refresh'], check=True)
+
+    assert cache.read_text() == 'unknown\t\n'
+
+
+def test_watch_refreshes_on_networkmanager_events(setup, network):
+    helper, cache, state = network
+    watcher = subprocess.Popen([str(helper), 'watch'], start_new_session=True)
+    try:
+        deadline = time.monotonic() + 5
+        while not cache.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert 'Cafe\t70' in cache.read_text()
+
+        (state / 'networks').write_text('Cafe:20:WPA2\n')
+        (state / 'event').touch()
+        deadline = time.monotonic() + 5
+        while 'Cafe\t20' not in cache.read_text() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert cache.read_text() == 'enabled\tHome: 5G\nCafe\t20\tWPA2\n'
+    finally:
+        os.killpg(watcher.pid, signal.SIGTERM)
+        watcher.wait()
@@ -0,0 +1,152 @@
+import pytest
+
+# Fake repository: package name followed by what else it provides
+REPOSITORY = '''
+bash /bin/sh
+vim-enhanced vim
+htop
+cmake
+gcc-c++
+'''
+
+FAKE_DNF = f'''
+args="$*"
+echo "${{args//$'\n'/}}" >> "$FAKE_ROOT/dnf.log"
+[ -e "$FAKE_ROOT/dnf-broken" ] && exit 1
+repository='{REPOSITORY}'
+command=$1; shift
+case "$command" in
+repoquery)
+    provides=; specs=()
+    while [ $# -gt 0 ]; do
+        case "$1" in
+            --whatprovides=*) provides=${{1#*=}}; shift;;
+            --queryformat) shift 2;;
+            --*) shift;;
+            *) specs+=("$1"); shift;;
+        esac
+    done
+    while read -r name extra; do
+        [ -n "$name" ] || continue
+        if [ -n "$provides" ]; then
+            for capability in $name $extra; do
+                if [[ ",$provides," == *",$capability,"* ]]; then
+                    echo "=$name"
+                    for provide in $name $extra; do echo "$provide = 1.0-1.fc43"; done
+                    break
+                fi
+            done
+        else
+            for spec in "${{specs[@]}}"; do [ "$spec" = "$name" ] && echo "$name"; done
+        fi
+    done <<< "$repository"
+    ;;
+install)
+    for spec in "$@"; do
+        case "$spec" in -*) continue;; esac
+        grep -E "^$spec( |$)| $spec( |$)" <<< "$repository" >> "$FAKE_ROOT/installed"
+    done
+    ;;
+esac
+exit 0
+'''
+
+FAKE_RPM = '''
+if [ "$1" = -qp ]; then
+    shift 5
+    for file in "$@"; do
+        read -r name version extra < "$file"
+        echo "=$name-0:$version-1.fc43.x86_64"
+        for capability in $name $extra; do echo "$capability"; done
+    done
+    exit 0
+fi
+while read -r name extra; do
+    [ -n "$name" ] || continue
+    echo "=$name-0:1.0-1.fc43.x86_64"
+    for capability in $name $extra; do echo "$capability"; done
+done < "$FAKE_ROOT/installed"
+'''
+
+
+@pytest.fixture
+def dnf(setup, fake_bin, tmp_path, monkeypatch):
+    """Fake dnf, rpm and sudo over a tiny repository, returning the dnf call log"""
+    monkeypatch.setenv('FAKE_ROOT', str(tmp_path))
+    (tmp_path / 'installed').write_text('bash\n')
+    fake_bin('dnf', FAKE_DNF)
+    fake_bin('rpm', FAKE_RPM)
+    fake_bin('sudo', 'exec "$@"\n')
+    # The index is keyed by the real rpm database, which the fakes never change
+    monkeypatch.setattr(setup, 'rpmdb_fingerprint', lambda: None)
+
+    def calls(command: str):
+        log = tmp_path / 'dnf.log'
+        lines = log.read_text().splitlines() if log.exists() else []
+        return [line.split() for line in lines if line.startswith(command)]
+
+    return calls
+
+
+def new_plan(setup):
+    plan = setup.PackagePlan()
+    plan.request(['bash', 'vim', 'htop'])
+    plan.request(['polybar'], fallback=['cmake', 'gcc-c++'])
+    return plan
+
+
+def test_specs_resolved_through_provides_stay_in_the_transaction(setup, dnf):
+    plan = new_plan(setup)
+
+    assert plan.transaction() == ['vim', 'htop', 'cmake', 'gcc-c++']
+    assert plan.satisfied == {'bash'}
+    assert plan.unavailable == {'polybar'}
+
+
+def test_resolution_queries_names_then_all_the_rest_as_provides_at_once(setup, dnf):
+    new_plan(setup).transaction()
+
+    queries = dnf('repoquery')
+    assert len(queries) == 2
+    assert queries[1][-1] == '--whatprovides=vim,polybar'
+
+
+def test_names_resolved_by_name_skip_the_provides_query(setup, dnf):
+    plan = setup.PackagePlan()
+    plan.request(['htop', 'cmake'])
+
+    assert plan.transaction() == ['htop', 'cmake']
+    assert len(dnf('repoquery')) == 1
+
+
+def test_apply_installs_everything_in_one_transaction(setup, dnf):
+    new_plan(setup).apply()
+
+    installs = dnf('install')
+    assert len(installs) == 1
+    assert installs[0][-4:] == ['vim', 'htop', 'cmake', 'gcc-c++']
+    assert 'vim' in setup.INSTALLED
+
+
+def test_full_set_ignores_what_this_machine_has_installed(setup, dnf):
+    assert new_plan(setup).full_set() == ['bash', 'vim', 'htop', 'cmake', 'gcc-c++']
+
+
+def test_failed_query_installs_the_requests_unresolved(setup, dnf, tmp_path):
+    (tmp_path / 'dnf-broken').touch()
+
+    assert new_plan(setup).transaction() == ['vim', 'htop', 'polybar']
+
+
+def test_prefetched_rpms_replace_their_specs(setup, dnf, tmp_path):
+    prefetched = tmp_path / 'prefetch'
+    prefetched.mkdir()
+    # Fake RPM files hold "name version provides..."
+    (prefetched / 'bash.rpm').write_text('bash 0.9 /bin/sh\n')
+    (prefetched / 'htop.rpm').write_text('htop 3.3\n')
+    (prefetched / 'vim-enhanced.rpm').write_text('vim-enhanced 9.1 vim\n')
+
+    new_plan(setup).apply(sorted(prefetched.iterdir()))
+
+    [install] = dnf('install')
+    assert install[-4:] == ['cmake', 'gcc-c++', str(prefetched / 'htop.rpm'), str(prefetched / 'vim-enhanced.rpm')]
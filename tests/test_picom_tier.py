@@ -0,0 +1,77 @@
+import pytest
+
+NO_VIRT = 'echo none\nexit 1\n'
+
+
+@pytest.fixture
+def machine(setup, tmp_path, fake_bin, monkeypatch):
+    """Fake /sys and /dev trees with GPUs bound to drivers, and stub glxinfo/systemd-detect-virt"""
+    sys_root = tmp_path / 'sys'
+    dev_root = tmp_path / 'dev'
+    (sys_root / 'class' / 'drm').mkdir(parents=True)
+    (dev_root / 'dri').mkdir(parents=True)
+    monkeypatch.delenv('DISPLAY', raising=False)
+    fake_bin('systemd-detect-virt', NO_VIRT)
+
+    def build(drivers=(), render_node=True, renderer=None, virtualization=None):
+        for index, driver in enumerate(drivers):
+            module = sys_root / 'bus' / 'pci' / 'drivers' / driver
+            module.mkdir(parents=True, exist_ok=True)
+            device = sys_root / 'devices' / f'gpu{index}'
+            device.mkdir(parents=True)
+            (device / 'driver').symlink_to(module)
+            card = sys_root / 'class' / 'drm' / f'card{index}'
+            card.mkdir()
+            (card / 'device').symlink_to(device)
+            # Connectors sit next to the cards and have no driver of their own
+            (sys_root / 'class' / 'drm' / f'card{index}-DP-1').mkdir()
+        if render_node:
+            (dev_root / 'dri' / 'renderD128').touch()
+        if renderer:
+            monkeypatch.setenv('DISPLAY', ':0')
+            fake_bin('glxinfo', f'echo "OpenGL vendor string: Mesa"\necho "OpenGL renderer string: {renderer}"\n')
+        if virtualization:
+            fake_bin('systemd-detect-virt', f'echo {virtualization}\n')
+        return setup.probe_graphics(sys_root, dev_root)
+
+    return build
+
+
+def test_accelerated_gpu_on_bare_metal_gets_the_full_tier(setup, machine):
+    graphics = machine(['amdgpu'], renderer='AMD Radeon RX 6600 (radeonsi, navi23, LLVM 17.0.6, DRM 3.57)')
+
+    assert graphics == {'drivers': ['amdgpu'], 'render_node': True,
+                        'renderer': 'AMD Radeon RX 6600 (radeonsi, navi23, LLVM 17.0.6, DRM 3.57)',
+                        'virtualization': None}
+    assert setup.picom_tier(graphics)[0] == 'full'
+
+
+def test_virtual_gpu_gets_the_reduced_tier(setup, machine):
+    graphics = machine(['virtio_gpu'], virtualization='kvm')
+
+    assert setup.picom_tier(graphics) == ('reduced', 'virtual GPU in kvm')
+
+
+@pytest.mark.parametrize('drivers, render_node, renderer', [
+    (['i915'], True, 'llvmpipe (LLVM 17.0.6, 256 bits)'),
+    (['simpledrm'], False, None),
+    (['i915'], False, None),
+    ([], False, None),
+])
+def test_software_rendering_gets_the_minimal_tier(setup, machine, drivers, render_node, renderer):
+    graphics = machine(drivers, render_node=render_node, renderer=renderer)
+
+    assert setup.picom_tier(graphics)[0] == 'minimal'
+
+
+def test_config_follows_the_probed_tier_unless_one_is_chosen(setup, machine, monkeypatch):
+    graphics = machine(['simpledrm'], render_node=False)
+    monkeypatch.setattr(setup, 'probe_graphics', lambda: graphics)
+    picom_conf = setup.Path.home() / '.config' / 'picom' / 'picom.conf'
+
+    setup.create_picom_config()
+    assert 'backend = "xrender"' in picom_conf.read_text()
+
+    monkeypatch.setattr(setup, 'PICOM_TIER', 'full')
+    setup.create_picom_config()
+    assert 'backend = "glx"' in picom_conf.read_text()
@@ -0,0 +1,74 @@
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not all(shutil.which(tool) for tool in ('git', 'cmake', 'cc', 'c++')),
+                                reason="needs git, cmake and a C/C++ compiler")
+
+CMAKELISTS = '''cmake_minimum_required(VERSION 3.10)
+project(toybar C)
+add_executable(polybar main.c)
+install(TARGETS polybar DESTINATION bin)
+'''
+
+
+def git(*args, cwd):
+    subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args], cwd=cwd,
+                   check=True, capture_output=True)
+
+
+@pytest.fixture
+def upstream(setup, tmp_path, monkeypatch):
+    """A bare repository holding a toy CMake project in place of upstream polybar, and a way to commit to it"""
+    work = tmp_path / 'work'
+    work.mkdir()
+    (work / 'CMakeLists.txt').write_text(CMAKELISTS)
+    git('init', '-q', cwd=work)
+
+    def commit(message: str) -> str:
+        (work / 'main.c').write_text(f'int main(void) {{ return 0; }} /* {message} */\n')
+        git('add', '-A', cwd=work)
+        git('commit', '-q', '-m', message, cwd=work)
+        git('push', '-q', '--force', str(bare), 'HEAD:refs/heads/master', cwd=work)
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=work, capture_output=True, text=True,
+                              check=True).stdout.strip()
+
+    bare = tmp_path / 'polybar.git'
+    subprocess.run(['git', 'init', '-q', '--bare', '--initial-branch=master', str(bare)], check=True)
+    monkeypatch.setattr(setup, 'POLYBAR_REPO', str(bare))
+    return commit
+
+
+def test_build_packages_only_the_payload_with_normalized_owners(setup, upstream):
+    commit = upstream('first')
+
+    artifact = setup.polybar_artifact()
+
+    assert artifact == setup.polybar_artifact_path(commit)
+    with tarfile.open(artifact) as tar:
+        members = {member.name: member for member in tar.getmembers()}
+    assert not any(name in ('.', './') or name.startswith('./') for name in members)
+    binary = members['usr/local/bin/polybar']
+    assert (binary.uid, binary.gid) == (0, 0)
+    assert binary.mode & 0o755 == 0o755
+    assert not (setup.POLYBAR_CACHE / 'stage').exists()
+
+
+def test_new_upstream_commits_are_fetched_into_the_existing_clone(setup, upstream):
+    upstream('first')
+    first = setup.polybar_artifact()
+    clone = setup.POLYBAR_CACHE / 'src' / '.git'
+    clone_inode = clone.stat().st_ino
+    built = first.stat().st_mtime_ns
+
+    assert setup.polybar_artifact() == first
+    assert first.stat().st_mtime_ns == built
+    commit = upstream('second')
+    second = setup.polybar_artifact()
+
+    assert second != first and second == setup.polybar_artifact_path(commit)
+    assert clone.stat().st_ino == clone_inode
+    assert sorted(path.name for path in (setup.POLYBAR_CACHE / 'artifacts').iterdir()) == sorted(
+        [first.name, second.name])
@@ -0,0 +1,179 @@
+import hashlib
+import json
+
+import pytest
+
+from conftest import QuietHandler
+
+PAYLOAD = bytes(range(256)) * 1024
+DIGEST = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+@pytest.fixture
+def fast_retry(setup, monkeypatch):
+    """A network retry policy with millisecond backoff and its own budget"""
+    policy = setup.RetryPolicy(attempts=4, base=0.001, cap=0.01, budget=setup.RetryBudget(10))
+    monkeypatch.setattr(setup, 'NETWORK_RETRY', policy)
+    return policy
+
+
+def flaky_handler(faults, requests):
+    """Serve PAYLOAD after failing one request per fault: an HTTP status, or 'cut' to drop the body midway"""
+    faults = list(faults)
+
+    class Handler(QuietHandler):
+        def do_GET(self):
+            ranged = self.headers.get('Range')
+            requests.append(ranged)
+            fault = faults.pop(0) if faults else None
+            if isinstance(fault, int):
+                self.send_response(fault)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start = int(ranged.split('=')[1].rstrip('-')) if ranged else 0
+            self.send_response(206 if ranged else 200)
+            if ranged:
+                self.send_header('Content-Range', f'bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}')
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(PAYLOAD) - start))
+            self.end_headers()
+            body = PAYLOAD[start:]
+            self.wfile.write(body[:len(body) // 2] if fault == 'cut' else body)
+
+    return Handler
+
+
+def test_backoff_stays_within_the_jittered_window_and_gives_up(setup):
+    policy = setup.RetryPolicy(attempts=3, base=0.002, cap=0.003, budget=setup.RetryBudget(10))
+
+    assert policy.wait(0, 'probe') and policy.wait(1, 'probe')
+    assert not policy.wait(2, 'probe')
+
+    count, waited = setup.RETRY_STATS['probe']
+    assert count == 2 and 0 <= waited <= 0.002 + 0.003
+
+
+def test_retry_after_sets_a_floor_capped_by_the_policy(setup):
+    policy = setup.RetryPolicy(base=0.001, cap=0.02, budget=setup.RetryBudget(10))
+
+    policy.wait(0, 'floor', retry_after=3600)
+
+    assert setup.RETRY_STATS['floor'][1] == 0.02
+
+
+def test_a_spent_budget_stops_every_policy(setup):
+    budget = setup.RetryBudget(1)
+    first, second = (setup.RetryPolicy(base=0.001, budget=budget) for _ in range(2))
+
+    assert first.wait(0, 'a')
+    assert not second.wait(0, 'b')
+
+
+def test_downloads_retry_transient_statuses(setup, serve, fast_retry, tmp_path):
+    requests = []
+    url = serve(flaky_handler([503, 429], requests)) + 'file'
+
+    assert setup.download_file(url, tmp_path / 'file', DIGEST)
+
+    assert (tmp_path / 'file').read_bytes() == PAYLOAD
+    assert len(requests) == 3
+
+
+def test_downloads_do_not_retry_permanent_statuses(setup, serve, fast_retry, tmp_path):
+    requests = []
+    url = serve(flaky_handler([404], requests)) + 'file'
+
+    assert not setup.download_file(url, tmp_path / 'file', DIGEST)
+
+    assert len(requests) == 1
+
+
+def test_dropped_transfers_resume_where_they_stopped(setup, serve, fast_retry, tmp_path):
+    requests = []
+    url = serve(flaky_handler(['cut'], requests)) + 'file'
+
+    assert setup.download_file(url, tmp_path / 'file', DIGEST)
+
+    assert (tmp_path / 'file').read_bytes() == PAYLOAD
+    assert requests == [None, f'bytes={len(PAYLOAD) // 2}-']
+
+
+def test_commands_retry_network_failures_only(setup, fake_bin, fast_retry, tmp_path):
+    fake_bin('git', f'''
+echo x >> {tmp_path}/attempts
+[ "$(wc -l < {tmp_path}/attempts)" -ge 3 ] && exit 0
+echo "fatal: unable to access: Could not resolve host: github.com" >&2
+exit 128
+''')
+    fake_bin('dnf', f'echo x >> {tmp_path}/dnf-attempts\necho "Error: Unable to find a match: nope" >&2\nexit 1\n')
+
+    setup.run_command(['git', 'fetch'], retry=fast_retry)
+    assert len((tmp_path / 'attempts').read_text().splitlines()) == 3
+
+    with pytest.raises(setup.CommandError):
+        setup.run_command(['dnf', 'install', 'nope'], retry=fast_retry)
+    assert len((tmp_path / 'dnf-attempts').read_text().splitlines()) == 1
+
+
+def test_resume_skips_completed_steps_and_restarts_at_the_failed_one(setup, tmp_path):
+    runs = []
+    broken = {'second': True}
+
+    def first():
+        runs.append('first')
+
+    def second():
+        runs.append('second')
+        if broken['second']:
+            raise RuntimeError("mirror went away")
+
+    def third():
+        runs.append('third')
+
+    steps = [setup.Step(first), setup.Step(second, requires=('first',)), setup.Step(third, requires=('second',))]
+    path = tmp_path / 'checkpoint.json'
+
+    checkpoint = setup.Checkpoint(path)
+    checkpoint.begin(resume=False)
+    with pytest.raises(RuntimeError):
+        setup.run_steps(steps, checkpoint=checkpoint)
+    saved = json.loads(path.read_text())
+    assert list(saved['completed']) == ['first']
+    assert saved['failed'] == {'step': 'second', 'error': 'mirror went away'}
+
+    broken['second'] = False
+    resumed = setup.Checkpoint(path)
+    resumed.begin(resume=True)
+    setup.run_steps(steps, checkpoint=resumed)
+    resumed.finish()
+
+    assert runs == ['first', 'second', 'second', 'third']
+    assert not path.exists()
+
+
+def test_resume_reruns_completed_steps_whose_inputs_changed(setup, tmp_path):
+    runs = []
+    version = {'value': 1}
+
+    def configure():
+        runs.append(version['value'])
+
+    def fail():
+        raise RuntimeError("boom")
+
+    steps = [setup.Step(configure, inputs=lambda: version['value']), setup.Step(fail, requires=('configure',))]
+    path = tmp_path / 'checkpoint.json'
+    checkpoint = setup.Checkpoint(path)
+    checkpoint.begin(resume=False)
+    with pytest.raises(RuntimeError):
+        setup.run_steps(steps, checkpoint=checkpoint)
+
+    version['value'] = 2
+    resumed = setup.Checkpoint(path)
+    resumed.begin(resume=True)
+    with pytest.raises(RuntimeError):
+        setup.run_steps(steps, checkpoint=resumed)
+
+    assert runs == [1, 2]
@@ -0,0 +1,85 @@
+import sys
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def wallpaper(setup):
+    """A synthetic 1600x800 wallpaper: red left half, blue right half, green band in the middle"""
+    image = Image.new('RGB', (1600, 800), (255, 0, 0))
+    image.paste((0, 0, 255), (800, 0, 1600, 800))
+    image.paste((0, 255, 0), (700, 0, 900, 800))
+    setup.WALLPAPER_PATH.parent.mkdir(parents=True)
+    image.save(setup.WALLPAPER_PATH)
+    return setup.WALLPAPER_PATH
+
+
+def test_scaling_fills_and_center_crops(setup, wallpaper, tmp_path):
+    destination = tmp_path / 'scaled.jpg'
+
+    assert setup.scale_wallpaper(wallpaper, destination, 400, 400)
+
+    with Image.open(destination) as scaled:
+        assert scaled.format == 'JPEG'
+        assert scaled.size == (400, 400)
+        # 2:1 source filled into a square keeps the middle half, the green band stays centered
+        red, green, blue = scaled.getpixel((200, 200))
+        assert green > 200 and red < 60 and blue < 60
+        assert scaled.getpixel((10, 200))[0] > 200
+        assert scaled.getpixel((390, 200))[2] > 200
+    assert not list(tmp_path.glob('.scaled.jpg*'))
+
+
+def test_prepare_makes_one_variant_per_resolution(setup, wallpaper, monkeypatch):
+    monkeypatch.setattr(setup, 'WALLPAPER_RESOLUTIONS', [(1920, 1080), (1280, 1024), (1920, 1080)])
+
+    setup.prepare_wallpaper()
+
+    variants = sorted(setup.WALLPAPER_VARIANTS.iterdir())
+    assert [path.name.split('-')[1] for path in variants] == ['1280x1024.jpg', '1920x1080.jpg']
+    heads = setup.wallpaper_heads()
+    assert [Image.open(head).size for head in heads] == [(1920, 1080), (1280, 1024), (1920, 1080)]
+
+
+def test_prepared_variants_are_reused(setup, wallpaper, monkeypatch):
+    monkeypatch.setattr(setup, 'WALLPAPER_RESOLUTIONS', [(800, 600)])
+    setup.prepare_wallpaper()
+    [variant] = setup.WALLPAPER_VARIANTS.iterdir()
+    mtime = variant.stat().st_mtime_ns
+
+    setup.prepare_wallpaper()
+
+    assert variant.stat().st_mtime_ns == mtime
+
+
+def test_variants_live_outside_the_cache_and_follow_the_wallpaper(setup, wallpaper, monkeypatch):
+    monkeypatch.setattr(setup, 'WALLPAPER_RESOLUTIONS', [(800, 600)])
+    setup.prepare_wallpaper()
+    [old] = setup.WALLPAPER_VARIANTS.iterdir()
+    assert setup.CACHE_DIR not in old.parents
+
+    Image.new('RGB', (1600, 800), (0, 0, 0)).save(wallpaper)
+    setup.prepare_wallpaper()
+
+    [new] = setup.WALLPAPER_VARIANTS.iterdir()
+    assert new != old and setup.wallpaper_heads() == [new]
+
+
+def test_nitrogen_gets_one_section_per_differing_head(setup, wallpaper, monkeypatch):
+    monkeypatch.setattr(setup, 'WALLPAPER_RESOLUTIONS', [(1920, 1080), (1280, 1024)])
+    setup.prepare_wallpaper()
+
+    setup.create_nitrogen_config()
+
+    bg_saved = (setup.Path.home() / '.config' / 'nitrogen' / 'bg-saved.cfg').read_text()
+    assert '[xin_0]' in bg_saved and '[xin_1]' in bg_saved and '[xin_-1]' not in bg_saved
+
+
+def test_without_pillow_or_imagemagick_the_original_is_kept(setup, wallpaper, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'PIL', None)
+    monkeypatch.setenv('PATH', str(tmp_path / 'empty'))
+
+    assert not setup.scale_wallpaper(wallpaper, tmp_path / 'scaled.jpg', 400, 400)
+    assert setup.wallpaper_heads() == [wallpaper]